@@ -1,18 +1,27 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Request
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, status, Request
+from fastapi.encoders import jsonable_encoder
 from fastapi.responses import Response
 from typing import Dict, Any, List
+import asyncio
 import uuid
 from datetime import datetime
 import csv
 from io import StringIO
 
-from app.core.models import TransactionCreate, TransactionResponse, ErrorResponse, RuleCreate, RuleResponse
+from app.core.models import (
+    TransactionCreate, TransactionResponse, TransactionDecision, ErrorResponse, RuleCreate, RuleResponse, DeadLetterReplay
+)
 from app.core.logging import get_logger
+from app.core.metrics import score_latency
 from app.db.database import SessionLocal, get_db
 from app.db.models import Transaction, Rule, RuleResult
-from app.services.transaction_service import create_transaction, get_transaction_stats, get_all_transactions
+from app.db.redis import redis_client
+from app.services.transaction_service import (
+    create_transaction, get_transaction_stats, get_all_transactions, update_transactions_status
+)
 from app.services.rule_service import load_rules_from_db
 from app.services.analytics_service import get_dashboard_data
+from app.services.admission_service import QUEUED, REJECTED, SYNC, admission_controller
 from sqlalchemy.orm import Session
 
 logger = get_logger(__name__)
@@ -27,32 +36,56 @@ router = APIRouter()
 )
 async def create_transaction_endpoint(transaction: TransactionCreate, request: Request, db: Session = Depends(get_db)):
     """
-    Создание новой транзакции
+    Создание новой транзакции и постановка её в очередь на оценку.
+    При переполненной очереди — 429 с Retry-After или, для крупных сумм,
+    оценка сразу в запросе (см. admission_service).
     """
     correlation_id = request.headers.get("X-Correlation-ID", "unknown")
     
+    # Генерируем ID для транзакции
+    transaction_id = str(uuid.uuid4())
+    # Транзакция в том виде, в каком её получит воркер из очереди
+    queued_data = jsonable_encoder(transaction)
+    queued_data.update(id=transaction_id, correlation_id=correlation_id)
+
+    # Решение принимается до записи в БД: отклонённая транзакция не сохраняется
+    decision = await admission_controller.admit(queued_data)
+    if decision == REJECTED:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=ErrorResponse(
+                error="QueueOverloaded",
+                message="Transaction queue is over capacity, retry later",
+                correlation_id=correlation_id
+            ).dict(),
+            headers={"Retry-After": str(admission_controller.retry_after)}
+        )
+    
     try:
         logger.info(f"Creating transaction - Correlation ID: {correlation_id}")
         
-        # Генерируем ID для транзакции
-        transaction_id = str(uuid.uuid4())
-        
-        # Создаем объект ответа
-        transaction_response = TransactionResponse(
-            id=transaction_id,
-            correlation_id=correlation_id,
-            status="received",
-            **transaction.dict()
-        )
-        
         # Сохраняем в БД
         transaction_data = transaction.dict()
         transaction_data["transaction_id"] = transaction_id
         db_transaction = create_transaction(transaction_data)
+
+        transaction_status = "received"
+        if decision == QUEUED and not await redis_client.push_transaction(queued_data):
+            # Без очереди транзакция осталась бы в received навсегда
+            logger.warning(f"Queue unavailable, scoring transaction {transaction_id} synchronously")
+            decision = SYNC
+        if decision == SYNC:
+            transaction_status = await score_transaction(queued_data)
         
-        logger.info(f"Transaction created successfully - ID: {transaction_id}")
+        logger.info(f"Transaction created successfully - ID: {transaction_id}, status: {transaction_status}")
         
-        return transaction_response
+        # Создаем объект ответа
+        return TransactionResponse(
+            id=transaction_id,
+            correlation_id=correlation_id,
+            status=transaction_status,
+            **transaction.dict()
+        )
         
     except Exception as e:
         logger.error(f"Error creating transaction: {e}")
@@ -65,6 +98,85 @@ async def create_transaction_endpoint(transaction: TransactionCreate, request: R
             ).dict()
         )
 
+
+async def score_transaction(transaction_data: Dict[str, Any]) -> str:
+    """Оценка в запросе, минуя очередь; результат сохраняется как у воркера"""
+    from app.rules.rule_engine import rule_engine
+    from app.workers.transaction_worker import worker
+
+    evaluation_result = await rule_engine.evaluate_transaction_async(transaction_data, lean=True)
+    if not await asyncio.to_thread(worker.complete_transaction, transaction_data, evaluation_result):
+        raise RuntimeError(f"Failed to save evaluation of transaction {transaction_data['id']}")
+    return worker.determine_status(evaluation_result)
+
+
+def save_scored_transaction(
+    transaction_data: Dict[str, Any],
+    scored_data: Dict[str, Any],
+    evaluation_result: Dict[str, Any]
+):
+    """Сохранение после ответа /transactions/score: транзакция, результаты правил, статус"""
+    from app.workers.transaction_worker import worker
+
+    try:
+        create_transaction(transaction_data)
+    except Exception as e:
+        logger.error(f"Failed to save scored transaction {scored_data['id']}: {e}")
+        return
+    worker.complete_transaction(scored_data, evaluation_result)
+
+
+@router.post(
+    "/transactions/score",
+    response_model=TransactionDecision
+)
+async def score_transaction_endpoint(
+    transaction: TransactionCreate,
+    request: Request,
+    background_tasks: BackgroundTasks
+):
+    """
+    Синхронная оценка: правила выполняются в запросе, решение возвращается
+    сразу. Очередь не используется, транзакция и результаты правил
+    сохраняются в БД уже после ответа.
+    """
+    from app.rules.rule_engine import rule_engine
+    from app.workers.transaction_worker import worker
+
+    correlation_id = request.headers.get("X-Correlation-ID", "unknown")
+    transaction_id = str(uuid.uuid4())
+    scored_data = jsonable_encoder(transaction)
+    scored_data.update(id=transaction_id, correlation_id=correlation_id)
+
+    try:
+        with score_latency.time():
+            evaluation_result = await rule_engine.evaluate_transaction_async(scored_data, lean=True)
+    except Exception as e:
+        logger.error(f"Error scoring transaction: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=ErrorResponse(
+                error="InternalServerError",
+                message="Failed to score transaction",
+                correlation_id=correlation_id
+            ).dict()
+        )
+
+    transaction_data = transaction.dict()
+    transaction_data["transaction_id"] = transaction_id
+    background_tasks.add_task(save_scored_transaction, transaction_data, scored_data, evaluation_result)
+
+    return TransactionDecision(
+        id=transaction_id,
+        correlation_id=correlation_id,
+        status=worker.determine_status(evaluation_result),
+        is_suspicious=evaluation_result["is_suspicious"],
+        risk_score=evaluation_result["risk_score"],
+        triggered_rules=evaluation_result["triggered_rules"],
+        degraded_rules=evaluation_result.get("degraded_rules", []),
+        rule_set_version=evaluation_result["rule_set_version"]
+    )
+
 @router.get(
     "/transactions/{transaction_id}",
     response_model=TransactionResponse
@@ -163,6 +275,42 @@ async def get_transaction_admin(transaction_id: str, db: Session = Depends(get_d
         ]
     }
 
+@router.get("/admin/dead-letters")
+async def get_dead_letters_admin(offset: int = 0, limit: int = 100):
+    """
+    Транзакции в DLQ (исчерпали попытки обработки) с ошибками всех попыток, новые первыми
+    """
+    try:
+        dead_letters = await redis_client.get_dead_letters(offset=max(offset, 0), limit=min(max(limit, 1), 1000))
+    except Exception as e:
+        logger.error(f"Failed to read dead-letter queue: {e}")
+        raise HTTPException(status_code=503, detail="Queue storage unavailable")
+    return {
+        "dead_letters": dead_letters["items"],
+        "total": dead_letters["total"]
+    }
+
+@router.post("/admin/dead-letters/replay")
+async def replay_dead_letters_admin(replay: DeadLetterReplay):
+    """
+    Вернуть транзакции из DLQ в очередь (все или выбранные) со сброшенным счётчиком попыток
+    """
+    try:
+        replayed = await redis_client.replay_dead_letters(replay.transaction_ids, replay.limit)
+    except Exception as e:
+        logger.error(f"Failed to replay dead-letter queue: {e}")
+        raise HTTPException(status_code=503, detail="Queue storage unavailable")
+    try:
+        # Только ещё failed: воркер мог успеть выставить итоговый статус
+        await asyncio.to_thread(update_transactions_status, replayed, "received", "failed")
+    except Exception as e:
+        # Транзакции уже в очереди: воркер всё равно выставит итоговый статус
+        logger.warning(f"Failed to reset status of replayed transactions: {e}")
+    return {
+        "replayed": len(replayed),
+        "transaction_ids": replayed
+    }
+
 @router.get("/admin/rules")
 async def get_rules_admin(db: Session = Depends(get_db)):
     """
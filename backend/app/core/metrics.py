@@ -0,0 +1,338 @@
+"""
+Метрики в формате Prometheus.
+Значения копятся в собственных счётчиках, gauge и гистограммах с метками:
+обновления не берут блокировок — в горячем пути это одна-две арифметические
+операции, небольшая потеря точности при гонках потоков допустима. Экспозицию
+строит prometheus_client: реестр отдаёт ему семейства как коллектор.
+"""
+import time
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Sequence, Tuple
+
+from prometheus_client import generate_latest
+from prometheus_client.core import (
+    CounterMetricFamily,
+    GaugeMetricFamily,
+    HistogramMetricFamily,
+    Metric,
+)
+from prometheus_client.utils import floatToGoString
+
+# Границы по умолчанию, секунды: от 50 мкс до 2.5 с
+DEFAULT_BUCKETS = (
+    0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025,
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5,
+)
+
+
+class _CounterChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+    def drain(self) -> float:
+        value, self.value = self.value, 0.0
+        return value
+
+    def merge(self, value: float):
+        self.value += value
+
+
+class _GaugeChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def set(self, value: float):
+        self.value = value
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+    def dec(self, amount: float = 1.0):
+        self.value -= amount
+
+
+class _HistogramChild:
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def observe_many(self, total: float, n: int):
+        """n наблюдений с суммарным временем total (пакетная оценка)"""
+        if n <= 0:
+            return
+        self.counts[bisect_left(self.bounds, total / n)] += n
+        self.sum += total
+        self.count += n
+
+    def drain(self) -> Tuple[List[int], float, int]:
+        state = (self.counts, self.sum, self.count)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+        return state
+
+    def merge(self, state: Tuple[List[int], float, int]):
+        counts, total, n = state
+        for i, count in enumerate(counts):
+            self.counts[i] += count
+        self.sum += total
+        self.count += n
+
+    @contextmanager
+    def time(self):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started)
+
+
+class _Family(ABC):
+    """Семейство метрик с одинаковым именем и набором меток"""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+
+    @abstractmethod
+    def _new_child(self):
+        """Новое значение для набора меток"""
+
+    def labels(self, *values):
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}")
+            child = self._children[key] = self._new_child()
+        return child
+
+    def drain(self) -> Dict[Tuple[str, ...], Any]:
+        """Накопленные значения по наборам меток; счётчики обнуляются"""
+        return {key: child.drain() for key, child in list(self._children.items())}
+
+    def merge(self, states: Dict[Tuple[str, ...], Any]):
+        """Добавляет значения, снятые drain в другом процессе"""
+        for key, state in states.items():
+            self.labels(*key).merge(state)
+
+    @abstractmethod
+    def collect(self) -> Metric:
+        """Текущие значения семейства для prometheus_client"""
+
+
+class Counter(_Family):
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1.0):
+        self.labels().inc(amount)
+
+    def collect(self) -> Metric:
+        family = CounterMetricFamily(self.name, self.documentation, labels=self.labelnames)
+        for key, child in list(self._children.items()):
+            family.add_metric(key, child.value)
+        return family
+
+
+class Gauge(Counter):
+    def _new_child(self):
+        return _GaugeChild()
+
+    def set(self, value: float):
+        self.labels().set(value)
+
+    def collect(self) -> Metric:
+        family = GaugeMetricFamily(self.name, self.documentation, labels=self.labelnames)
+        for key, child in list(self._children.items()):
+            family.add_metric(key, child.value)
+        return family
+
+
+class Histogram(_Family):
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.bounds = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.bounds)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def time(self):
+        return self.labels().time()
+
+    def collect(self) -> Metric:
+        family = HistogramMetricFamily(self.name, self.documentation, labels=self.labelnames)
+        bounds = [floatToGoString(bound) for bound in self.bounds + (float("inf"),)]
+        for key, child in list(self._children.items()):
+            cumulative, buckets = 0, []
+            for bound, count in zip(bounds, child.counts):
+                cumulative += count
+                buckets.append((bound, cumulative))
+            family.add_metric(key, buckets, child.sum)
+        return family
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._families: Dict[str, _Family] = {}
+
+    def _register(self, family: _Family) -> _Family:
+        existing = self._families.get(family.name)
+        if existing is not None:
+            return existing
+        self._families[family.name] = family
+        return family
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS
+    ) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def collect(self) -> Iterator[Metric]:
+        """Интерфейс коллектора prometheus_client"""
+        for family in list(self._families.values()):
+            yield family.collect()
+
+    def render(self) -> str:
+        return generate_latest(self).decode("utf-8")
+
+
+registry = MetricsRegistry()
+
+# --- Движок правил ---
+rule_latency = registry.histogram(
+    "rule_evaluation_seconds", "Rule evaluation latency", ("rule_id", "rule_name")
+)
+rule_errors = registry.counter(
+    "rule_errors_total", "Rule evaluation errors", ("rule_id", "rule_name")
+)
+rule_triggers = registry.counter(
+    "rule_triggered_total", "Rule evaluations that triggered", ("rule_id", "rule_name")
+)
+rule_degraded = registry.counter(
+    "rule_degraded_total",
+    "Rule evaluations over budget, replaced by fallback or skipped (timeout, bypassed, deadline)",
+    ("rule_id", "rule_name", "reason")
+)
+# Метрики правил, которые процессы пула (WORKER_MODE=process) передают родителю
+_RULE_FAMILIES = (rule_latency, rule_errors, rule_triggers, rule_degraded)
+score_latency = registry.histogram(
+    "transaction_score_seconds", "Synchronous scoring latency (/transactions/score, persistence excluded)"
+)
+
+# --- Очередь и воркер ---
+queue_length = registry.gauge("transaction_queue_length", "Transactions waiting in the queue")
+queue_pending = registry.gauge(
+    "transaction_queue_pending", "Transactions delivered to consumers and not yet acknowledged"
+)
+queue_lane_length = registry.gauge(
+    "transaction_queue_lane_length", "Transactions waiting per queue lane", ("lane",)
+)
+queue_wait = registry.histogram(
+    "transaction_queue_wait_seconds", "Time from enqueue to delivery to a worker", ("lane",)
+)
+queue_requeued = registry.counter(
+    "transaction_queue_requeued_total", "Unacknowledged transactions returned to the queue"
+)
+queue_retrying = registry.gauge("transaction_queue_retrying", "Failed transactions waiting for a delayed retry")
+queue_dead = registry.gauge("transaction_queue_dead_letters", "Transactions in the dead-letter queue")
+queue_retried = registry.counter(
+    "transaction_queue_retried_total", "Failed transactions scheduled for a delayed retry"
+)
+queue_dead_lettered = registry.counter(
+    "transaction_queue_dead_lettered_total", "Transactions moved to the dead-letter queue after the last attempt"
+)
+admission_decisions = registry.counter(
+    "ingest_admission_total", "Ingest admission decisions (queued, sync, rejected)", ("decision",)
+)
+worker_processed = registry.counter("worker_processed_total", "Transactions processed by the worker")
+worker_failed = registry.counter("worker_failed_total", "Transactions the worker failed to process")
+worker_batch_size = registry.histogram(
+    "worker_batch_size", "Transactions taken from the queue per worker wakeup",
+    buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)
+)
+
+# --- Хранилища ---
+db_latency = registry.histogram("db_query_seconds", "Database statement latency")
+redis_latency = registry.histogram("redis_command_seconds", "Redis call latency", ("operation",))
+redis_pool_connections = registry.gauge(
+    "redis_pool_connections", "Redis pool connections by state (in_use, idle)", ("pool", "state")
+)
+redis_pool_max_connections = registry.gauge(
+    "redis_pool_max_connections", "Redis pool size limit", ("pool",)
+)
+
+
+class RuleStats:
+    """Метрики одного правила; снимок правил держит их рядом с планом"""
+    __slots__ = ("rule_id", "rule_name", "latency", "errors", "triggers")
+
+    def __init__(self, rule_id: int, rule_name: str):
+        self.rule_id = rule_id
+        self.rule_name = rule_name
+        self.latency = rule_latency.labels(rule_id, rule_name)
+        self.errors = rule_errors.labels(rule_id, rule_name)
+        self.triggers = rule_triggers.labels(rule_id, rule_name)
+
+    def degraded(self, reason: str, amount: float = 1.0):
+        rule_degraded.labels(self.rule_id, self.rule_name, reason).inc(amount)
+
+
+def drain_rule_metrics() -> Dict[str, Dict[Tuple[str, ...], Any]]:
+    """
+    Снимает накопленные метрики правил с обнулением. Процесс пула отдаёт
+    их вместе с оценкой пачки, родитель добавляет через merge_rule_metrics.
+    """
+    return {family.name: family.drain() for family in _RULE_FAMILIES}
+
+
+def merge_rule_metrics(drained: Dict[str, Dict[Tuple[str, ...], Any]]):
+    """Добавляет метрики правил, снятые drain_rule_metrics в процессе пула"""
+    for family in _RULE_FAMILIES:
+        states = drained.get(family.name)
+        if states:
+            family.merge(states)
+
+
+def render_metrics() -> str:
+    """Все метрики в текстовом формате Prometheus"""
+    return registry.render()
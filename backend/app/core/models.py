@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field, validator
-from typing import Optional, Literal, Dict, Any
+from typing import Optional, Literal, Dict, Any, List
 from datetime import datetime, timezone
 from decimal import Decimal
 
@@ -12,6 +12,7 @@ class TransactionCreate(BaseModel):
     user_id: str = Field(..., description="ID пользователя")
     timestamp: datetime = Field(..., description="Временная метка транзакции")
     description: Optional[str] = Field(None, description="Описание транзакции")
+    merchant_category: Optional[str] = Field(None, description="Категория магазина (для полос очереди и правил)")
     
     @validator('timestamp')
     def validate_timestamp_not_in_future(cls, v):
@@ -57,6 +58,20 @@ class TransactionResponse(BaseModel):
             Decimal: lambda v: float(v)
         }
 
+class TransactionDecision(BaseModel):
+    """Решение синхронной оценки (/transactions/score)"""
+    
+    id: str = Field(..., description="Уникальный идентификатор транзакции")
+    correlation_id: str = Field(..., description="ID для трассировки запроса")
+    status: Literal["approved", "suspicious", "blocked"] = Field(..., description="Решение по транзакции")
+    is_suspicious: bool = Field(..., description="Сработало хотя бы одно правило")
+    risk_score: float = Field(..., description="Итоговый риск-скор")
+    triggered_rules: List[str] = Field(default_factory=list, description="Сработавшие правила")
+    degraded_rules: List[Dict[str, Any]] = Field(
+        default_factory=list, description="Правила, не уложившиеся в бюджет времени"
+    )
+    rule_set_version: int = Field(..., description="Версия набора правил")
+
 class ErrorResponse(BaseModel):
     """Модель для ошибок API"""
     
@@ -69,7 +84,7 @@ class RuleCreate(BaseModel):
     """Модель для создания правила"""
     name: str = Field(..., min_length=1, max_length=100)
     description: Optional[str] = Field(None)
-    type: str = Field(..., description="Тип правила: threshold, pattern, composite, ml")
+    type: str = Field(..., description="Тип правила: threshold, pattern, composite, ml, velocity")
     condition: str = Field(..., description="Условие правила в JSON")
     risk_score: int = Field(..., ge=1, le=100)
     is_active: bool = Field(True)
@@ -85,4 +100,9 @@ class RuleResponse(BaseModel):
     risk_score: int
     is_active: bool
     priority: int
-    created_at: datetime
\ No newline at end of file
+    created_at: datetime
+
+class DeadLetterReplay(BaseModel):
+    """Запрос повторной постановки записей DLQ в очередь"""
+    transaction_ids: Optional[List[str]] = Field(None, description="Только эти транзакции; по умолчанию — все")
+    limit: int = Field(default=1000, ge=1, le=10000, description="Сколько записей вернуть за запрос, старые первыми")
@@ -1,7 +1,9 @@
 import os
-from sqlalchemy import create_engine
+import time
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker, declarative_base
 from sqlalchemy.pool import QueuePool
+from app.core.metrics import db_latency
 
 # Используем переменную окружения для Docker или локальную для разработки
 DATABASE_URL = os.getenv(
@@ -18,6 +20,17 @@ engine = create_engine(
     echo=False  # Логирование SQL-запросов (True для отладки)
 )
 
+# Латентность SQL-запросов для /metrics
+@event.listens_for(engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+@event.listens_for(engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info["query_started"].pop()
+    db_latency.observe(time.perf_counter() - started)
+
 # Создаем фабрику сессий
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
@@ -30,4 +43,9 @@ def get_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+
+def close_database():
+    """Закрывает соединения пула БД (остановка приложения или воркера)"""
+    engine.dispose()
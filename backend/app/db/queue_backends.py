@@ -0,0 +1,522 @@
+"""
+Режимы хранения очереди транзакций (QUEUE_MODE): как транзакции ставятся
+в очередь (push), выдаются потребителю пачкой (pop), подтверждаются (ack)
+и возвращаются после сбоя потребителя (release, requeue_expired).
+RedisClient (app.db.redis) выбирает режим по QUEUE_BACKENDS и оставляет
+себе общее для всех режимов: сериализацию, повторы, DLQ и метрики.
+"""
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List, Optional, Tuple
+
+from redis.exceptions import ResponseError
+
+from app.core.logging import get_logger
+from app.core.metrics import queue_requeued, redis_latency
+from app.db.queue_lanes import DEFAULT_LANE, QueueLane
+from app.db.queue_scripts import CLAIM_SCRIPT, LANES_CLAIM_SCRIPT, REQUEUE_LANES_SCRIPT, REQUEUE_SCRIPT
+
+logger = get_logger(__name__)
+
+# Сигналов в звонке не больше, чем нужно, чтобы разбудить всех потребителей
+DOORBELL_MAX = 1000
+
+# Элемент пачки: (квитанция для ack или None, JSON транзакции, полоса)
+QueueEntry = Tuple[Optional[str], Optional[str], str]
+
+
+class QueueBackend(ABC):
+    """
+    Режим очереди поверх RedisClient: клиент, ключи, полосы и скрипты
+    берутся у него (queue), режим хранит только своё состояние.
+    """
+    mode = ""
+    # LMOVE/BLMOVE (reliable) и XAUTOCLAIM (stream) появились в Redis 6.2
+    min_server_version: Optional[Tuple[int, int]] = None
+    # Операция для redis_command_seconds при чтении длины очереди
+    depth_operation = "llen"
+
+    def __init__(self, queue: "RedisClient"):
+        self.queue = queue
+
+    @property
+    def move_mode(self) -> str:
+        """Куда MOVE_TO_QUEUE_SCRIPT ставит транзакции: list, lanes или stream"""
+        return "lanes" if self.queue.lanes.enabled else "list"
+
+    @abstractmethod
+    def lane_key(self, lane: QueueLane) -> str:
+        """Ключ полосы; у полосы default — прежний ключ очереди"""
+
+    @abstractmethod
+    async def push(self, key: str, transaction_json: str) -> Dict[str, Any]:
+        """Ставит транзакцию в полосу key; подробности для лога"""
+
+    @abstractmethod
+    async def pop(self, max_items: int, timeout: float, consumer_id: str) -> List[QueueEntry]:
+        """Пачка до max_items: первая транзакция ожидается до timeout секунд"""
+
+    async def ack(self, receipts: List[str], consumer_id: str):
+        """Подтверждает обработку транзакций по квитанциям"""
+
+    async def release(self, consumer_id: str) -> int:
+        """Возвращает неподтверждённое потребителем; число транзакций"""
+        return 0
+
+    async def requeue_expired(self) -> int:
+        """Возвращает в очередь транзакции потребителей с истёкшей арендой"""
+        return 0
+
+    async def ready(self):
+        """Подготовка ключей перед чтением статистики"""
+
+    def queue_depth(self, pipe):
+        """Ставит в конвейер чтение длины полос"""
+        for lane in self.queue.lanes.lanes:
+            pipe.llen(self.lane_key(lane))
+
+    def lane_depths(self, replies: List[Any]) -> List[Tuple[int, int]]:
+        """(ждут выдачи, выданы без подтверждения) по полосам из ответов queue_depth"""
+        return [(int(length), 0) for length in replies]
+
+    async def pending(self) -> Optional[int]:
+        """Выданные потребителям и не подтверждённые; None — уже посчитаны в lane_depths"""
+        return None
+
+
+class SimpleQueue(QueueBackend):
+    """
+    simple (по умолчанию) — прежний RPOP без подтверждений: BRPOP первой
+    транзакции и RPOP остальных. С полосами пачка набирается
+    LANES_CLAIM_SCRIPT, ожидание нескольких полос — блокирующее чтение
+    звонка (doorbell), в который каждая постановка добавляет сигнал.
+    """
+    mode = "simple"
+    # Выданное остаётся в списке обработки до ack
+    acknowledged = False
+
+    def lane_key(self, lane: QueueLane) -> str:
+        base = self.queue.queue_key
+        return base if lane.name == DEFAULT_LANE else f"{base}:lane:{lane.name}"
+
+    def processing_key(self, consumer_id: str) -> str:
+        return f"{self.queue.queue_key}:processing:{consumer_id}"
+
+    def lease_key(self, consumer_id: str) -> str:
+        return f"{self.queue.queue_key}:lease:{consumer_id}"
+
+    async def push(self, key: str, transaction_json: str) -> Dict[str, Any]:
+        queue = self.queue
+        if queue.lanes.enabled:
+            # Транзакция и сигнал звонка — атомарно (MULTI)
+            pipe = queue.client.pipeline(transaction=True)
+            pipe.lpush(key, transaction_json)
+            pipe.lpush(queue.doorbell_key, "1")
+            pipe.ltrim(queue.doorbell_key, 0, DOORBELL_MAX - 1)
+            with redis_latency.labels("lpush").time():
+                result = (await pipe.execute())[0]
+        else:
+            with redis_latency.labels("lpush").time():
+                result = await queue.client.lpush(key, transaction_json)
+        return {"queue_length": result}
+
+    async def pop(self, max_items: int, timeout: float, consumer_id: str) -> List[QueueEntry]:
+        if self.queue.lanes.enabled:
+            return await self._claim_lanes(max_items, timeout, consumer_id)
+        return [(None, item, DEFAULT_LANE) for item in await self._pop(max_items, timeout)]
+
+    async def _pop(self, max_items: int, timeout: float) -> List[str]:
+        """BRPOP первой транзакции и RPOP с count для остальных"""
+        client = self.queue.client
+        queue_key = self.queue.queue_key
+        with redis_latency.labels("brpop").time():
+            popped = await client.brpop([queue_key], timeout=timeout)
+        if not popped:
+            return []
+        items = [popped[1]]
+        if max_items > 1:
+            with redis_latency.labels("rpop").time():
+                rest = await client.rpop(queue_key, max_items - 1)
+            items.extend(rest or [])
+        return items
+
+    async def _lease(self, consumer_id: str) -> int:
+        """Аренда списка обработки в мс; 0 — выданное сразу снимается с очереди"""
+        return 0
+
+    async def _claim_lanes(self, max_items: int, timeout: float, consumer_id: str) -> List[QueueEntry]:
+        """
+        LANES_CLAIM_SCRIPT по плану полос; если все полосы пусты — ожидание
+        сигнала звонка (BRPOP) до timeout и повторная выборка.
+        С арендой (reliable) элементы переносятся в список обработки.
+        """
+        lease_ms = await self._lease(consumer_id)
+        items = await self._take_lanes(max_items, lease_ms, consumer_id)
+        if not items:
+            with redis_latency.labels("brpop").time():
+                signal = await self.queue.client.brpop([self.queue.doorbell_key], timeout=timeout)
+            if signal:
+                items = await self._take_lanes(max_items, lease_ms, consumer_id)
+
+        entries = []
+        for item in items:
+            lane, raw = item.split("|", 1)
+            entries.append((item if self.acknowledged else None, raw, lane))
+        return entries
+
+    async def _take_lanes(self, max_items: int, lease_ms: int, consumer_id: str) -> List[str]:
+        queue = self.queue
+        plan = queue.lanes.plan(max_items)
+        lanes = [queue.lanes.lanes[index] for index, _ in plan]
+        with redis_latency.labels("claim").time():
+            counts, items = await queue._script(LANES_CLAIM_SCRIPT)(
+                keys=[self.processing_key(consumer_id), self.lease_key(consumer_id), queue.doorbell_key]
+                + [self.lane_key(lane) for lane in lanes],
+                args=[max_items, lease_ms]
+                + [lane.name for lane in lanes]
+                + [quota for _, quota in plan]
+            )
+        queue.lanes.served([index for (index, _), count in zip(plan, counts) if int(count) >= 0])
+        return items or []
+
+    async def ack(self, receipts: List[str], consumer_id: str):
+        pipe = self.queue.client.pipeline(transaction=False)
+        processing_key = self.processing_key(consumer_id)
+        for item in receipts:
+            # Новые элементы списка — слева, подтверждаемые обычно старые: ищем справа
+            pipe.lrem(processing_key, -1, item)
+        with redis_latency.labels("ack").time():
+            await pipe.execute()
+
+
+class ReliableQueue(SimpleQueue):
+    """
+    reliable — at-least-once на списках: извлечённые транзакции переносятся
+    в список обработки потребителя и удаляются из него только подтверждением
+    (ack) после сохранения. Пока потребитель жив, он продлевает аренду
+    (QUEUE_VISIBILITY_TIMEOUT); транзакции потребителя с истёкшей арендой
+    любой воркер возвращает в очередь (requeue_expired).
+    """
+    mode = "reliable"
+    min_server_version = (6, 2)
+    acknowledged = True
+
+    def __init__(self, queue: "RedisClient"):
+        super().__init__(queue)
+        self.consumers_key = f"{queue.queue_key}:consumers"
+
+    async def pop(self, max_items: int, timeout: float, consumer_id: str) -> List[QueueEntry]:
+        if self.queue.lanes.enabled:
+            return await self._claim_lanes(max_items, timeout, consumer_id)
+        return [(item, item, DEFAULT_LANE) for item in await self._claim(max_items, timeout, consumer_id)]
+
+    async def _claim(self, max_items: int, timeout: float, consumer_id: str) -> List[str]:
+        """BLMOVE первой транзакции в список обработки и CLAIM_SCRIPT для остальных"""
+        queue = self.queue
+        processing_key = self.processing_key(consumer_id)
+        lease_ms = await self._lease(consumer_id)
+
+        with redis_latency.labels("blmove").time():
+            first = await queue.client.blmove(queue.queue_key, processing_key, timeout, "RIGHT", "LEFT")
+        if first is None:
+            return []
+        items = [first]
+        if max_items > 1:
+            with redis_latency.labels("claim").time():
+                rest = await queue._script(CLAIM_SCRIPT)(
+                    keys=[queue.queue_key, processing_key, self.lease_key(consumer_id)],
+                    args=[max_items - 1, lease_ms]
+                )
+            items.extend(rest or [])
+        return items
+
+    async def _lease(self, consumer_id: str) -> int:
+        """
+        Продлевает аренду потребителя до ожидания (ожидание не должно её
+        истечь) и регистрирует его. Возвращает аренду в мс.
+        """
+        lease_ms = int(self.queue.visibility_timeout * 1000)
+        pipe = self.queue.client.pipeline(transaction=False)
+        pipe.set(self.lease_key(consumer_id), "1", px=lease_ms)
+        pipe.sadd(self.consumers_key, consumer_id)
+        await pipe.execute()
+        return lease_ms
+
+    async def _requeue(self, consumer_id: str, force: bool) -> int:
+        queue = self.queue
+        if queue.lanes.enabled:
+            moved = await queue._script(REQUEUE_LANES_SCRIPT)(
+                keys=[
+                    self.processing_key(consumer_id),
+                    self.lease_key(consumer_id),
+                    self.consumers_key,
+                    queue.doorbell_key
+                ] + [self.lane_key(lane) for lane in queue.lanes.lanes],
+                args=[consumer_id, "1" if force else "0"] + [lane.name for lane in queue.lanes.lanes]
+            )
+        else:
+            moved = await queue._script(REQUEUE_SCRIPT)(
+                keys=[
+                    self.processing_key(consumer_id),
+                    queue.queue_key,
+                    self.lease_key(consumer_id),
+                    self.consumers_key
+                ],
+                args=[consumer_id, "1" if force else "0"]
+            )
+        moved = int(moved)
+        if moved > 0:
+            queue_requeued.inc(moved)
+            logger.warning(
+                "Requeued unacknowledged transactions",
+                extra={"extra_data": {"consumer_id": consumer_id, "count": moved}}
+            )
+        return max(moved, 0)
+
+    async def release(self, consumer_id: str) -> int:
+        return await self._requeue(consumer_id, force=True)
+
+    async def requeue_expired(self) -> int:
+        """Потребители этого процесса пропускаются: их аренду продлевает он сам"""
+        own = self.queue.consumer_id
+        consumers = await self.queue.client.smembers(self.consumers_key)
+        moved = 0
+        for consumer_id in consumers:
+            if consumer_id != own and not consumer_id.startswith(f"{own}:"):
+                moved += await self._requeue(consumer_id, force=False)
+        return moved
+
+    async def pending(self) -> Optional[int]:
+        consumers = await self.queue.client.smembers(self.consumers_key)
+        pipe = self.queue.client.pipeline(transaction=False)
+        for consumer_id in consumers:
+            pipe.llen(self.processing_key(consumer_id))
+        return sum(await pipe.execute())
+
+
+class StreamQueue(QueueBackend):
+    """
+    stream — Redis Streams с группой потребителей QUEUE_GROUP: каждая запись
+    выдаётся одному потребителю группы, подтверждается XACK, записи, не
+    подтверждённые за QUEUE_VISIBILITY_TIMEOUT, забирает XAUTOCLAIM; видно
+    отставание группы (lag) и число выданных неподтверждённых (pending).
+    У каждой полосы свой поток. Квитанция записи — "полоса|id".
+    """
+    mode = "stream"
+    min_server_version = (6, 2)
+    depth_operation = "xinfo"
+
+    def __init__(self, queue: "RedisClient"):
+        super().__init__(queue)
+        self.stream_key = f"{queue.queue_key}:stream"
+        self.group = queue.group
+        self._group_ready = False
+        # Потребители, которым нужно заново выдать их неподтверждённые записи потока
+        self._replay: set = set()
+        self._next_autoclaim: Dict[str, float] = {}
+
+    @property
+    def move_mode(self) -> str:
+        return "stream"
+
+    def lane_key(self, lane: QueueLane) -> str:
+        return self.stream_key if lane.name == DEFAULT_LANE else f"{self.stream_key}:{lane.name}"
+
+    async def push(self, key: str, transaction_json: str) -> Dict[str, Any]:
+        with redis_latency.labels("xadd").time():
+            result = await self.queue.client.xadd(key, {"data": transaction_json})
+        return {"stream_id": result}
+
+    def _lane_streams(self) -> Dict[str, str]:
+        """{поток полосы: имя полосы}"""
+        return {self.lane_key(lane): lane.name for lane in self.queue.lanes.lanes}
+
+    async def _ensure_group(self):
+        """Группа потребителей (и потоки полос) создаются при первом обращении"""
+        if self._group_ready:
+            return
+        for stream_key in self._lane_streams():
+            try:
+                # id=0: записи, добавленные до создания группы, тоже будут прочитаны
+                await self.queue.client.xgroup_create(stream_key, self.group, id="0", mkstream=True)
+            except ResponseError as e:
+                if "BUSYGROUP" not in str(e):
+                    raise
+        self._group_ready = True
+
+    async def ready(self):
+        await self._ensure_group()
+
+    def _stream_entries(self, stream_key: str, messages) -> List[QueueEntry]:
+        """(квитанция "полоса|id", данные, полоса); удалённая запись приходит без полей"""
+        lane = self._lane_streams()[stream_key]
+        return [(f"{lane}|{entry_id}", (fields or {}).get("data"), lane) for entry_id, fields in messages]
+
+    async def _read_group(
+        self,
+        consumer_id: str,
+        streams: Dict[str, str],
+        max_items: int,
+        block_ms: Optional[int]
+    ) -> List[QueueEntry]:
+        with redis_latency.labels("xreadgroup").time():
+            reply = await self.queue.client.xreadgroup(
+                self.group, consumer_id, streams, count=max_items, block=block_ms
+            )
+        entries = []
+        for stream_key, messages in reply or []:
+            entries.extend(self._stream_entries(stream_key, messages))
+        return entries
+
+    async def pop(self, max_items: int, timeout: float, consumer_id: str) -> List[QueueEntry]:
+        """
+        По порядку: свои неподтверждённые записи после release (XREADGROUP
+        с id 0), записи, зависшие дольше visibility timeout у любого
+        потребителя группы (XAUTOCLAIM, не чаще раза в половину тайм-аута),
+        затем новые записи (XREADGROUP > с BLOCK; при полосах — сначала
+        по плану без ожидания).
+        """
+        queue = self.queue
+        await self._ensure_group()
+        streams = list(self._lane_streams())
+        try:
+            if consumer_id in self._replay:
+                entries = await self._read_group(consumer_id, {key: "0" for key in streams}, max_items, None)
+                if entries:
+                    return entries
+                self._replay.discard(consumer_id)
+
+            now = time.monotonic()
+            if now >= self._next_autoclaim.get(consumer_id, 0.0):
+                self._next_autoclaim[consumer_id] = now + queue.visibility_timeout / 2
+                claimed = []
+                for stream_key in streams:
+                    if len(claimed) >= max_items:
+                        break
+                    with redis_latency.labels("xautoclaim").time():
+                        reply = await queue.client.xautoclaim(
+                            stream_key, self.group, consumer_id,
+                            int(queue.visibility_timeout * 1000), "0-0", count=max_items - len(claimed)
+                        )
+                    claimed.extend(self._stream_entries(stream_key, reply[1]))
+                if claimed:
+                    queue_requeued.inc(len(claimed))
+                    logger.warning(
+                        "Claimed stuck stream entries",
+                        extra={"extra_data": {"consumer_id": consumer_id, "count": len(claimed)}}
+                    )
+                    return claimed
+
+            if queue.lanes.enabled:
+                entries = await self._read_lanes(consumer_id, max_items)
+                if entries:
+                    return entries
+                # Все полосы пусты: ждать любую, не забирая больше своей доли пачки
+                max_items = max(1, max_items // len(streams))
+            return await self._read_group(
+                consumer_id, {key: ">" for key in streams}, max_items, max(1, int(timeout * 1000))
+            )
+        except ResponseError as e:
+            if "NOGROUP" in str(e):
+                # Поток удалён вместе с группой — пересоздать при следующем чтении
+                self._group_ready = False
+            raise
+
+    async def _read_lanes(self, consumer_id: str, max_items: int) -> List[QueueEntry]:
+        """
+        Новые записи полос по плану без ожидания: квоты — одним конвейером,
+        добор — по порядку плана из полос, отдавших квоту целиком.
+        Прочитанное сразу закреплено за потребителем, поэтому квоты
+        урезаются так, чтобы в сумме не превысить max_items.
+        """
+        lanes = self.queue.lanes
+        plan = []
+        remaining = max_items
+        for index, quota in lanes.plan(max_items):
+            quota = min(quota, remaining)
+            remaining -= quota
+            plan.append((index, quota))
+
+        pipe = self.queue.client.pipeline(transaction=False)
+        requested = [(index, quota) for index, quota in plan if quota > 0]
+        for index, quota in requested:
+            pipe.xreadgroup(
+                self.group, consumer_id, {self.lane_key(lanes.lanes[index]): ">"}, count=quota
+            )
+        with redis_latency.labels("xreadgroup").time():
+            replies = await pipe.execute()
+
+        entries = []
+        drained = set()
+        for (index, quota), reply in zip(requested, replies):
+            read = []
+            for stream_key, messages in reply or []:
+                read.extend(self._stream_entries(stream_key, messages))
+            if len(read) < quota:
+                drained.add(index)
+            entries.extend(read)
+        reached = [index for index, _ in requested]
+
+        for index, _ in plan:
+            if len(entries) >= max_items:
+                break
+            if index in drained:
+                continue
+            reached.append(index)
+            entries.extend(await self._read_group(
+                consumer_id, {self.lane_key(lanes.lanes[index]): ">"}, max_items - len(entries), None
+            ))
+        lanes.served(reached)
+        return entries
+
+    async def ack(self, receipts: List[str], consumer_id: str):
+        lanes = self.queue.lanes
+        by_lane: Dict[str, List[str]] = {}
+        for receipt in receipts:
+            lane, entry_id = receipt.split("|", 1)
+            by_lane.setdefault(lane, []).append(entry_id)
+        pipe = self.queue.client.pipeline(transaction=False)
+        for lane, entry_ids in by_lane.items():
+            index = lanes.index(lane)
+            stream_key = self.lane_key(lanes.lanes[index if index is not None else -1])
+            pipe.xack(stream_key, self.group, *entry_ids)
+            # Поток — очередь работ: обработанные записи больше не нужны
+            pipe.xdel(stream_key, *entry_ids)
+        with redis_latency.labels("ack").time():
+            await pipe.execute()
+
+    async def release(self, consumer_id: str) -> int:
+        """Записи остаются за потребителем и выдаются ему заново следующим pop"""
+        await self._ensure_group()
+        self._replay.add(consumer_id)
+        pipe = self.queue.client.pipeline(transaction=False)
+        for stream_key in self._lane_streams():
+            pipe.xpending(stream_key, self.group)
+        return sum(
+            int(c["pending"])
+            for summary in await pipe.execute()
+            for c in summary.get("consumers") or []
+            if c["name"] == consumer_id
+        )
+
+    def queue_depth(self, pipe):
+        for lane in self.queue.lanes.lanes:
+            pipe.xinfo_groups(self.lane_key(lane))
+            pipe.xlen(self.lane_key(lane))
+
+    def lane_depths(self, replies: List[Any]) -> List[Tuple[int, int]]:
+        depths = []
+        for position in range(0, len(replies), 2):
+            groups, size = replies[position], replies[position + 1]
+            group = next((g for g in groups if g["name"] == self.group), None)
+            pending = int(group["pending"]) if group is not None else 0
+            length = group.get("lag") if group is not None else 0
+            if length is None:
+                # lag неизвестен (Redis < 7 или удаления): подтверждённые
+                # записи удаляются, значит в потоке — ожидающие и выданные
+                length = size - pending
+            depths.append((int(length), pending))
+        return depths
+
+
+QUEUE_BACKENDS = {backend.mode: backend for backend in (SimpleQueue, ReliableQueue, StreamQueue)}
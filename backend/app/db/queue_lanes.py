@@ -0,0 +1,150 @@
+"""
+Полосы (lanes) очереди транзакций: маршрутизация по критериям транзакции
+и порядок, в котором потребитель забирает полосы.
+Настраиваются JSON-списком QUEUE_LANES, порядок в списке — приоритет:
+
+    [{"name": "high", "min_amount": 10000, "weight": 8},
+     {"name": "crypto", "merchant_categories": ["crypto", "gambling"], "weight": 3}]
+
+Транзакция попадает в первую полосу, все критерии которой выполнены;
+не подошедшие — в полосу default (последняя, вес QUEUE_DEFAULT_LANE_WEIGHT).
+"""
+import json
+import math
+import os
+import re
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+DEFAULT_LANE = "default"
+LANE_POLICIES = ("weighted", "strict")
+
+_LANE_NAME = re.compile(r"^[A-Za-z0-9_.-]+$")
+
+
+class QueueLane:
+    """
+    Полоса и её критерии (все заданные должны выполняться):
+    min_amount/max_amount — границы amount (min включительно, max — нет),
+    currencies — коды валют, merchant_categories — значения merchant_category,
+    merchants — значения merchant. weight — доля полосы в пачке (weighted).
+    """
+    __slots__ = ("name", "weight", "min_amount", "max_amount", "currencies", "merchant_categories", "merchants")
+
+    def __init__(self, spec: Dict[str, Any]):
+        self.name = str(spec.get("name", ""))
+        if not _LANE_NAME.match(self.name):
+            raise ValueError(f"Invalid queue lane name '{self.name}'")
+        self.weight = int(spec.get("weight", 1))
+        if self.weight < 1:
+            raise ValueError(f"Queue lane '{self.name}' weight must be >= 1")
+        self.min_amount = float(spec["min_amount"]) if spec.get("min_amount") is not None else None
+        self.max_amount = float(spec["max_amount"]) if spec.get("max_amount") is not None else None
+        self.currencies = self._values(spec.get("currencies"), str.upper)
+        self.merchant_categories = self._values(spec.get("merchant_categories"), str.lower)
+        self.merchants = self._values(spec.get("merchants"), str.lower)
+
+    @staticmethod
+    def _values(values: Optional[List[str]], normalize) -> Optional[frozenset]:
+        return frozenset(normalize(str(value)) for value in values) if values else None
+
+    def matches(self, transaction: Dict[str, Any]) -> bool:
+        if self.min_amount is not None or self.max_amount is not None:
+            try:
+                amount = float(transaction.get("amount"))
+            except (TypeError, ValueError):
+                return False
+            if self.min_amount is not None and amount < self.min_amount:
+                return False
+            if self.max_amount is not None and amount >= self.max_amount:
+                return False
+        if self.currencies is not None and str(transaction.get("currency", "")).upper() not in self.currencies:
+            return False
+        if (
+            self.merchant_categories is not None
+            and str(transaction.get("merchant_category", "")).lower() not in self.merchant_categories
+        ):
+            return False
+        if self.merchants is not None and str(transaction.get("merchant", "")).lower() not in self.merchants:
+            return False
+        return True
+
+    def __repr__(self):
+        return f"<QueueLane(name='{self.name}', weight={self.weight})>"
+
+
+def load_lanes(raw: Optional[str] = None) -> List[QueueLane]:
+    """Полосы из QUEUE_LANES; полоса default всегда последняя"""
+    raw = raw if raw is not None else os.getenv("QUEUE_LANES", "")
+    specs = json.loads(raw) if raw.strip() else []
+    if not isinstance(specs, list):
+        raise ValueError("QUEUE_LANES must be a JSON list")
+    lanes = [QueueLane(spec) for spec in specs if spec.get("name") != DEFAULT_LANE]
+    default_weight = next(
+        (spec.get("weight") for spec in specs if spec.get("name") == DEFAULT_LANE),
+        os.getenv("QUEUE_DEFAULT_LANE_WEIGHT", "1")
+    )
+    lanes.append(QueueLane({"name": DEFAULT_LANE, "weight": default_weight}))
+    names = [lane.name for lane in lanes]
+    if len(set(names)) != len(names):
+        raise ValueError(f"Duplicate queue lane names in {names}")
+    return lanes
+
+
+class LaneScheduler:
+    """
+    План выборки пачки по полосам — [(индекс полосы, квота)] в порядке обхода:
+    - weighted (по умолчанию) — каждая полоса получает долю пачки по весу
+      (не меньше одного места), недобранное добирается по приоритету;
+    - strict — полосы по приоритету, следующая — только если предыдущие пусты.
+    Защита от голодания: полоса, которую не обходили дольше starvation_ms
+    (QUEUE_LANE_STARVATION_MS), идёт в плане первой.
+    """
+
+    def __init__(
+        self,
+        lanes: List[QueueLane],
+        policy: Optional[str] = None,
+        starvation_ms: Optional[float] = None
+    ):
+        self.lanes = lanes
+        self.policy = (policy or os.getenv("QUEUE_LANE_POLICY", "weighted")).lower()
+        if self.policy not in LANE_POLICIES:
+            raise ValueError(f"Unknown lane policy '{self.policy}'. Use one of {LANE_POLICIES}")
+        self.starvation = (starvation_ms or float(os.getenv("QUEUE_LANE_STARVATION_MS", "5000"))) / 1000
+        self._total_weight = sum(lane.weight for lane in lanes)
+        now = time.monotonic()
+        self._served = [now] * len(lanes)
+
+    @property
+    def enabled(self) -> bool:
+        """Полос больше одной — иначе очередь работает как прежде"""
+        return len(self.lanes) > 1
+
+    def route(self, transaction: Dict[str, Any]) -> QueueLane:
+        for lane in self.lanes:
+            if lane.matches(transaction):
+                return lane
+        return self.lanes[-1]
+
+    def index(self, name: str) -> Optional[int]:
+        return next((i for i, lane in enumerate(self.lanes) if lane.name == name), None)
+
+    def plan(self, max_items: int) -> List[Tuple[int, int]]:
+        now = time.monotonic()
+        order = list(range(len(self.lanes)))
+        starving = [i for i in order if now - self._served[i] > self.starvation]
+        if starving:
+            order = starving + [i for i in order if i not in starving]
+        if self.policy == "strict":
+            return [(i, max_items) for i in order]
+        return [
+            (i, max(1, math.ceil(max_items * self.lanes[i].weight / self._total_weight)))
+            for i in order
+        ]
+
+    def served(self, reached: List[int]):
+        """Полосы, до которых дошла выборка (взято или пусты), обслужены"""
+        now = time.monotonic()
+        for i in reached:
+            self._served[i] = now
@@ -0,0 +1,155 @@
+"""
+Lua-скрипты очереди транзакций. Каждый выполняется на сервере атомарно:
+перенос между очередью, списками обработки, полосами, отложенными повторами
+и DLQ не теряет и не дублирует транзакции при параллельных потребителях.
+Регистрируются на клиенте очереди (RedisClient._script, EVALSHA с откатом на EVAL).
+"""
+
+# Дозабор пачки в список обработки потребителя и продление его аренды — атомарно.
+# KEYS: очередь, список обработки, ключ аренды; ARGV: сколько забрать, аренда в мс
+CLAIM_SCRIPT = """
+local items = {}
+for i = 1, tonumber(ARGV[1]) do
+    local item = redis.call('LMOVE', KEYS[1], KEYS[2], 'RIGHT', 'LEFT')
+    if not item then break end
+    items[#items + 1] = item
+end
+redis.call('SET', KEYS[3], '1', 'PX', ARGV[2])
+return items
+"""
+
+# Возврат необработанных транзакций потребителя в очередь (в исходном порядке:
+# первыми снова будут извлечены самые старые). Если аренда жива и ARGV[2] ~= '1',
+# потребитель считается рабочим и список не трогается — возвращается -1.
+# KEYS: список обработки, очередь, ключ аренды, множество потребителей; ARGV: id, force
+REQUEUE_SCRIPT = """
+if ARGV[2] ~= '1' and redis.call('EXISTS', KEYS[3]) == 1 then
+    return -1
+end
+local moved = 0
+while redis.call('LMOVE', KEYS[1], KEYS[2], 'LEFT', 'RIGHT') do
+    moved = moved + 1
+end
+redis.call('SREM', KEYS[4], ARGV[1])
+return moved
+"""
+
+# Выборка пачки из полос очереди по плану LaneScheduler: сначала квоты полос,
+# затем добор по порядку плана. Элементы возвращаются как "полоса|транзакция";
+# при аренде > 0 они же кладутся в список обработки. Если пачка не набрана,
+# все полосы пусты — звонок (сигналы ожидающим потребителям) очищается.
+# KEYS: список обработки, ключ аренды, звонок, полосы (в порядке плана);
+# ARGV: сколько забрать, аренда в мс, имена полос, квоты полос.
+# Возвращает {взято по полосам (-1 — до полосы не дошли), элементы}
+LANES_CLAIM_SCRIPT = """
+local lanes = #KEYS - 3
+local limit = tonumber(ARGV[1])
+local lease = tonumber(ARGV[2])
+local items = {}
+local counts = {}
+local drained = {}
+for i = 1, lanes do counts[i] = -1 end
+local function take(i, quota)
+    if drained[i] then return end
+    if counts[i] < 0 then counts[i] = 0 end
+    local name = ARGV[2 + i]
+    while quota > 0 and #items < limit do
+        local item = redis.call('RPOP', KEYS[3 + i])
+        if not item then
+            drained[i] = true
+            return
+        end
+        item = name .. '|' .. item
+        if lease > 0 then
+            redis.call('LPUSH', KEYS[1], item)
+        end
+        items[#items + 1] = item
+        counts[i] = counts[i] + 1
+        quota = quota - 1
+    end
+end
+for i = 1, lanes do
+    if #items >= limit then break end
+    take(i, tonumber(ARGV[2 + lanes + i]))
+end
+for i = 1, lanes do
+    if #items >= limit then break end
+    take(i, limit)
+end
+if lease > 0 then
+    redis.call('SET', KEYS[2], '1', 'PX', lease)
+end
+if #items < limit then
+    redis.call('DEL', KEYS[3])
+end
+return {counts, items}
+"""
+
+# REQUEUE_SCRIPT для полос: каждая транзакция возвращается в свою полосу
+# (неизвестная полоса или элемент без префикса — в последнюю, default)
+# и звонок будит ожидающих потребителей.
+# KEYS: список обработки, ключ аренды, множество потребителей, звонок, полосы;
+# ARGV: id, force, имена полос
+REQUEUE_LANES_SCRIPT = """
+if ARGV[2] ~= '1' and redis.call('EXISTS', KEYS[2]) == 1 then
+    return -1
+end
+local lanes = {}
+for i = 5, #KEYS do
+    lanes[ARGV[i - 2]] = KEYS[i]
+end
+local moved = 0
+while true do
+    local item = redis.call('LPOP', KEYS[1])
+    if not item then break end
+    local key = KEYS[#KEYS]
+    local separator = string.find(item, '|', 1, true)
+    if separator and string.sub(item, 1, 1) ~= '{' then
+        key = lanes[string.sub(item, 1, separator - 1)] or key
+        item = string.sub(item, separator + 1)
+    end
+    redis.call('RPUSH', key, item)
+    moved = moved + 1
+end
+if moved > 0 then
+    redis.call('LPUSH', KEYS[4], '1')
+end
+redis.call('SREM', KEYS[3], ARGV[1])
+return moved
+"""
+
+# Постановка в очередь транзакций из отложенных повторов (ZSET) или из DLQ
+# (список): транзакция ставится, только если её удалось снять с источника, —
+# параллельные переносы её не дублируют.
+# KEYS: источник, звонок, очередь или поток каждой транзакции;
+# ARGV: тип источника (zset или list), режим (list, lanes или stream),
+# предел звонка, затем пары (элемент источника, элемент очереди).
+# Возвращает номера (с нуля) поставленных пар
+MOVE_TO_QUEUE_SCRIPT = """
+local moved = {}
+for i = 3, #KEYS do
+    local member = ARGV[2 * i - 2]
+    local item = ARGV[2 * i - 1]
+    local removed
+    if ARGV[1] == 'zset' then
+        removed = redis.call('ZREM', KEYS[1], member)
+    else
+        removed = redis.call('LREM', KEYS[1], -1, member)
+    end
+    if removed > 0 then
+        if ARGV[2] == 'stream' then
+            redis.call('XADD', KEYS[i], '*', 'data', item)
+        else
+            redis.call('LPUSH', KEYS[i], item)
+            if ARGV[2] == 'lanes' then
+                redis.call('LPUSH', KEYS[2], '1')
+            end
+        end
+        moved[#moved + 1] = i - 3
+    end
+end
+if #moved > 0 and ARGV[2] == 'lanes' then
+    redis.call('LTRIM', KEYS[2], 0, tonumber(ARGV[3]) - 1)
+end
+return moved
+"""
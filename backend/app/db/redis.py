@@ -1,34 +1,237 @@
+import asyncio
 import os
 import json
-import logging
-from typing import Optional, Any, Dict
+import random
+import socket
+import time
+from typing import Optional, Any, Dict, List, Tuple
+import redis as sync_redis
 import redis.asyncio as redis
+from app.db.queue_backends import DOORBELL_MAX, QUEUE_BACKENDS, QueueBackend
+from app.db.queue_lanes import LaneScheduler, QueueLane, load_lanes
+from app.db.queue_scripts import MOVE_TO_QUEUE_SCRIPT
 from app.core.logging import get_logger, traced_function
+from app.core.metrics import (
+    queue_lane_length,
+    queue_length,
+    queue_pending,
+    queue_dead,
+    queue_dead_lettered,
+    queue_retried,
+    queue_retrying,
+    queue_wait,
+    redis_latency,
+    redis_pool_connections,
+    redis_pool_max_connections,
+)
 
 logger = get_logger(__name__)
 
+
+class RedisSettings:
+    """
+    Параметры подключения из окружения: REDIS_URL или REDIS_HOST/REDIS_PORT/REDIS_DB,
+    размер пула и таймауты. Пул блокирующий: при исчерпании команда ждёт
+    свободное соединение до REDIS_POOL_TIMEOUT, а не падает сразу.
+    """
+
+    def __init__(self):
+        self.url = os.getenv("REDIS_URL")
+        self.host = os.getenv("REDIS_HOST", "redis")
+        self.port = int(os.getenv("REDIS_PORT", "6379"))
+        self.db = int(os.getenv("REDIS_DB", "0"))
+        self.max_connections = int(os.getenv("REDIS_MAX_CONNECTIONS", "50"))
+        self.pool_timeout = float(os.getenv("REDIS_POOL_TIMEOUT", "5"))
+        self.socket_timeout = float(os.getenv("REDIS_SOCKET_TIMEOUT", "5"))
+        self.connect_timeout = float(os.getenv("REDIS_CONNECT_TIMEOUT", "5"))
+        # Соединение, простаивавшее дольше интервала, проверяется PING перед командой
+        self.health_check_interval = int(os.getenv("REDIS_HEALTH_CHECK_INTERVAL", "30"))
+
+    def _pool_kwargs(self) -> Dict[str, Any]:
+        return {
+            "max_connections": self.max_connections,
+            "timeout": self.pool_timeout,
+            "socket_timeout": self.socket_timeout,
+            "socket_connect_timeout": self.connect_timeout,
+            "health_check_interval": self.health_check_interval,
+            "retry_on_timeout": True,
+            "encoding": "utf-8",
+            "decode_responses": True,
+        }
+
+    def _pool(self, pool_class):
+        if self.url:
+            return pool_class.from_url(self.url, **self._pool_kwargs())
+        return pool_class(host=self.host, port=self.port, db=self.db, **self._pool_kwargs())
+
+    def async_pool(self) -> redis.BlockingConnectionPool:
+        return self._pool(redis.BlockingConnectionPool)
+
+    def sync_pool(self) -> sync_redis.BlockingConnectionPool:
+        return self._pool(sync_redis.BlockingConnectionPool)
+
+
+_async_client: Optional[redis.Redis] = None
+_sync_client: Optional[sync_redis.Redis] = None
+
+
+def get_redis() -> redis.Redis:
+    """
+    Общий асинхронный клиент процесса: очередь, правила и кэши работают через
+    один пул. Соединения открываются при первой команде.
+    """
+    global _async_client
+    if _async_client is None:
+        _async_client = redis.Redis(connection_pool=RedisSettings().async_pool())
+    return _async_client
+
+
+def get_sync_redis() -> sync_redis.Redis:
+    """
+    Синхронный клиент с теми же настройками — для кода вне event loop
+    (пакетная оценка правил, скрипты). Пулы asyncio и потоков общими быть не могут.
+    """
+    global _sync_client
+    if _sync_client is None:
+        _sync_client = sync_redis.Redis(connection_pool=RedisSettings().sync_pool())
+    return _sync_client
+
+
+def set_redis(async_client: Optional[redis.Redis] = None, sync_client: Optional[sync_redis.Redis] = None):
+    """Подменяет общие клиенты (тесты, бенчмарки); None — сброс к созданию по настройкам"""
+    global _async_client, _sync_client
+    _async_client = async_client
+    _sync_client = sync_client
+
+
+async def close_redis_pools():
+    """Закрывает соединения общих пулов (остановка приложения)"""
+    global _async_client, _sync_client
+    if _async_client is not None:
+        await _async_client.close(close_connection_pool=True)
+        _async_client = None
+    if _sync_client is not None:
+        _sync_client.close()
+        _sync_client.connection_pool.disconnect()
+        _sync_client = None
+
+
+def _pool_usage(pool) -> Tuple[int, int]:
+    """(занятые, свободные) соединения пула"""
+    in_use = getattr(pool, "_in_use_connections", None)
+    if in_use is not None:
+        return len(in_use), len(pool._available_connections)
+    # Синхронный BlockingConnectionPool: очередь свободных, None — ещё не созданное
+    idle = sum(1 for connection in list(pool.pool.queue) if connection is not None)
+    return len(pool._connections) - idle, idle
+
+
+def observe_redis_pools():
+    """Обновляет метрики утилизации пулов (вызывается при сборе /metrics)"""
+    for name, client in (("async", _async_client), ("sync", _sync_client)):
+        pool = getattr(client, "connection_pool", None)
+        if pool is None:
+            continue
+        try:
+            in_use, idle = _pool_usage(pool)
+        except AttributeError:
+            continue
+        redis_pool_connections.labels(name, "in_use").set(in_use)
+        redis_pool_connections.labels(name, "idle").set(idle)
+        redis_pool_max_connections.labels(name).set(pool.max_connections)
+
+
+# Записей DLQ за одно чтение при повторной постановке и пар за один скрипт
+DEAD_LETTER_PAGE = 500
+
+# Поле транзакции с квитанцией очереди (элемент списка обработки или
+# "полоса|id записи потока") — по ней подтверждается обработка
+QUEUE_RECEIPT = "_queue_receipt"
+# Время постановки в очередь (для метрики ожидания), снимается при извлечении
+QUEUE_ENQUEUED_AT = "_enqueued_at"
+# Номер попытки и ошибки прошлых попыток транзакции, назначенной на повтор
+QUEUE_ATTEMPTS = "_attempts"
+QUEUE_ERRORS = "_errors"
+
+QUEUE_MODES = tuple(QUEUE_BACKENDS)
+MIN_SERVER_VERSION = {
+    mode: backend.min_server_version
+    for mode, backend in QUEUE_BACKENDS.items()
+    if backend.min_server_version is not None
+}
+
+
 class RedisClient:
+    """
+    Очередь транзакций. Режим хранения — QUEUE_MODE (simple, reliable, stream,
+    см. queue_backends): клиент делегирует ему постановку, выдачу,
+    подтверждение и возврат транзакций. reliable и stream требуют
+    Redis >= 6.2 — проверяется в init_redis.
+    Полосы (QUEUE_LANES, см. queue_lanes): транзакция ставится в полосу по своим
+    полям, пачка набирается из полос по плану LaneScheduler. Без QUEUE_LANES —
+    одна полоса default с прежними ключами.
+    Повторы: транзакция, обработка которой не удалась, откладывается в ZSET
+    (score — время повтора) с экспоненциальной задержкой QUEUE_RETRY_BASE_MS..
+    QUEUE_RETRY_MAX_MS и возвращается в очередь promote_retries; после
+    QUEUE_MAX_ATTEMPTS попыток она уходит в DLQ (dead-letter список) с ошибками
+    всех попыток, откуда её возвращает replay_dead_letters.
+    """
+
     def __init__(self):
         self.redis_client: Optional[redis.Redis] = None
         self.queue_key = "transaction_queue"
+        self.mode = os.getenv("QUEUE_MODE", "simple").lower()
+        if self.mode not in QUEUE_MODES:
+            raise ValueError(f"Unknown queue mode '{self.mode}'. Use one of {QUEUE_MODES}")
+        self.visibility_timeout = float(os.getenv("QUEUE_VISIBILITY_TIMEOUT", "30"))
+        self.consumer_id = os.getenv("WORKER_CONSUMER_ID") or f"{socket.gethostname()}:{os.getpid()}"
+        self.group = os.getenv("QUEUE_GROUP", "workers")
+        self._scripts: Dict[str, Any] = {}
+        self.lanes = LaneScheduler(load_lanes())
+        self.doorbell_key = f"{self.queue_key}:doorbell"
+        self.retry_key = f"{self.queue_key}:retry"
+        self.dead_key = f"{self.queue_key}:dead"
+        self.max_attempts = int(os.getenv("QUEUE_MAX_ATTEMPTS", "5"))
+        self.retry_base = float(os.getenv("QUEUE_RETRY_BASE_MS", "1000")) / 1000
+        self.retry_max = float(os.getenv("QUEUE_RETRY_MAX_MS", "300000")) / 1000
+        # Как часто воркер переносит наступившие повторы в очередь
+        self.retry_poll = float(os.getenv("QUEUE_RETRY_POLL_MS", "500")) / 1000
+        # Как часто /metrics обновляет метрики очереди из Redis
+        self.stats_interval = float(os.getenv("QUEUE_STATS_INTERVAL_MS", "5000")) / 1000
+        self._stats_at = float("-inf")
+        self._stats_refresh: Optional[asyncio.Task] = None
+        self.backend: QueueBackend = QUEUE_BACKENDS[self.mode](self)
+
+    def lane_key(self, lane: QueueLane) -> str:
+        """Список или поток полосы; у полосы default — прежние ключи очереди"""
+        return self.backend.lane_key(lane)
+
+    def _script(self, source: str):
+        """Скрипт, зарегистрированный на текущем клиенте"""
+        key = (id(self.client), source)
+        script = self._scripts.get(key)
+        if script is None:
+            script = self._scripts[key] = self.client.register_script(source)
+        return script
+
+    @property
+    def client(self) -> redis.Redis:
+        """Клиент общего пула; соединение устанавливается при первой команде"""
+        if self.redis_client is None:
+            self.redis_client = get_redis()
+        return self.redis_client
 
     @traced_function(__name__)
     async def init_redis(self):
-        """Инициализация подключения к Redis"""
+        """
+        Проверка подключения к Redis при запуске. Если сервер старше, чем нужно
+        режиму очереди, — ValueError: без LMOVE/XAUTOCLAIM очередь не работает.
+        """
+        required = self.backend.min_server_version
         try:
-            redis_host = os.getenv("REDIS_HOST", "redis")
-            redis_port = int(os.getenv("REDIS_PORT", "6379"))
-            
-            self.redis_client = redis.Redis(
-                host=redis_host,
-                port=redis_port,
-                db=0,
-                encoding="utf-8",
-                decode_responses=True,
-                socket_connect_timeout=5
-            )
-            
-            await self.redis_client.ping()
+            with redis_latency.labels("ping").time():
+                await self.client.ping()
+            info = await self.client.info("server") if required else {}
             logger.info("Redis connection established successfully")
             
         except Exception as e:
@@ -39,26 +242,37 @@ class RedisClient:
             )
             raise
 
+        if required:
+            version = str(info.get("redis_version", ""))
+            parsed = tuple(int(part) for part in version.split(".")[:2] if part.isdigit())
+            if parsed < required:
+                raise ValueError(
+                    f"QUEUE_MODE={self.mode} requires Redis >= {'.'.join(map(str, required))}, "
+                    f"server is {version or 'unknown'}. Upgrade Redis or use QUEUE_MODE=simple"
+                )
+
     async def close_redis(self):
         """Закрытие подключения к Redis"""
         if self.redis_client:
-            await self.redis_client.close()
+            self.redis_client = None
+            await close_redis_pools()
             logger.info("Redis connection closed")
 
     @traced_function(__name__)
     async def push_transaction(self, transaction_data: Dict[str, Any]) -> bool:
         """Добавление транзакции в очередь"""
         try:
-            if not self.redis_client:
-                await self.init_redis()
-
-            transaction_json = json.dumps(transaction_data, ensure_ascii=False)
-            result = await self.redis_client.lpush(self.queue_key, transaction_json)
+            lane = self.lanes.route(transaction_data)
+            transaction_json = json.dumps(
+                {**transaction_data, QUEUE_ENQUEUED_AT: time.time()}, ensure_ascii=False
+            )
+            details = await self.backend.push(self.lane_key(lane), transaction_json)
+            details["lane"] = lane.name
             
             logger.info(
                 "Transaction pushed to queue",
                 extra={"extra_data": {
-                    "queue_length": result,
+                    **details,
                     "transaction_id": transaction_data.get("id")
                 }}
             )
@@ -76,48 +290,329 @@ class RedisClient:
             return False
 
     @traced_function(__name__)
-    async def pop_transaction(self) -> Optional[Dict[str, Any]]:
-        """Извлечение транзакции из очереди"""
+    async def pop_transaction(self, timeout: float = 0.01) -> Optional[Dict[str, Any]]:
+        """
+        Извлечение одной транзакции из очереди (ожидание до timeout секунд).
+        В режимах reliable и stream её нужно подтвердить ack_transactions.
+        """
         try:
-            if not self.redis_client:
-                await self.init_redis()
+            transactions = await self.pop_transactions(1, timeout)
+        except Exception:
+            return None
+        if not transactions:
+            logger.debug("Queue is empty")
+            return None
+        logger.info(
+            "Transaction popped from queue",
+            extra={"extra_data": {
+                "transaction_id": transactions[0].get("id")
+            }}
+        )
+        return transactions[0]
 
-            transaction_json = await self.redis_client.rpop(self.queue_key)
-            
-            if transaction_json:
-                transaction_data = json.loads(transaction_json)
-                logger.info(
-                    "Transaction popped from queue",
-                    extra={"extra_data": {
-                        "transaction_id": transaction_data.get("id")
-                    }}
+    @traced_function(__name__)
+    async def pop_transactions(
+        self,
+        max_items: int = 100,
+        timeout: float = 1.0,
+        consumer_id: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Пачка транзакций из очереди: первая ожидается блокирующей командой до
+        timeout секунд, остальные (до max_items) забираются одним обменом.
+        В режимах reliable и stream транзакции несут QUEUE_RECEIPT для
+        ack_transactions. consumer_id — потребитель внутри процесса (пул
+        воркеров), по умолчанию self.consumer_id.
+        Пустой список — очередь пуста весь timeout.
+        """
+        consumer_id = consumer_id or self.consumer_id
+        try:
+            entries = await self.backend.pop(max_items, timeout, consumer_id)
+        except Exception as e:
+            logger.error(
+                "Error popping transactions from Redis",
+                extra={"extra_data": {"error": str(e)}},
+                exc_info=True
+            )
+            raise
+
+        transactions = []
+        malformed = []
+        now = time.time()
+        for receipt, item, lane in entries:
+            try:
+                transaction = json.loads(item)
+            except (TypeError, ValueError) as e:
+                logger.error(
+                    "Dropping malformed queue item",
+                    extra={"extra_data": {"error": str(e), "item": str(item)[:200]}}
                 )
-                return transaction_data
+                if receipt is not None:
+                    malformed.append(receipt)
+                continue
+            enqueued_at = transaction.pop(QUEUE_ENQUEUED_AT, None)
+            if enqueued_at is not None:
+                queue_wait.labels(lane).observe(max(0.0, now - enqueued_at))
+            if receipt is not None:
+                transaction[QUEUE_RECEIPT] = receipt
+            transactions.append(transaction)
+        if malformed:
+            await self.backend.ack(malformed, consumer_id)
+        logger.debug(
+            "Transactions popped from queue",
+            extra={"extra_data": {"count": len(transactions)}}
+        )
+        return transactions
+
+    @traced_function(__name__)
+    async def ack_transactions(self, transactions: List[Dict[str, Any]], consumer_id: Optional[str] = None):
+        """
+        Подтверждает обработку: транзакции удаляются из списка обработки
+        (reliable) или подтверждаются в группе и удаляются из потока (stream).
+        Вызывать после сохранения результатов. В режиме simple ничего не делает.
+        """
+        items = [t.pop(QUEUE_RECEIPT) for t in transactions if QUEUE_RECEIPT in t]
+        if items:
+            await self.backend.ack(items, consumer_id or self.consumer_id)
+
+    @traced_function(__name__)
+    async def requeue_expired(self) -> int:
+        """
+        Возвращает в очередь транзакции потребителей с истёкшей арендой
+        (упавших или зависших дольше QUEUE_VISIBILITY_TIMEOUT). Потребители
+        этого процесса пропускаются. Число возвращённых. В режиме stream
+        зависшие записи забирает сам pop_transactions (XAUTOCLAIM).
+        """
+        return await self.backend.requeue_expired()
+
+    @traced_function(__name__)
+    async def release_inflight(self, consumer_id: Optional[str] = None) -> int:
+        """
+        Возвращает в очередь неподтверждённые транзакции потребителя
+        (ошибка обработки пачки, перезапуск с тем же WORKER_CONSUMER_ID).
+        В режиме stream записи остаются за потребителем и выдаются ему заново
+        следующим pop_transactions; возвращается их число.
+        """
+        return await self.backend.release(consumer_id or self.consumer_id)
+
+    def retry_delay(self, attempt: int) -> float:
+        """
+        Задержка повтора после attempt-й неудачной попытки: retry_base * 2^(attempt-1),
+        не больше retry_max. Половина задержки случайна — транзакции одного сбоя
+        (например, недоступной БД) не возвращаются в очередь разом.
+        """
+        delay = min(self.retry_max, self.retry_base * 2 ** (attempt - 1))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    @traced_function(__name__)
+    async def schedule_retries(
+        self,
+        failures: List[Tuple[Dict[str, Any], str]],
+        consumer_id: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Неудавшиеся транзакции (транзакция, ошибка) — на отложенный повтор,
+        исчерпавшие max_attempts попыток — в DLQ, одним обменом (MULTI).
+        Вызывать до ack_transactions: после подтверждения транзакция есть
+        только в отложенных или в DLQ. Возвращает ушедшие в DLQ.
+        """
+        if not failures:
+            return []
+        now = time.time()
+        retries: Dict[str, float] = {}
+        dead_letters = []
+        dead = []
+        for transaction_data, error in failures:
+            transaction = {
+                key: value for key, value in transaction_data.items()
+                if key not in (QUEUE_RECEIPT, QUEUE_ENQUEUED_AT)
+            }
+            attempt = int(transaction.pop(QUEUE_ATTEMPTS, 0)) + 1
+            errors = (transaction.pop(QUEUE_ERRORS, None) or []) + [str(error)[:500]]
+            if attempt < self.max_attempts:
+                due = now + self.retry_delay(attempt)
+                retry = {**transaction, QUEUE_ATTEMPTS: attempt, QUEUE_ERRORS: errors, QUEUE_ENQUEUED_AT: due}
+                retries[json.dumps(retry, ensure_ascii=False)] = due
             else:
-                logger.debug("Queue is empty")
-                return None
-                
+                dead.append(transaction)
+                dead_letters.append(json.dumps({
+                    "id": transaction.get("id"),
+                    "transaction": transaction,
+                    "attempts": attempt,
+                    "errors": errors,
+                    "consumer_id": consumer_id or self.consumer_id,
+                    "failed_at": now
+                }, ensure_ascii=False))
+
+        pipe = self.client.pipeline(transaction=True)
+        if retries:
+            pipe.zadd(self.retry_key, retries)
+        if dead_letters:
+            pipe.lpush(self.dead_key, *dead_letters)
+        with redis_latency.labels("retry").time():
+            await pipe.execute()
+
+        queue_retried.inc(len(retries))
+        if dead:
+            queue_dead_lettered.inc(len(dead))
+            logger.error(
+                "Transactions moved to the dead-letter queue",
+                extra={"extra_data": {
+                    "transaction_ids": [t.get("id") for t in dead],
+                    "attempts": self.max_attempts
+                }}
+            )
+        if retries:
+            logger.warning(
+                "Failed transactions scheduled for retry",
+                extra={"extra_data": {"count": len(retries)}}
+            )
+        return dead
+
+    async def _move_to_queue(self, source_key: str, source_type: str, moves: List[Tuple[str, str]]) -> List[int]:
+        """MOVE_TO_QUEUE_SCRIPT для пар (элемент источника, элемент очереди)"""
+        keys, args = [], []
+        for member, item in moves:
+            keys.append(self.lane_key(self.lanes.route(json.loads(item))))
+            args.extend((member, item))
+        with redis_latency.labels("move_to_queue").time():
+            moved = await self._script(MOVE_TO_QUEUE_SCRIPT)(
+                keys=[source_key, self.doorbell_key] + keys,
+                args=[source_type, self.backend.move_mode, DOORBELL_MAX] + args
+            )
+        return [int(index) for index in moved]
+
+    @traced_function(__name__)
+    async def promote_retries(self) -> int:
+        """Ставит в очередь транзакции, время повтора которых наступило; число поставленных"""
+        moved = 0
+        while True:
+            with redis_latency.labels("zrangebyscore").time():
+                items = await self.client.zrangebyscore(
+                    self.retry_key, "-inf", time.time(), start=0, num=DEAD_LETTER_PAGE
+                )
+            if not items:
+                break
+            moved += len(await self._move_to_queue(self.retry_key, "zset", [(item, item) for item in items]))
+            if len(items) < DEAD_LETTER_PAGE:
+                break
+        if moved:
+            logger.info(
+                "Retries returned to the queue",
+                extra={"extra_data": {"count": moved}}
+            )
+        return moved
+
+    @traced_function(__name__)
+    async def get_dead_letters(self, offset: int = 0, limit: int = 100) -> Dict[str, Any]:
+        """
+        Страница DLQ, новые первыми: total и записи (id, transaction, attempts,
+        errors — ошибки всех попыток, consumer_id, failed_at).
+        """
+        pipe = self.client.pipeline(transaction=False)
+        pipe.llen(self.dead_key)
+        pipe.lrange(self.dead_key, offset, offset + limit - 1)
+        with redis_latency.labels("lrange").time():
+            total, items = await pipe.execute()
+        return {"total": int(total), "items": [json.loads(item) for item in items]}
+
+    @traced_function(__name__)
+    async def replay_dead_letters(
+        self,
+        transaction_ids: Optional[List[str]] = None,
+        limit: int = 1000
+    ) -> List[str]:
+        """
+        Возвращает записи DLQ в очередь, старые первыми, со сброшенным счётчиком
+        попыток: все или только transaction_ids, не больше limit. Запись
+        снимается с DLQ и ставится в очередь атомарно. Возвращает id
+        поставленных транзакций.
+        """
+        wanted = set(transaction_ids) if transaction_ids else None
+        moves: List[Tuple[str, str]] = []
+        ids: List[str] = []
+        now = time.time()
+        end = -1
+        # Чтение с хвоста: новые записи добавляются в голову и не сдвигают его
+        while len(moves) < limit:
+            with redis_latency.labels("lrange").time():
+                page = await self.client.lrange(self.dead_key, end - DEAD_LETTER_PAGE + 1, end)
+            for raw in reversed(page):
+                entry = json.loads(raw)
+                if wanted is not None and entry.get("id") not in wanted:
+                    continue
+                moves.append((raw, json.dumps({**entry["transaction"], QUEUE_ENQUEUED_AT: now}, ensure_ascii=False)))
+                ids.append(entry.get("id"))
+                if len(moves) >= limit:
+                    break
+            if len(page) < DEAD_LETTER_PAGE:
+                break
+            end -= DEAD_LETTER_PAGE
+
+        replayed = []
+        for start in range(0, len(moves), DEAD_LETTER_PAGE):
+            moved = await self._move_to_queue(self.dead_key, "list", moves[start:start + DEAD_LETTER_PAGE])
+            replayed.extend(ids[start + index] for index in moved)
+        if replayed:
+            logger.warning(
+                "Dead letters returned to the queue",
+                extra={"extra_data": {"count": len(replayed)}}
+            )
+        return replayed
+
+    async def _queue_depth(self) -> Dict[str, Any]:
+        """
+        Ждущие выдачи (length, по полосам — lanes), для потока — выданные
+        без подтверждения (pending), ждущие повтора (retrying) и число
+        записей DLQ (dead) — одним обменом с Redis.
+        """
+        await self.backend.ready()
+        pipe = self.client.pipeline(transaction=False)
+        self.backend.queue_depth(pipe)
+        pipe.zcard(self.retry_key)
+        pipe.llen(self.dead_key)
+        with redis_latency.labels(self.backend.depth_operation).time():
+            replies = await pipe.execute()
+
+        depth = {"length": 0, "pending": 0, "retrying": int(replies[-2]), "dead": int(replies[-1]), "lanes": {}}
+        for lane, (length, pending) in zip(self.lanes.lanes, self.backend.lane_depths(replies[:-2])):
+            depth["lanes"][lane.name] = length
+            depth["length"] += length
+            depth["pending"] += pending
+        return depth
+
+    @traced_function(__name__)
+    async def get_queue_length(self, default: Optional[int] = 0) -> Optional[int]:
+        """
+        Длина очереди (для потока — отставание группы) одним обменом с Redis.
+        При ошибке Redis — default.
+        """
+        try:
+            return (await self._queue_depth())["length"]
         except Exception as e:
             logger.error(
-                "Error popping transaction from Redis",
+                "Error getting queue length from Redis",
                 extra={"extra_data": {"error": str(e)}},
                 exc_info=True
             )
-            return None
+            return default
 
     @traced_function(__name__)
-    async def get_queue_length(self) -> int:
-        """Получение длины очереди"""
+    async def get_queue_stats(self) -> Dict[str, Any]:
+        """
+        length — ждут выдачи, pending — выданы потребителям и не подтверждены,
+        retrying — ждут повтора, dead — в DLQ. Обновляет метрики transaction_queue_*.
+        """
+        stats = {"mode": self.mode, "length": 0, "pending": 0, "retrying": 0, "dead": 0, "lanes": {}}
         try:
-            if not self.redis_client:
-                await self.init_redis()
-
-            length = await self.redis_client.llen(self.queue_key)
+            stats.update(await self._queue_depth())
+            pending = await self.backend.pending()
+            if pending is not None:
+                stats["pending"] = pending
             logger.debug(
                 "Queue length retrieved",
-                extra={"extra_data": {"queue_length": length}}
+                extra={"extra_data": stats}
             )
-            return length
             
         except Exception as e:
             logger.error(
@@ -125,6 +620,32 @@ class RedisClient:
                 extra={"extra_data": {"error": str(e)}},
                 exc_info=True
             )
-            return 0
+        queue_length.set(stats["length"])
+        queue_pending.set(stats["pending"])
+        queue_retrying.set(stats["retrying"])
+        queue_dead.set(stats["dead"])
+        for lane, length in stats["lanes"].items():
+            queue_lane_length.labels(lane).set(length)
+        return stats
+
+    async def _refresh_queue_stats(self):
+        try:
+            await self.get_queue_stats()
+        finally:
+            self._stats_at = time.monotonic()
+
+    async def observe_queue_stats(self):
+        """
+        Метрики очереди для /metrics (вызывается при сборе): обновляются из
+        Redis не чаще раза в QUEUE_STATS_INTERVAL_MS одной фоновой задачей,
+        до её завершения отдаются прежние значения — частота и число сборщиков
+        не добавляют обращений к Redis. Ждёт обновления только первый сбор.
+        """
+        if time.monotonic() - self._stats_at < self.stats_interval:
+            return
+        if self._stats_refresh is None or self._stats_refresh.done():
+            self._stats_refresh = asyncio.create_task(self._refresh_queue_stats())
+        if self._stats_at == float("-inf"):
+            await asyncio.shield(self._stats_refresh)
 
 redis_client = RedisClient()
\ No newline at end of file
@@ -1,6 +1,7 @@
 from abc import ABC, abstractmethod
-from typing import Dict, Any
+from typing import Dict, Any, Callable, List, Optional
 from datetime import datetime
+from .columns import ColumnResults
 
 
 class RuleResult:
@@ -9,24 +10,111 @@ class RuleResult:
     passed     — True, если правило пройдено (не сработало).
     risk_score — значение риска (0.0–1.0).
     details    — любая дополнительная информация.
-    timestamp  — время оценки.
+    timestamp  — время оценки (движок проставляет одно время на транзакцию).
+
+    details может строиться лениво (см. RuleResult.lazy): словарь и строки
+    причин формируются только при первом обращении — при сохранении
+    результата или выдаче в API.
     """
-    def __init__(self, passed: bool, risk_score: float, details: Dict[str, Any]):
+    __slots__ = ("passed", "risk_score", "timestamp", "_details", "_factory", "_args")
+
+    def __init__(
+        self,
+        passed: bool,
+        risk_score: float,
+        details: Optional[Dict[str, Any]] = None,
+        timestamp: Optional[datetime] = None
+    ):
         self.passed = passed
         self.risk_score = risk_score
-        self.details = details
-        self.timestamp = datetime.utcnow()
+        self.timestamp = timestamp
+        self._details = details
+        self._factory = None
+        self._args = ()
+
+    @classmethod
+    def lazy(
+        cls,
+        passed: bool,
+        risk_score: float,
+        factory: Callable[..., Dict[str, Any]],
+        *args: Any
+    ) -> "RuleResult":
+        """Результат, details которого строятся вызовом factory(*args) по требованию."""
+        result = cls(passed, risk_score)
+        result._factory = factory
+        result._args = args
+        return result
+
+    @property
+    def details(self) -> Dict[str, Any]:
+        if self._details is None:
+            if self._factory is not None:
+                self._details = self._factory(*self._args)
+                self._factory = None
+                self._args = ()
+            else:
+                self._details = {}
+        return self._details
 
-    def to_dict(self) -> Dict[str, Any]:
+    @details.setter
+    def details(self, value: Dict[str, Any]):
+        self._details = value
+        self._factory = None
+        self._args = ()
+
+    def to_dict(self, timestamp_iso: Optional[str] = None) -> Dict[str, Any]:
+        if timestamp_iso is None:
+            timestamp_iso = (self.timestamp or datetime.utcnow()).isoformat() + "Z"
         return {
             "passed": self.passed,
             "risk_score": self.risk_score,
             "details": self.details,
-            "timestamp": self.timestamp.isoformat() + "Z"
+            "timestamp": timestamp_iso
         }
 
 
+class EvaluationContext:
+    """
+    Контекст оценки одной транзакции.
+    Кэширует результаты правил по rule_id, чтобы правило, встречающееся
+    на верхнем уровне и во вложенных CompositeRule, оценивалось один раз.
+    """
+    __slots__ = ("transaction", "results", "_pending")
+
+    def __init__(self, transaction: Dict[str, Any]):
+        self.transaction = transaction
+        self.results: Dict[int, RuleResult] = {}
+        self._pending = set()
+
+    def resolve(self, rule: "BaseRule") -> RuleResult:
+        """Возвращает результат правила из кэша или оценивает его."""
+        result = self.results.get(rule.rule_id)
+        if result is not None:
+            return result
+        if rule.rule_id in self._pending:
+            raise ValueError(f"Cyclic rule reference detected at rule_id={rule.rule_id}")
+        self._pending.add(rule.rule_id)
+        try:
+            result = rule.evaluate_in_context(self)
+        finally:
+            self._pending.discard(rule.rule_id)
+        self.results[rule.rule_id] = result
+        return result
+
+
 class BaseRule(ABC):
+    # True — правило умеет оценивать пачку транзакций колонками (evaluate_columns)
+    vectorized = False
+    # True — правилу нужен EvaluationContext (вложенные правила)
+    uses_context = False
+    # True — правило ждёт I/O (Redis, внешний сервис); асинхронный движок
+    # ожидает такие правила параллельно через evaluate_async
+    io_bound = False
+    # True — оценка меняет внешнее состояние (velocity-счётчики): пакетно
+    # правило оценивается только для транзакций, дошедших до него по плану
+    stateful = False
+
     def __init__(
         self,
         rule_id: int,
@@ -49,6 +137,40 @@ class BaseRule(ABC):
         """
         ...
 
+    async def evaluate_async(self, transaction: Dict[str, Any]) -> RuleResult:
+        """
+        Асинхронная оценка. По умолчанию — обычный evaluate;
+        I/O-правила переопределяют метод, чтобы не блокировать event loop.
+        """
+        return self.evaluate(transaction)
+
+    def evaluate_in_context(self, context: EvaluationContext) -> RuleResult:
+        """Оценка в рамках общего контекста транзакции."""
+        return self.evaluate(context.transaction)
+
+    def compile(self) -> Callable[[Dict[str, Any]], RuleResult]:
+        """
+        Возвращает функцию оценки для плана RuleEngine.
+        Правила с дорогой подготовкой переопределяют метод и
+        возвращают заранее собранный предикат.
+        """
+        return self.evaluate
+
+    def evaluate_batch(self, transactions: List[Dict[str, Any]], columns) -> List[Optional[RuleResult]]:
+        """
+        Пакетная оценка по колонкам (см. TransactionColumns).
+        None в позиции — транзакцию нужно оценить через evaluate.
+        """
+        return [None] * len(transactions)
+
+    def evaluate_columns(self, transactions: List[Dict[str, Any]], columns) -> ColumnResults:
+        """
+        Пакетная оценка массивами исходов (см. ColumnResults) — её использует
+        RuleEngine.evaluate_batch. По умолчанию собирается из evaluate_batch;
+        правила, умеющие считать исходы колонкой, переопределяют метод.
+        """
+        return ColumnResults.from_results(self.evaluate_batch(transactions, columns))
+
     def get_name(self) -> str:
         """Имя правила."""
         return self.name
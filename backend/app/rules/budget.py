@@ -0,0 +1,109 @@
+import logging
+from typing import Dict, Optional
+
+from .base_rule import BaseRule, RuleResult
+
+logger = logging.getLogger(__name__)
+
+
+class RuleDegraded(Exception):
+    """Правило не оценено: ожидание I/O-правила превысило бюджет (timeout),
+    правило отключено (bypassed) или исчерпан бюджет транзакции (deadline)"""
+
+    def __init__(self, reason: str):
+        super().__init__(f"Rule degraded: {reason}")
+        self.reason = reason
+
+
+class RuleBudget:
+    """
+    Бюджет времени правила и состояние его автоотключения.
+    После failure_threshold таймаутов подряд правило обходится
+    cooldown секунд; первая оценка после паузы либо сбрасывает счётчик,
+    либо снова отключает правило.
+    """
+    __slots__ = (
+        "rule_id", "timeout", "fallback_score", "failure_threshold", "cooldown",
+        "consecutive_timeouts", "open_until"
+    )
+
+    def __init__(
+        self,
+        rule_id: int,
+        timeout: Optional[float],
+        fallback_score: Optional[float] = None,
+        failure_threshold: int = 3,
+        cooldown: float = 30.0
+    ):
+        self.rule_id = rule_id
+        self.timeout = timeout
+        self.fallback_score = fallback_score
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.consecutive_timeouts = 0
+        self.open_until = 0.0
+
+    def allows(self, now: float) -> bool:
+        """False — правило временно обходится"""
+        return now >= self.open_until
+
+    def record_success(self):
+        self.consecutive_timeouts = 0
+
+    def record_timeout(self, now: float):
+        self.consecutive_timeouts += 1
+        if self.consecutive_timeouts >= self.failure_threshold:
+            self.open_until = now + self.cooldown
+            logger.warning(
+                f"Rule {self.rule_id} timed out {self.consecutive_timeouts} times in a row, "
+                f"bypassing for {self.cooldown}s"
+            )
+
+    def fallback_result(self, reason: str) -> Optional[RuleResult]:
+        """Результат с запасным скором или None, если правило просто пропускается"""
+        if self.fallback_score is None:
+            return None
+        return RuleResult(
+            passed=True,
+            risk_score=self.fallback_score,
+            details={
+                "reason": f"Rule degraded: {reason}",
+                "fallback_risk_score": self.fallback_score,
+                "degraded": True
+            }
+        )
+
+
+class RuleBudgets:
+    """
+    Реестр бюджетов правил движка. Состояние автоотключения хранится по rule_id
+    и переживает перезагрузку правил.
+    Параметры правила: timeout_ms — бюджет, fallback_risk_score — запасной скор.
+    """
+
+    def __init__(
+        self,
+        rule_timeout_ms: Optional[float] = None,
+        failure_threshold: int = 3,
+        cooldown_seconds: float = 30.0
+    ):
+        self.rule_timeout_ms = rule_timeout_ms
+        self.failure_threshold = failure_threshold
+        self.cooldown_seconds = cooldown_seconds
+        self._budgets: Dict[int, RuleBudget] = {}
+
+    def for_rule(self, rule: BaseRule) -> Optional[RuleBudget]:
+        timeout_ms = rule.parameters.get("timeout_ms", self.rule_timeout_ms)
+        fallback = rule.parameters.get("fallback_risk_score")
+        if timeout_ms is None:
+            self._budgets.pop(rule.rule_id, None)
+            return None
+
+        budget = self._budgets.get(rule.rule_id)
+        if budget is None:
+            budget = self._budgets[rule.rule_id] = RuleBudget(rule.rule_id, None)
+        budget.timeout = float(timeout_ms) / 1000.0
+        budget.fallback_score = float(fallback) if fallback is not None else None
+        budget.failure_threshold = self.failure_threshold
+        budget.cooldown = self.cooldown_seconds
+        return budget
@@ -0,0 +1,155 @@
+import logging
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class ColumnResults:
+    """
+    Результаты правила по пачке массивами по строкам:
+    triggered — правило сработало, scores — риск-скор, known — строка
+    посчитана векторно (остальные движок оценивает скалярно через evaluate).
+    Сам RuleResult строится лениво вызовом make(row) — только для строк,
+    которые попадают в результат оценки; make_dict(row, timestamp_iso) —
+    сразу словарь RuleResult.to_dict без промежуточного объекта.
+    """
+    __slots__ = ("triggered", "scores", "known", "complete", "_make", "_make_dict")
+
+    def __init__(
+        self,
+        triggered: np.ndarray,
+        scores: np.ndarray,
+        known: np.ndarray,
+        make: Callable[[int], Any],
+        make_dict: Optional[Callable[[int, str], Dict[str, Any]]] = None
+    ):
+        self.triggered = triggered
+        self.scores = scores
+        self.known = known
+        self.complete = bool(known.all())
+        self._make = make
+        self._make_dict = make_dict
+
+    @classmethod
+    def from_results(cls, results: List[Optional[Any]]) -> "ColumnResults":
+        """Из готового списка RuleResult (None — строку нужно оценить скалярно)"""
+        size = len(results)
+        return cls(
+            np.fromiter((r is not None and not r.passed for r in results), dtype=bool, count=size),
+            np.fromiter((r.risk_score if r is not None else 0.0 for r in results), dtype=np.float64, count=size),
+            np.fromiter((r is not None for r in results), dtype=bool, count=size),
+            results.__getitem__
+        )
+
+    @classmethod
+    def unknown(cls, size: int) -> "ColumnResults":
+        """Ни одна строка не посчитана — вся пачка оценивается скалярно"""
+        return cls(np.zeros(size, dtype=bool), np.zeros(size), np.zeros(size, dtype=bool), lambda row: None)
+
+    def result(self, row: int) -> Any:
+        """RuleResult строки, посчитанной векторно"""
+        return self._make(row)
+
+    def result_dict(self, row: int, timestamp_iso: str) -> Dict[str, Any]:
+        """Результат строки в виде RuleResult.to_dict"""
+        if self._make_dict is not None:
+            return self._make_dict(row, timestamp_iso)
+        return self._make(row).to_dict(timestamp_iso)
+
+    def __getitem__(self, row: int) -> Optional[Any]:
+        if not self.known[row]:
+            return None
+        return self._make(row)
+
+    def __len__(self) -> int:
+        return len(self.known)
+
+    def results(self) -> List[Optional[Any]]:
+        """Все строки списком RuleResult (None — строку нужно оценить скалярно)"""
+        return [self[row] for row in range(len(self.known))]
+
+
+class TransactionColumns:
+    """
+    Колоночное представление пачки транзакций для векторной оценки.
+    Колонки строятся лениво и кэшируются: каждое поле разбирается
+    один раз на пачку, сколько бы правил его ни использовало.
+    """
+
+    def __init__(self, transactions: List[Dict[str, Any]]):
+        self.transactions = transactions
+        self.size = len(transactions)
+        self._columns: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        self._time_features = None
+
+    def column(self, field: str) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Возвращает (values, present) для поля.
+        values — float64, если все присутствующие значения числовые,
+        иначе object-массив с исходными значениями.
+        present — маска транзакций, в которых поле есть.
+        """
+        cached = self._columns.get(field)
+        if cached is not None:
+            return cached
+
+        missing = object()
+        raw = [tx.get(field, missing) for tx in self.transactions]
+        present = np.fromiter((v is not missing for v in raw), dtype=bool, count=self.size)
+        numeric = all(
+            isinstance(v, (int, float)) and not isinstance(v, bool)
+            for v, p in zip(raw, present) if p
+        )
+        if numeric:
+            values = np.fromiter(
+                (v if p else 0.0 for v, p in zip(raw, present)),
+                dtype=np.float64,
+                count=self.size
+            )
+        else:
+            values = np.empty(self.size, dtype=object)
+            values[:] = [v if p else None for v, p in zip(raw, present)]
+
+        self._columns[field] = (values, present)
+        return values, present
+
+    def numeric_column(self, field: str, default: float = 0.0) -> np.ndarray:
+        """Колонка float64 с приведением float(...) и значением по умолчанию."""
+        return np.fromiter(
+            (float(tx.get(field, default)) for tx in self.transactions),
+            dtype=np.float64,
+            count=self.size
+        )
+
+    def time_features(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Час и день недели по полю timestamp (int64-колонки).
+        Разбор повторяет MLModelSimulator.extract_features: при отсутствии
+        или ошибке разбора — 12 часов, понедельник.
+        """
+        if self._time_features is not None:
+            return self._time_features
+
+        hours = np.full(self.size, 12, dtype=np.int64)
+        weekdays = np.zeros(self.size, dtype=np.int64)
+        for i, tx in enumerate(self.transactions):
+            timestamp = tx.get("timestamp")
+            if not timestamp:
+                continue
+            try:
+                if isinstance(timestamp, str):
+                    dt = datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
+                else:
+                    dt = timestamp
+                hours[i] = dt.hour
+                weekdays[i] = dt.weekday()
+            except Exception as e:
+                logger.warning(f"Failed to parse timestamp: {e}")
+                hours[i] = 12
+                weekdays[i] = 0
+
+        self._time_features = (hours, weekdays)
+        return self._time_features
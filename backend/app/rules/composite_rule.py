@@ -1,9 +1,11 @@
 import logging
 from typing import Dict, Any, List
-from .base_rule import BaseRule, RuleResult
+from .base_rule import BaseRule, RuleResult, EvaluationContext
 logger = logging.getLogger(__name__)
 
 class CompositeRule(BaseRule):
+    uses_context = True
+
     def __init__(self, rule_id: int, name:str, enabled = True, parameters = None,rules_registry: Dict[int, BaseRule] = None,priority:int=5):
         super().__init__(rule_id, name, enabled, parameters,priority)
          
@@ -21,16 +23,39 @@ class CompositeRule(BaseRule):
         
         self.rules_registry = rules_registry or {}
         self.custom_risk_score = self.parameters.get("risk_score")
+        # Ленивая оценка: AND останавливается на первом непройденном условии,
+        # OR — на первом сработавшем. False — оценивать все вложенные правила
+        self.short_circuit = bool(self.parameters.get("short_circuit", True))
+        # Остановка не должна менять риск: несработавший AND даёт 0, а риск
+        # сработавшего OR без risk_score — среднее по всем вложенным правилам
+        self._stop_when = None
+        if self.short_circuit:
+            if self.operator == "AND":
+                self._stop_when = True
+            elif self.custom_risk_score is not None:
+                self._stop_when = False
 
     def evaluate(self, transaction: Dict[str, Any]) -> RuleResult:
         """
         Рекурсивно оценивает все вложенные правила и комбинирует результаты
         в зависимости от оператора AND/OR.
         """
-        nested_results = []
+        return self.evaluate_in_context(EvaluationContext(transaction))
+
+    def evaluate_in_context(self, context: EvaluationContext) -> RuleResult:
+        """
+        Оценивает вложенные правила через общий контекст транзакции:
+        правило, уже оценённое движком или другим композитом, берётся из кэша.
+        При short_circuit оценка прекращается, как только исход известен и
+        риск от оставшихся правил не зависит (AND; OR с заданным risk_score) —
+        результат тот же, что при полной оценке, короче только nested_results.
+        """
+        # (rule_id, правило, результат, ошибка) — словари строятся лениво в _details
+        nested = []
+        nested_passed = []
         nested_risk_scores = []
         
-        # Проверяем все вложенные правила
+        # Проверяем вложенные правила
         for rule_id in self.nested_rule_ids:
             nested_rule = self.rules_registry.get(rule_id)
             
@@ -43,23 +68,20 @@ class CompositeRule(BaseRule):
                 continue
             
             try:
-                result = nested_rule.evaluate(transaction)
-                nested_results.append({
-                    "rule_id": rule_id,
-                    "rule_name": nested_rule.get_name(),
-                    "passed": result.passed,
-                    "risk_score": result.risk_score,
-                    "details": result.details
-                })
+                result = context.resolve(nested_rule)
+                nested.append((rule_id, nested_rule, result, None))
+                nested_passed.append(result.passed)
                 nested_risk_scores.append(result.risk_score)
             except Exception as e:
                 logger.error(f"Error evaluating nested rule {rule_id}: {e}")
-                nested_results.append({
-                    "rule_id": rule_id,
-                    "error": str(e)
-                })
+                nested.append((rule_id, nested_rule, None, str(e)))
+                continue
+
+            # AND уже не выполнится, OR уже выполнен
+            if self._stop_when is not None and result.passed == self._stop_when:
+                break
         
-        if not nested_results:
+        if not nested:
             logger.warning(f"No valid nested rules evaluated in CompositeRule {self.rule_id}")
             return RuleResult(
                 passed=True,
@@ -74,12 +96,10 @@ class CompositeRule(BaseRule):
         # Применяем логический оператор
         if self.operator == "AND":
             # Все правила должны НЕ пройти (passed=False), чтобы композитное правило сработало
-            all_failed = all(not r["passed"] for r in nested_results if "passed" in r)
-            condition_met = all_failed
+            condition_met = not any(nested_passed)
         else:  # OR
             # Хотя бы одно правило должно НЕ пройти (passed=False)
-            any_failed = any(not r["passed"] for r in nested_results if "passed" in r)
-            condition_met = any_failed
+            condition_met = not all(nested_passed)
         
         # Вычисляем агрегированный риск-скор
         if self.custom_risk_score is not None:
@@ -92,28 +112,58 @@ class CompositeRule(BaseRule):
             aggregated_risk = 0.0
         
         if condition_met:
-            return RuleResult(
-                passed=False,
-                risk_score=aggregated_risk,
-                details={
-                    "reason": f"Composite rule triggered ({self.operator})",
-                    "operator": self.operator,
-                    "nested_results": nested_results,
-                    "aggregated_risk_score": aggregated_risk,
-                    "condition_met": True
-                }
-            )
-        else:
-            return RuleResult(
-                passed=True,
-                risk_score=0.0,
-                details={
-                    "reason": f"Composite rule not triggered ({self.operator})",
-                    "operator": self.operator,
-                    "nested_results": nested_results,
-                    "condition_met": False
-                }
-            )
+            return RuleResult.lazy(False, aggregated_risk, self._details, nested, True, aggregated_risk)
+        return RuleResult.lazy(True, 0.0, self._details, nested, False, aggregated_risk)
+
+    def has_pending_io(self, context: EvaluationContext, _seen: set = None) -> bool:
+        """
+        Есть ли среди вложенных правил (рекурсивно) I/O-правила,
+        результата которых ещё нет в контексте.
+        """
+        seen = _seen if _seen is not None else set()
+        seen.add(self.rule_id)
+        for rule_id in self.nested_rule_ids:
+            nested_rule = self.rules_registry.get(rule_id)
+            if not nested_rule or not nested_rule.is_enabled() or rule_id in context.results:
+                continue
+            if nested_rule.uses_context:
+                if rule_id not in seen and nested_rule.has_pending_io(context, seen):
+                    return True
+            elif nested_rule.io_bound:
+                return True
+        return False
+
+    def _details(self, nested: List[tuple], condition_met: bool, aggregated_risk: float) -> Dict[str, Any]:
+        nested_results = []
+        for rule_id, nested_rule, result, error in nested:
+            if error is not None:
+                nested_results.append({
+                    "rule_id": rule_id,
+                    "error": error
+                })
+                continue
+            nested_results.append({
+                "rule_id": rule_id,
+                "rule_name": nested_rule.get_name(),
+                "passed": result.passed,
+                "risk_score": result.risk_score,
+                "details": result.details
+            })
+
+        if condition_met:
+            return {
+                "reason": f"Composite rule triggered ({self.operator})",
+                "operator": self.operator,
+                "nested_results": nested_results,
+                "aggregated_risk_score": aggregated_risk,
+                "condition_met": True
+            }
+        return {
+            "reason": f"Composite rule not triggered ({self.operator})",
+            "operator": self.operator,
+            "nested_results": nested_results,
+            "condition_met": False
+        }
 
     def __repr__(self):
         rule_ids = ", ".join(str(rid) for rid in self.nested_rule_ids)
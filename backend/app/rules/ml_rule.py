@@ -1,13 +1,19 @@
 import logging
-from typing import Any, Dict
+from typing import Any, Dict, List, Optional
+
+import numpy as np
 
 from .base_rule import BaseRule, RuleResult
+from .columns import ColumnResults, TransactionColumns
 from backend.app.services.ml_service import get_ml_model
 
 
 logger = logging.getLogger(__name__)
 
 class MLRule(BaseRule):
+    # Правило поддерживает RuleEngine.evaluate_batch (evaluate_columns)
+    vectorized = True
+
     def __init__(self, rule_id:int, name:str, enabled = True, parameters = None):
         super().__init__(rule_id, name, enabled, parameters)
 
@@ -36,33 +42,7 @@ class MLRule(BaseRule):
             # Получаем предсказание модели
             fraud_probability = self.ml_model.predict(features)
             
-            # Сравниваем с порогом
-            condition_met = fraud_probability >= self.threshold
-            
-            if condition_met:
-                return RuleResult(
-                    passed=False,
-                    risk_score=fraud_probability,
-                    details={
-                        "reason": f"ML model detected fraud probability: {fraud_probability:.3f} >= {self.threshold}",
-                        "fraud_probability": fraud_probability,
-                        "threshold": self.threshold,
-                        "features": features,
-                        "condition_met": True
-                    }
-                )
-            else:
-                return RuleResult(
-                    passed=True,
-                    risk_score=fraud_probability,
-                    details={
-                        "reason": f"ML model fraud probability below threshold: {fraud_probability:.3f} < {self.threshold}",
-                        "fraud_probability": fraud_probability,
-                        "threshold": self.threshold,
-                        "features": features,
-                        "condition_met": False
-                    }
-                )
+            return self._make_result(fraud_probability, features)
                 
         except Exception as e:
             logger.error(f"Error in MLRule evaluation: {e}")
@@ -75,6 +55,58 @@ class MLRule(BaseRule):
                 }
             )
 
+    def _make_result(self, fraud_probability: float, features: Dict[str, Any]) -> RuleResult:
+        # Сравниваем с порогом
+        condition_met = fraud_probability >= self.threshold
+        return RuleResult.lazy(
+            not condition_met,
+            fraud_probability,
+            self._details,
+            fraud_probability,
+            features,
+            condition_met
+        )
+
+    def _details(self, fraud_probability: float, features: Dict[str, Any], condition_met: bool) -> Dict[str, Any]:
+        if condition_met:
+            reason = f"ML model detected fraud probability: {fraud_probability:.3f} >= {self.threshold}"
+        else:
+            reason = f"ML model fraud probability below threshold: {fraud_probability:.3f} < {self.threshold}"
+        return {
+            "reason": reason,
+            "fraud_probability": fraud_probability,
+            "threshold": self.threshold,
+            "features": features,
+            "condition_met": condition_met
+        }
+
+    def evaluate_columns(
+        self,
+        transactions: List[Dict[str, Any]],
+        columns: TransactionColumns
+    ) -> ColumnResults:
+        """
+        Векторная оценка пачки: признаки собираются колонками,
+        модель вызывается один раз на всю пачку. RuleResult с признаками
+        строится только для строк, попавших в результат.
+        """
+        try:
+            features = self.ml_model.extract_features_batch(columns)
+            probabilities = self.ml_model.predict_batch(features)
+        except Exception as e:
+            logger.warning(f"Batch ML evaluation failed, falling back to per-transaction: {e}")
+            return ColumnResults.unknown(columns.size)
+
+        rows: List[Optional[Dict[str, Any]]] = []
+
+        def make(row: int) -> RuleResult:
+            if not rows:
+                rows.extend(self.ml_model.feature_rows(features))
+            return self._make_result(float(probabilities[row]), rows[row])
+
+        triggered = probabilities >= self.threshold
+        return ColumnResults(triggered, probabilities, np.ones(columns.size, dtype=bool), make)
+
     def __repr__(self):
         return (
             f"<MLRule id={self.rule_id} name='{self.name}' "
@@ -1,29 +1,27 @@
 import logging
-from typing import Dict, Any
-from datetime import timedelta
-import redis
+import time
+from typing import Dict, Any, Callable, List, Optional
 
 from .base_rule import BaseRule, RuleResult
+from .velocity_store import VelocityBatch, VelocityStore, get_velocity_store
 
 logger = logging.getLogger(__name__)
 
-# Инициализация Redis-клиента 
-redis_client = redis.Redis(
-    host="localhost",
-    port=6379,
-    db=0,
-    decode_responses=True
-)
-
 
 class PatternRule(BaseRule):
+    io_bound = True
+    # Пачка транзакций обновляет счётчики одним обменом с хранилищем
+    vectorized = True
+    stateful = True
+
     def __init__(
         self,
         rule_id: int,
         name: str,
         enabled: bool = True,
         parameters: Dict[str, Any] = None,
-        priority: int = 5
+        priority: int = 5,
+        store: Optional[VelocityStore] = None
     ):
         super().__init__(rule_id, name, enabled, parameters,priority)
         if "max_transactions" not in self.parameters or "time_window_minutes" not in self.parameters:
@@ -31,47 +29,101 @@ class PatternRule(BaseRule):
         self.max_tx = int(self.parameters["max_transactions"])
         self.window = int(self.parameters["time_window_minutes"])
         self.field = self.parameters.get("field", "from_account")
+        # Хранилище счётчиков: Redis или память процесса (VELOCITY_BACKEND)
+        self.store = store if store is not None else get_velocity_store()
+        self.io_bound = self.store.remote
+
+    def velocity_key(self, value: Any) -> str:
+        """Ключ счётчика: отдельный для каждого правила и поля"""
+        return f"velocity:{self.rule_id}:{self.field}:{value}"
 
     def evaluate(self, transaction: Dict[str, Any]) -> RuleResult:
-        from_acc = transaction.get("from_account")
-        if not from_acc:
+        value = transaction.get(self.field)
+        if not value:
             return RuleResult(
                 passed=True,
                 risk_score=0.0,
-                details={"reason": "no from_account field"}
-            )
-        key = f"account:{from_acc}:count"
-        # Увеличиваем счётчик и устанавливаем TTL, если новый ключ
-        count = redis_client.incr(key)
-        # Если первый раз, устанавливаем TTL
-        if count == 1:
-            redis_client.expire(key, self.window * 60)
-        # Проверяем условие
-        if count > self.max_tx:
-            # сработало правило
-            return RuleResult(
-                passed=False,
-                risk_score=0.5,
-                details={
-                    "reason": f"{count} transactions in last {self.window} minutes",
-                    "from_account": from_acc,
-                    "count": count,
-                    "max_transactions": self.max_tx,
-                    "time_window_minutes": self.window
-                }
+                details={"reason": f"no {self.field} field"}
             )
-        # не сработало
-        return RuleResult(
-            passed=True,
-            risk_score=0.0,
-            details={
-                "reason": f"{count} transactions in last {self.window} minutes",
-                "from_account": from_acc,
-                "count": count,
-                "max_transactions": self.max_tx,
-                "time_window_minutes": self.window
-            }
+        # Число событий за последние window минут, включая текущее
+        count = self.store.hit(
+            self.velocity_key(value),
+            int(time.time() * 1000),
+            self.window * 60 * 1000
         )
+        return self._make_result(value, count)
+
+    def evaluate_batch(self, transactions: List[Dict[str, Any]], columns=None) -> List[Optional[RuleResult]]:
+        """
+        Счётчики всей пачки — одним конвейером, в порядке транзакций.
+        Транзакции без поля остаются None и оцениваются через evaluate.
+        """
+        batch = self.store.batch()
+        finish = self.defer_batch(transactions, batch)
+        batch.execute()
+        return finish()
+
+    def defer_batch(
+        self,
+        transactions: List[Dict[str, Any]],
+        batch: VelocityBatch
+    ) -> Callable[[], List[Optional[RuleResult]]]:
+        """
+        Ставит обновления счётчиков пачки в batch (общий для нескольких правил).
+        Возвращает функцию, собирающую результаты после batch.execute().
+        """
+        now_ms = int(time.time() * 1000)
+        rows = []
+        values = []
+        hits = []
+        for row, transaction in enumerate(transactions):
+            value = transaction.get(self.field)
+            if value:
+                rows.append(row)
+                values.append(value)
+                hits.append((self.velocity_key(value), now_ms))
+
+        handle = batch.hit_many(hits, self.window * 60 * 1000)
+
+        def finish() -> List[Optional[RuleResult]]:
+            results: List[Optional[RuleResult]] = [None] * len(transactions)
+            for row, value, count in zip(rows, values, batch.result(handle)):
+                results[row] = self._make_result(value, count)
+            return results
+
+        return finish
+
+    def _make_result(self, value: Any, count: int) -> RuleResult:
+        # Проверяем условие: count > max_tx — правило сработало
+        triggered = count > self.max_tx
+        return RuleResult.lazy(
+            not triggered,
+            0.5 if triggered else 0.0,
+            self._details,
+            value,
+            count
+        )
+
+    async def evaluate_async(self, transaction: Dict[str, Any]) -> RuleResult:
+        """Обмен с хранилищем через асинхронный пул — event loop не блокируется."""
+        if not self.store.remote:
+            return self.evaluate(transaction)
+        batch = self.store.batch()
+        finish = self.defer_batch([transaction], batch)
+        await batch.execute_async()
+        result = finish()[0]
+        # None — нет ключевых полей, evaluate ответит без обращения к хранилищу
+        return result if result is not None else self.evaluate(transaction)
+
+    def _details(self, value: Any, count: int) -> Dict[str, Any]:
+        return {
+            "reason": f"{count} transactions in last {self.window} minutes",
+            "field": self.field,
+            self.field: value,
+            "count": count,
+            "max_transactions": self.max_tx,
+            "time_window_minutes": self.window
+        }
 
     def __repr__(self):
         return (
@@ -1,98 +1,1164 @@
+import asyncio
+import gc
 import logging
-from typing import List, Dict, Any
-from .base_rule import BaseRule
+import os
+import threading
+from collections.abc import Sequence
+from contextlib import contextmanager
+from time import perf_counter
+from datetime import datetime
+from typing import List, Dict, Any, Callable, Generator, Optional, Set, Tuple, Union
+import numpy as np
+from .base_rule import BaseRule, RuleResult, EvaluationContext
+from .budget import RuleBudget, RuleBudgets, RuleDegraded
+from .columns import ColumnResults, TransactionColumns
+from .rule_snapshot import RuleSetSnapshot
+from .velocity_store import VelocityBatch
 
 logger = logging.getLogger(__name__)
 
+# Результаты пачки по позициям плана: ColumnResults векторизуемых правил или
+# список RuleResult по строкам (velocity-правила); None — оценка построчно
+BatchResults = List[Optional[Union[ColumnResults, List[Optional[RuleResult]]]]]
+
+
+def _env_ms(name: str) -> Optional[float]:
+    """Бюджет в миллисекундах из переменной окружения (пусто — без ограничения)"""
+    value = os.getenv(name)
+    return float(value) if value else None
+
+
+class _Tally:
+    """Накопитель результатов оценки одной транзакции"""
+    __slots__ = (
+        "snapshot", "lean", "timestamp", "timestamp_iso",
+        "results", "total_score", "triggered", "degraded"
+    )
+
+    def __init__(self, snapshot: RuleSetSnapshot, lean: bool):
+        self.snapshot = snapshot
+        self.lean = lean
+        self.timestamp = datetime.utcnow()
+        self.timestamp_iso = None if lean else self.timestamp.isoformat() + "Z"
+        self.results: List[Dict[str, Any]] = []
+        self.total_score = 0.0
+        self.triggered: List[str] = []
+        self.degraded: List[Dict[str, Any]] = []
+
+    def add(self, position: int, res: RuleResult, overran: bool = False) -> bool:
+        """
+        Учитывает результат правила; True — сработало критическое правило.
+        overran — синхронная оценка превысила бюджет правила: результат
+        используется, превышение отмечается в записи и в degraded_rules.
+        """
+        rule_id, rule_name, critical, _, _ = self.snapshot.plan[position]
+        if res.timestamp is None:
+            res.timestamp = self.timestamp
+        entry = {
+            "rule_id": rule_id,
+            "rule_name": rule_name,
+            "result": res if self.lean else res.to_dict(self.timestamp_iso)
+        }
+        if overran:
+            entry["timed_out"] = True
+            self.snapshot.stats[position].degraded("timeout")
+            self.degraded.append({"rule_id": rule_id, "rule_name": rule_name, "reason": "timeout"})
+        self.results.append(entry)
+        self.total_score += res.risk_score
+        if not res.passed:
+            self.triggered.append(rule_name)
+            self.snapshot.stats[position].triggers.inc()
+
+            # Проверяем критическое правило
+            if critical:
+                logger.warning(f"CRITICAL RULE TRIGGERED: {rule_name}. Stopping evaluation.")
+                return True
+        return False
+
+    def error(self, position: int, error: BaseException):
+        rule_id, rule_name, _, _, rule = self.snapshot.plan[position]
+        self.snapshot.stats[position].errors.inc()
+        logger.error(f"Error in rule {rule}: {error}")
+        self.results.append({
+            "rule_id": rule_id,
+            "rule_name": rule_name,
+            "error": str(error)
+        })
+
+    def degrade(self, position: int, reason: str):
+        """Правило не оценено: запасной результат, если он задан, иначе пропуск"""
+        rule_id, rule_name, _, _, _ = self.snapshot.plan[position]
+        self.snapshot.stats[position].degraded(reason)
+        self.degraded.append({"rule_id": rule_id, "rule_name": rule_name, "reason": reason})
+        budget = self.snapshot.budgets[position]
+        fallback = budget.fallback_result(reason) if budget is not None else None
+        if fallback is None:
+            self.results.append({"rule_id": rule_id, "rule_name": rule_name, "skipped": reason})
+            return
+        fallback.timestamp = self.timestamp
+        self.results.append({
+            "rule_id": rule_id,
+            "rule_name": rule_name,
+            "result": fallback if self.lean else fallback.to_dict(self.timestamp_iso),
+            "degraded": reason
+        })
+        self.total_score += fallback.risk_score
+
+    def expire(self, start: int):
+        """Бюджет транзакции исчерпан: правила с позиции start не оцениваются"""
+        logger.warning(f"Transaction budget exhausted, {len(self.snapshot.plan) - start} rules left unevaluated")
+        for position in range(start, len(self.snapshot.plan)):
+            self.degrade(position, "deadline")
+
+    def summary(self) -> Dict[str, Any]:
+        """Итоговый результат оценки по собранным результатам правил"""
+        plan = self.snapshot.plan
+        avg_score = self.total_score / len(plan) if plan else 0.0
+        evaluation = {
+            "is_suspicious": len(self.triggered) > 0,
+            "risk_score": avg_score,
+            "triggered_rules": self.triggered,
+            "checked_rules": len(plan),
+            "rule_set_version": self.snapshot.version,
+            "details": self.results
+        }
+        if self.degraded:
+            evaluation["degraded_rules"] = self.degraded
+        if self.lean:
+            evaluation["timestamp"] = self.timestamp
+        return evaluation
+
+
+@contextmanager
+def _gc_paused():
+    """
+    Циклический сборщик на время матричной оценки пачки не запускается:
+    тысячи живых RuleResult и словарей details иначе многократно обходятся
+    полными проходами gc, хотя циклов в них нет. Подсчёт ссылок работает как обычно.
+    """
+    enabled = gc.isenabled()
+    if enabled:
+        gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+class _BatchOutcomes:
+    """
+    Результаты пачки по ячейкам [позиция плана × строка]: ColumnResults
+    векторизуемых правил, ячейки, посчитанные построчно (cells), и ошибки.
+    """
+    __slots__ = ("plan", "batch", "cells", "errors", "positions")
+
+    def __init__(self, plan, batch: "BatchResults"):
+        self.plan = plan
+        self.batch = batch
+        self.cells: List[Optional[Dict[int, RuleResult]]] = [None] * len(plan)
+        self.errors: Dict[Tuple[int, int], str] = {}
+        self.positions = {entry[0]: position for position, entry in enumerate(plan)}
+
+    def set(self, position: int, row: int, res: RuleResult):
+        cells = self.cells[position]
+        if cells is None:
+            cells = self.cells[position] = {}
+        cells[row] = res
+
+    def result(self, position: int, row: int) -> Optional[RuleResult]:
+        """Уже известный результат ячейки или None"""
+        cells = self.cells[position]
+        if cells is not None:
+            res = cells.get(row)
+            if res is not None:
+                return res
+        # ColumnResults или результаты velocity-конвейера этапа
+        precomputed = self.batch[position]
+        if precomputed is not None:
+            return precomputed[row]
+        return None
+
+    def entry(
+        self,
+        position: int,
+        row: int,
+        timestamp: datetime,
+        timestamp_iso: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """Запись details для ячейки; timestamp_iso=None — lean (объект RuleResult)"""
+        rule_id, rule_name, _, _, _ = self.plan[position]
+        error = self.errors.get((position, row)) if self.errors else None
+        if error is not None:
+            return {"rule_id": rule_id, "rule_name": rule_name, "error": error}
+        cells = self.cells[position]
+        res = cells.get(row) if cells is not None else None
+        if res is None:
+            precomputed = self.batch[position]
+            if timestamp_iso is not None:
+                return {
+                    "rule_id": rule_id,
+                    "rule_name": rule_name,
+                    "result": precomputed.result_dict(row, timestamp_iso)
+                }
+            res = precomputed.result(row)
+        if res.timestamp is None:
+            res.timestamp = timestamp
+        return {
+            "rule_id": rule_id,
+            "rule_name": rule_name,
+            "result": res if timestamp_iso is None else res.to_dict(timestamp_iso)
+        }
+
+
+class _BatchContext(EvaluationContext):
+    """
+    Контекст строки пачки для составных правил: результаты вложенных правил,
+    уже посчитанные для пачки, берутся из _BatchOutcomes по требованию,
+    а не копируются в контекст для каждой строки заранее.
+    """
+    __slots__ = ("outcomes", "row")
+
+    def __init__(self, transaction: Dict[str, Any], outcomes: _BatchOutcomes, row: int):
+        super().__init__(transaction)
+        self.outcomes = outcomes
+        self.row = row
+
+    def resolve(self, rule: BaseRule) -> RuleResult:
+        result = self.results.get(rule.rule_id)
+        if result is not None:
+            return result
+        position = self.outcomes.positions.get(rule.rule_id)
+        if position is not None:
+            result = self.outcomes.result(position, self.row)
+            if result is not None:
+                self.results[rule.rule_id] = result
+                return result
+        return super().resolve(rule)
+
+
+class _MatrixDetails(Sequence):
+    """
+    details lean-оценки пачки: записи и RuleResult строятся при обходе
+    (materialize), а не для каждой ячейки матрицы заранее.
+    """
+    __slots__ = ("outcomes", "row", "size", "timestamp")
+
+    def __init__(self, outcomes: _BatchOutcomes, row: int, size: int, timestamp: datetime):
+        self.outcomes = outcomes
+        self.row = row
+        self.size = size
+        self.timestamp = timestamp
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self.size))]
+        if index < 0:
+            index += self.size
+        if not 0 <= index < self.size:
+            raise IndexError(index)
+        return self.outcomes.entry(index, self.row, self.timestamp)
+
+
 class RuleEngine:
     """
-    Контейнер для управления правилами
+    Контейнер для управления правилами.
+    Правила хранятся в неизменяемом RuleSetSnapshot; любое изменение
+    собирает новый снимок со следующей версией и атомарно подменяет ссылку.
+    rule_timeout_ms — бюджет правила по умолчанию (параметр правила timeout_ms
+    переопределяет его), transaction_timeout_ms — бюджет всей оценки транзакции.
     """
-    def __init__(self):
-        self.rules: List[BaseRule] = []
+    def __init__(
+        self,
+        rule_timeout_ms: Optional[float] = None,
+        transaction_timeout_ms: Optional[float] = None
+    ):
+        self.budgets = RuleBudgets(rule_timeout_ms)
+        self.transaction_timeout = transaction_timeout_ms / 1000.0 if transaction_timeout_ms else None
+        self._snapshot = RuleSetSnapshot((), version=0)
+        # Сериализует только писателей; читатели берут текущий снимок без блокировок
+        self._write_lock = threading.Lock()
         logger.info("RuleEngine initialized")
 
+    @property
+    def rules(self) -> List[BaseRule]:
+        """Правила текущего снимка, отсортированные по приоритету"""
+        return list(self._snapshot.rules)
+
+    @property
+    def version(self) -> int:
+        """Версия текущего снимка правил"""
+        return self._snapshot.version
+
+    def get_snapshot(self) -> RuleSetSnapshot:
+        """Текущий снимок — для закрепления нескольких оценок за одной версией"""
+        return self._snapshot
+
+    def _publish(self, rules: List[BaseRule]) -> RuleSetSnapshot:
+        """Собирает новый снимок и атомарно подменяет текущий (вызывать под _write_lock)"""
+        snapshot = RuleSetSnapshot(rules, version=self._snapshot.version + 1, budgets=self.budgets)
+        self._snapshot = snapshot
+        return snapshot
+
     def load_rules(self, rules: List[BaseRule]):
         """Загружает правила и сортирует их по приоритету"""
-        self.rules = sorted(rules, key=lambda r: r.get_priority())
-        logger.info(f"Loaded {len(rules)} rules, sorted by priority")
+        with self._write_lock:
+            snapshot = self._publish(sorted(rules, key=lambda r: r.get_priority()))
+        logger.info(f"Loaded {len(rules)} rules, sorted by priority (version {snapshot.version})")
 
     def add_rule(self, rule: BaseRule):
         """Добавляет новое правило"""
-        self.rules.append(rule)
+        with self._write_lock:
+            self._publish(list(self._snapshot.rules) + [rule])
         logger.info(f"Added rule: {rule}")
 
     def remove_rule(self, rule_id: int):
         """Удаляет правило по ID"""
-        before = len(self.rules)
-        self.rules = [r for r in self.rules if r.rule_id != rule_id]
-        after = len(self.rules)
-        logger.info(f"Removed rule_id={rule_id}. Count: {before}→{after}")
+        with self._write_lock:
+            current = self._snapshot
+            before = len(current)
+            snapshot = self._publish([r for r in current.rules if r.rule_id != rule_id])
+        logger.info(f"Removed rule_id={rule_id}. Count: {before}→{len(snapshot)}")
 
     def get_rule(self, rule_id: int) -> BaseRule:
         """Возвращает правило по ID или None"""
-        return next((r for r in self.rules if r.rule_id == rule_id), None)
+        return self._snapshot.get(rule_id)
 
     def get_active_rules(self) -> List[BaseRule]:
         """Список активных правил"""
-        return [r for r in self.rules if r.is_enabled()]
+        return list(self._snapshot.active)
+
+    def evaluate_transaction(
+        self,
+        transaction: Dict[str, Any],
+        lean: bool = False,
+        snapshot: Optional[RuleSetSnapshot] = None
+    ) -> Dict[str, Any]:
+        """
+        Оценивает транзакцию по всем активным правилам.
+        lean=True — в details остаются объекты RuleResult без сериализации,
+        см. materialize. snapshot — оценить по конкретной версии правил.
+        """
+        snapshot = snapshot or self._snapshot
+        logger.info(f"Evaluating transaction with {len(snapshot.plan)} rules")
+        resolved = self._resolve(snapshot, transaction)
+        return self._evaluate(snapshot, transaction, resolved=resolved, lean=lean)
+
+    def evaluate_batch(
+        self,
+        transactions: List[Dict[str, Any]],
+        lean: bool = False,
+        snapshot: Optional[RuleSetSnapshot] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Оценивает пачку транзакций. Векторизуемые правила (ThresholdRule, MLRule)
+        считаются по колонкам NumPy сразу для всей пачки, velocity-правила
+        (PatternRule, VelocityRule) — одним конвейером на этап, остальные — построчно.
+        Исходы сводятся матрицами [позиция плана × транзакция], см. _evaluate_matrix;
+        асинхронный вариант — evaluate_batch_async. При бюджетах правил
+        (RULE_TIMEOUT_MS, timeout_ms) или транзакции (TRANSACTION_TIMEOUT_MS)
+        пачка идёт построчным проходом _evaluate_range: автоотключение
+        проверяется перед каждым правилом, у каждой транзакции свой срок.
+        Результат по каждой транзакции совпадает с evaluate_transaction;
+        вся пачка оценивается по одному снимку правил.
+        """
+        snapshot = snapshot or self._snapshot
+        if not transactions:
+            return []
+
+        logger.info(f"Evaluating batch of {len(transactions)} transactions with {len(snapshot.plan)} rules")
+
+        if not self._budgeted(snapshot):
+            steps = self._evaluate_matrix(snapshot, transactions, lean)
+            elapsed = None
+            while True:
+                finished, value = self._advance(steps, elapsed)
+                if finished:
+                    return value
+                elapsed = self._execute_velocity(value)
+
+        columns = TransactionColumns(transactions)
+        n = len(transactions)
+        batch = self._evaluate_columns(snapshot, transactions, columns)
+
+        if not snapshot.stateful:
+            return [
+                self._evaluate(snapshot, transaction, batch, row, lean=lean)
+                for row, transaction in enumerate(transactions)
+            ]
+
+        # Velocity-правила меняют счётчики, поэтому оцениваются только для
+        # транзакций, дошедших до них: пачка идёт по этапам плана, и на каждом
+        # этапе счётчики оставшихся транзакций обновляются одним конвейером
+        # в порядке поступления.
+        tallies = [_Tally(snapshot, lean) for _ in transactions]
+        contexts = [self._context(snapshot, transaction, batch, row) for row, transaction in enumerate(transactions)]
+        deadlines: List[Optional[float]] = [None] * n
+        live = list(range(n))
+        start = 0
+        for stage in snapshot.stages:
+            if not live:
+                break
+            stop = stage[-1] + 1
+            stateful = [position for position in stage if position in snapshot.stateful]
+            if stateful:
+                self._evaluate_stateful(snapshot, stateful, transactions, live, contexts, batch)
+
+            still_live = []
+            for row in live:
+                if start == 0:
+                    deadlines[row] = self._deadline()
+                stopped = self._evaluate_range(
+                    snapshot, transactions[row], tallies[row], contexts[row],
+                    start, stop, batch, row, None, deadlines[row]
+                )
+                if not stopped:
+                    still_live.append(row)
+            live = still_live
+            start = stop
+
+        return [tally.summary() for tally in tallies]
 
-    def evaluate_transaction(self, transaction: Dict[str, Any]) -> Dict[str, Any]:
-        """Оценивает транзакцию по всем активным правилам"""
-        results = []
-        total_score = 0.0
-        triggered = []
-        active = self.get_active_rules()
+    async def evaluate_batch_async(
+        self,
+        transactions: List[Dict[str, Any]],
+        lean: bool = False,
+        snapshot: Optional[RuleSetSnapshot] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Асинхронная оценка пачки: тот же матричный проход, что в evaluate_batch,
+        но вычисления этапов идут в потоке, а конвейеры velocity-правил —
+        через асинхронный клиент хранилища (execute_async), не блокируя
+        event loop. При бюджетах правил или транзакции транзакции оцениваются по одной
+        через evaluate_transaction_async — бюджет I/O-правила ограничивает
+        ожидание ответа.
+        """
+        snapshot = snapshot or self._snapshot
+        if not transactions:
+            return []
 
-        logger.info(f"Evaluating transaction with {len(active)} rules")
+        if self._budgeted(snapshot):
+            return [
+                await self.evaluate_transaction_async(transaction, lean=lean, snapshot=snapshot)
+                for transaction in transactions
+            ]
 
-        for rule in active:
+        logger.info(f"Evaluating batch (async) of {len(transactions)} transactions with {len(snapshot.plan)} rules")
+        steps = self._evaluate_matrix(snapshot, transactions, lean)
+        elapsed = None
+        while True:
+            finished, value = await asyncio.to_thread(self._advance, steps, elapsed)
+            if finished:
+                return value
+            elapsed = await self._execute_velocity_async(value)
+
+    def _budgeted(self, snapshot: RuleSetSnapshot) -> bool:
+        """
+        Пачку нужно оценивать построчно: матричный проход идёт по всей пачке
+        сразу, поэтому не может выдержать ни бюджет правила, ни срок каждой
+        транзакции (TRANSACTION_TIMEOUT_MS).
+        """
+        return snapshot.has_budgets or self.transaction_timeout is not None
+
+    @staticmethod
+    def _advance(steps: Generator, elapsed: Optional[Dict[int, float]]) -> Tuple[bool, Any]:
+        """
+        Шаг _evaluate_matrix до следующего обмена с velocity-хранилищами.
+        (True, оценки) — проход завершён, (False, пачки операций) — их нужно
+        выполнить и передать время выполнения следующему шагу.
+        """
+        with _gc_paused():
+            try:
+                return False, steps.send(elapsed)
+            except StopIteration as done:
+                return True, done.value
+
+    @staticmethod
+    def _execute_velocity(velocity_batches: Dict[int, VelocityBatch]) -> Dict[int, float]:
+        """Выполняет пачки операций по хранилищам; время выполнения по удавшимся"""
+        elapsed = {}
+        for key, velocity_batch in velocity_batches.items():
+            started = perf_counter()
             try:
-                res = rule.evaluate(transaction)
-                results.append({
-                    "rule_id": rule.rule_id,
-                    "rule_name": rule.get_name(),
-                    "result": res.to_dict()
-                })
-                total_score += res.risk_score
-                if not res.passed:
-                    triggered.append(rule.get_name())
-                    
-                    # Проверяем критическое правило
-                    if rule.is_critical():
-                        logger.warning(f"CRITICAL RULE TRIGGERED: {rule.get_name()}. Stopping evaluation.")
-                        break
+                velocity_batch.execute()
             except Exception as e:
-                logger.error(f"Error in rule {rule}: {e}")
-                results.append({
-                    "rule_id": rule.rule_id,
-                    "rule_name": rule.get_name(),
-                    "error": str(e)
-                })
-
-        avg_score = total_score / len(active) if active else 0.0
-        return {
-            "is_suspicious": len(triggered) > 0,
-            "risk_score": avg_score,
-            "triggered_rules": triggered,
-            "checked_rules": len(active),
-            "details": results
-        }
+                logger.warning(f"Velocity batch failed: {e}")
+                continue
+            elapsed[key] = perf_counter() - started
+        return elapsed
+
+    @staticmethod
+    async def _execute_velocity_async(velocity_batches: Dict[int, VelocityBatch]) -> Dict[int, float]:
+        """_execute_velocity через асинхронные клиенты; хранилища опрашиваются параллельно"""
+        keys = list(velocity_batches)
+        started = perf_counter()
+        done = await asyncio.gather(
+            *(velocity_batches[key].execute_async() for key in keys), return_exceptions=True
+        )
+        elapsed = {}
+        for key, res in zip(keys, done):
+            if isinstance(res, BaseException):
+                logger.warning(f"Velocity batch failed: {res}")
+                continue
+            elapsed[key] = perf_counter() - started
+        return elapsed
+
+    @staticmethod
+    def _evaluate_columns(
+        snapshot: RuleSetSnapshot,
+        transactions: List[Dict[str, Any]],
+        columns: TransactionColumns
+    ) -> List[Optional[ColumnResults]]:
+        """
+        Векторизуемые правила плана по всей пачке: ColumnResults по позициям
+        плана, None — правило оценивается построчно. Пороговые правила из
+        ThresholdIndex получают исходы по точкам разреза группы (один
+        searchsorted на группу); время индекса делится между ними, как в _resolve.
+        """
+        n = columns.size
+        resolved = {}
+        index_share = 0.0
+        if snapshot.index is not None:
+            started = perf_counter()
+            try:
+                resolved = snapshot.index.resolve_columns(columns)
+            except Exception as e:
+                logger.warning(f"Threshold index batch resolution failed: {e}")
+            if resolved:
+                index_share = (perf_counter() - started) / len(resolved)
+
+        batch: List[Optional[ColumnResults]] = []
+        for position, ((_, rule_name, _, _, rule), stats) in enumerate(zip(snapshot.plan, snapshot.stats)):
+            outcome = None
+            if rule.vectorized and position not in snapshot.stateful:
+                condition = resolved.get(position)
+                started = perf_counter()
+                try:
+                    if condition is not None:
+                        outcome = rule.evaluate_columns(transactions, columns, condition)
+                    else:
+                        outcome = rule.evaluate_columns(transactions, columns)
+                except Exception as e:
+                    logger.warning(f"Batch evaluation failed for rule {rule_name}: {e}")
+                elapsed = perf_counter() - started
+                stats.latency.observe_many(elapsed + index_share if condition is not None else elapsed, n)
+            batch.append(outcome)
+        return batch
+
+    def _evaluate_matrix(
+        self,
+        snapshot: RuleSetSnapshot,
+        transactions: List[Dict[str, Any]],
+        lean: bool
+    ) -> Generator[Dict[int, VelocityBatch], Optional[Dict[int, float]], List[Dict[str, Any]]]:
+        """
+        Оценка пачки матрицами [позиция плана × строка]: срабатывания и
+        риск-скоры векторизуемых правил берутся из ColumnResults целиком,
+        построчно (по этапам плана, только для ещё не остановленных строк)
+        считаются лишь остальные ячейки — невекторизуемые и составные правила,
+        velocity-правила и строки, которые правило не смогло сравнить.
+        Остановка на первом сработавшем критическом правиле — argmax по
+        булевой матрице, сумма риска — np.where по оценённым позициям.
+        RuleResult строятся только для оценённых ячеек, в lean-режиме —
+        при materialize.
+        Генератор, как _queue_batch velocity-хранилища: на этапе с
+        velocity-правилами отдаёт пачки операций по хранилищам, их выполняет
+        вызывающий (evaluate_batch — синхронно, evaluate_batch_async —
+        асинхронно) и передаёт обратно время выполнения; результат прохода —
+        значение StopIteration, см. _advance.
+        """
+        plan = snapshot.plan
+        size = len(plan)
+        n = len(transactions)
+        if not size:
+            return [_Tally(snapshot, lean).summary() for _ in transactions]
+
+        batch = self._evaluate_columns(snapshot, transactions, TransactionColumns(transactions))
+
+        outcomes = _BatchOutcomes(plan, batch)
+        triggered = np.zeros((size, n), dtype=bool)
+        scores = np.zeros((size, n))
+        for position, precomputed in enumerate(batch):
+            if precomputed is not None:
+                triggered[position] = precomputed.triggered
+                scores[position] = precomputed.scores
+
+        contexts: List[Optional[EvaluationContext]] = [None] * n
+        # live — строки, не остановленные критическим правилом
+        live = np.ones(n, dtype=bool)
+        for stage in snapshot.stages:
+            rows = np.flatnonzero(live).tolist()
+            if not rows:
+                break
+            stateful = [position for position in stage if position in snapshot.stateful]
+            if stateful:
+                velocity_batches, pending = self._defer_stateful(snapshot, stateful, transactions, rows, contexts)
+                if pending:
+                    elapsed = yield velocity_batches
+                    self._finish_stateful(snapshot, pending, elapsed, transactions, contexts, batch)
+
+            for position in stage:
+                precomputed = batch[position]
+                if isinstance(precomputed, ColumnResults):
+                    if precomputed.complete:
+                        continue
+                    known = precomputed.known.tolist()
+                    pending = [row for row in rows if not known[row]]
+                    precomputed = None
+                else:
+                    pending = rows
+                if not pending:
+                    continue
+                self._evaluate_cells(
+                    snapshot, position, transactions, pending, precomputed,
+                    contexts, outcomes, triggered, scores
+                )
+            if plan[stage[-1]][2]:
+                live &= ~triggered[stage[-1]]
+
+        stops = triggered & np.fromiter((entry[2] for entry in plan), dtype=bool, count=size)[:, None]
+        stopped = stops.any(axis=0)
+        stop_count = np.where(stopped, stops.argmax(axis=0) + 1, size)
+        evaluated = np.arange(size)[:, None] < stop_count
+        hits = triggered & evaluated
+        totals = np.where(evaluated, scores, 0.0).sum(axis=0)
+
+        for stats, count in zip(snapshot.stats, hits.sum(axis=1).tolist()):
+            if count:
+                stats.triggers.inc(count)
+        if stopped.any():
+            positions, counts = np.unique(stop_count[stopped] - 1, return_counts=True)
+            for position, count in zip(positions.tolist(), counts.tolist()):
+                logger.warning(
+                    f"CRITICAL RULE TRIGGERED: {plan[position][1]} ({count} transactions). Stopping evaluation."
+                )
+
+        names = [entry[1] for entry in plan]
+        triggered_rules: List[List[str]] = [[] for _ in range(n)]
+        hit_rows, hit_positions = np.nonzero(hits.T)
+        for row, position in zip(hit_rows.tolist(), hit_positions.tolist()):
+            triggered_rules[row].append(names[position])
+
+        timestamp = datetime.utcnow()
+        timestamp_iso = timestamp.isoformat() + "Z"
+        # Ячейки только из ColumnResults — словари результатов строятся напрямую
+        plain = not outcomes.errors and all(cells is None for cells in outcomes.cells)
+        rule_ids = [entry[0] for entry in plan]
+        # Позиция без ColumnResults здесь не оценена ни в одной строке (её нет в checked)
+        result_dicts = [
+            precomputed.result_dict if precomputed is not None else None for precomputed in batch
+        ] if plain else None
+        evaluations = []
+        for row, (checked, total) in enumerate(zip(stop_count.tolist(), totals.tolist())):
+            if lean:
+                details = _MatrixDetails(outcomes, row, checked, timestamp)
+            elif plain:
+                details = [
+                    {"rule_id": rule_id, "rule_name": rule_name, "result": result_dict(row, timestamp_iso)}
+                    for rule_id, rule_name, result_dict in zip(
+                        rule_ids[:checked], names[:checked], result_dicts[:checked]
+                    )
+                ]
+            else:
+                details = [outcomes.entry(position, row, timestamp, timestamp_iso) for position in range(checked)]
+            evaluation = {
+                "is_suspicious": len(triggered_rules[row]) > 0,
+                "risk_score": total / size,
+                "triggered_rules": triggered_rules[row],
+                "checked_rules": size,
+                "rule_set_version": snapshot.version,
+                "details": details
+            }
+            if lean:
+                evaluation["timestamp"] = timestamp
+            evaluations.append(evaluation)
+        return evaluations
+
+    @staticmethod
+    def _evaluate_cells(
+        snapshot: RuleSetSnapshot,
+        position: int,
+        transactions: List[Dict[str, Any]],
+        rows: List[int],
+        precomputed: Optional[List[Optional[RuleResult]]],
+        contexts: List[Optional[EvaluationContext]],
+        outcomes: _BatchOutcomes,
+        triggered: np.ndarray,
+        scores: np.ndarray
+    ):
+        """
+        Построчная оценка ячеек позиции плана для строк rows: результат из
+        контекста составных правил или velocity-конвейера (precomputed),
+        иначе — скомпилированный предикат правила. Пишет исход в матрицы.
+        """
+        rule_id, _, _, evaluate, rule = snapshot.plan[position]
+        stats = snapshot.stats[position]
+        for row in rows:
+            context = contexts[row]
+            res = context.results.get(rule_id) if context is not None else None
+            if res is None and precomputed is not None:
+                res = precomputed[row]
+            if res is None:
+                started = perf_counter()
+                try:
+                    if rule.uses_context:
+                        if context is None:
+                            context = contexts[row] = _BatchContext(transactions[row], outcomes, row)
+                        res = context.resolve(rule)
+                    else:
+                        res = evaluate(transactions[row])
+                except Exception as e:
+                    stats.errors.inc()
+                    logger.error(f"Error in rule {rule}: {e}")
+                    outcomes.errors[(position, row)] = str(e)
+                    continue
+                stats.latency.observe(perf_counter() - started)
+            if context is not None:
+                context.results[rule_id] = res
+            outcomes.set(position, row, res)
+            triggered[position, row] = not res.passed
+            scores[position, row] = res.risk_score
+
+    def _evaluate_stateful(
+        self,
+        snapshot: RuleSetSnapshot,
+        positions: List[int],
+        transactions: List[Dict[str, Any]],
+        rows: List[int],
+        contexts: List[Optional[EvaluationContext]],
+        batch: BatchResults
+    ):
+        """
+        Пакетная оценка velocity-правил этапа для строк rows (по порядку):
+        обновления всех правил с общим хранилищем идут одним конвейером.
+        Строки, где правило уже оценено составным правилом, и отключённые
+        по бюджету правила пропускаются — их обработает обычный проход.
+        """
+        velocity_batches, pending = self._defer_stateful(snapshot, positions, transactions, rows, contexts)
+        if pending:
+            elapsed = self._execute_velocity(velocity_batches)
+            self._finish_stateful(snapshot, pending, elapsed, transactions, contexts, batch)
+
+    @staticmethod
+    def _defer_stateful(
+        snapshot: RuleSetSnapshot,
+        positions: List[int],
+        transactions: List[Dict[str, Any]],
+        rows: List[int],
+        contexts: List[Optional[EvaluationContext]]
+    ) -> Tuple[Dict[int, VelocityBatch], List[Tuple[int, List[int], Callable]]]:
+        """
+        Откладывает обновления velocity-правил этапа: пачки операций по
+        хранилищам и [(позиция, строки, finish)] для _finish_stateful.
+        """
+        pending = []
+        velocity_batches = {}
+        for position in positions:
+            rule_id, rule_name, _, _, rule = snapshot.plan[position]
+            budget = snapshot.budgets[position]
+            if budget is not None and not budget.allows(perf_counter()):
+                continue
+            rule_rows = [
+                row for row in rows
+                if contexts[row] is None or rule_id not in contexts[row].results
+            ]
+            if not rule_rows:
+                continue
+            velocity_batch = velocity_batches.get(id(rule.store))
+            if velocity_batch is None:
+                velocity_batch = velocity_batches[id(rule.store)] = rule.store.batch()
+            try:
+                finish = rule.defer_batch([transactions[row] for row in rule_rows], velocity_batch)
+            except Exception as e:
+                logger.warning(f"Batch evaluation failed for rule {rule_name}: {e}")
+                continue
+            pending.append((position, rule_rows, finish))
+        return velocity_batches, pending
+
+    @staticmethod
+    def _finish_stateful(
+        snapshot: RuleSetSnapshot,
+        pending: List[Tuple[int, List[int], Callable]],
+        elapsed: Dict[int, float],
+        transactions: List[Dict[str, Any]],
+        contexts: List[Optional[EvaluationContext]],
+        batch: BatchResults
+    ):
+        """Раскладывает ответы выполненных пачек по позициям плана (batch) и контекстам строк"""
+        for position, rule_rows, finish in pending:
+            rule_id, rule_name, _, _, rule = snapshot.plan[position]
+            if id(rule.store) not in elapsed:
+                continue
+            try:
+                computed = finish()
+            except Exception as e:
+                logger.warning(f"Batch evaluation failed for rule {rule_name}: {e}")
+                continue
+            snapshot.stats[position].latency.observe_many(elapsed[id(rule.store)], len(rule_rows))
+
+            precomputed: List[Optional[RuleResult]] = [None] * len(transactions)
+            for row, res in zip(rule_rows, computed):
+                precomputed[row] = res
+                # Составные правила этапа должны увидеть уже посчитанный результат
+                if res is not None and contexts[row] is not None:
+                    contexts[row].results[rule_id] = res
+            batch[position] = precomputed
+
+    @staticmethod
+    def _resolve(snapshot: RuleSetSnapshot, transaction: Dict[str, Any]) -> Optional[Dict[int, bool]]:
+        """
+        Исходы пороговых правил через ThresholdIndex. Время индекса делится
+        поровну между разрешёнными правилами и попадает в их гистограммы —
+        иначе /metrics не видит правила, оценённые индексом.
+        """
+        index = snapshot.index
+        if index is None:
+            return None
+        started = perf_counter()
+        resolved = index.resolve(transaction)
+        if resolved:
+            share = (perf_counter() - started) / len(resolved)
+            stats_by_position = snapshot.stats
+            for position in resolved:
+                stats_by_position[position].latency.observe(share)
+        return resolved
+
+    def _deadline(self) -> Optional[float]:
+        """Момент (perf_counter), к которому оценка транзакции должна завершиться"""
+        if self.transaction_timeout is None:
+            return None
+        return perf_counter() + self.transaction_timeout
+
+    @staticmethod
+    def _record_budget(budget: RuleBudget, elapsed: float) -> bool:
+        """
+        Учитывает время синхронной оценки в бюджете правила. Прервать её
+        нельзя, поэтому готовый результат используется, а превышение идёт
+        в счётчик автоотключения (после failure_threshold подряд правило обходится).
+        True — бюджет превышен (см. _Tally.add).
+        """
+        if elapsed > budget.timeout:
+            budget.record_timeout(perf_counter())
+            return True
+        budget.record_success()
+        return False
+
+    def _evaluate(
+        self,
+        snapshot: RuleSetSnapshot,
+        transaction: Dict[str, Any],
+        batch: Optional[BatchResults] = None,
+        row: int = 0,
+        resolved: Optional[Dict[int, bool]] = None,
+        lean: bool = False
+    ) -> Dict[str, Any]:
+        """
+        Проход по плану снимка для одной транзакции. batch — заранее посчитанные
+        результаты векторизуемых правил (по позициям плана), row — индекс строки,
+        resolved — исходы пороговых правил, разрешённые ThresholdIndex.
+        lean — не сериализовать результаты правил (details строятся позже).
+        Отключённое по бюджету правило заменяется запасным результатом или
+        пропускается, превышение бюджета учитывается для автоотключения;
+        по истечении бюджета транзакции оставшиеся правила не оцениваются.
+        """
+        tally = _Tally(snapshot, lean)
+        context = self._context(snapshot, transaction, batch, row)
+        self._evaluate_range(
+            snapshot, transaction, tally, context, 0, len(snapshot.plan),
+            batch, row, resolved, self._deadline()
+        )
+        return tally.summary()
+
+    @staticmethod
+    def _context(
+        snapshot: RuleSetSnapshot,
+        transaction: Dict[str, Any],
+        batch: Optional[BatchResults],
+        row: int
+    ) -> Optional[EvaluationContext]:
+        """EvaluationContext, если в плане есть составные правила, с результатами пачки"""
+        if not snapshot.needs_context:
+            return None
+        context = EvaluationContext(transaction)
+        if batch is not None:
+            for entry, precomputed in zip(snapshot.plan, batch):
+                if precomputed is not None:
+                    res = precomputed[row]
+                    if res is not None:
+                        context.results[entry[0]] = res
+        return context
+
+    def _evaluate_range(
+        self,
+        snapshot: RuleSetSnapshot,
+        transaction: Dict[str, Any],
+        tally: "_Tally",
+        context: Optional[EvaluationContext],
+        start: int,
+        stop: int,
+        batch: Optional[BatchResults],
+        row: int,
+        resolved: Optional[Dict[int, bool]],
+        deadline: Optional[float]
+    ) -> bool:
+        """
+        Оценивает позиции плана [start, stop). True — оценка остановлена
+        (критическое правило или исчерпан бюджет транзакции).
+        """
+        plan = snapshot.plan
+        stats_by_position = snapshot.stats
+        budgets = snapshot.budgets if snapshot.has_budgets else None
+
+        for position in range(start, stop):
+            rule_id, _, _, evaluate, rule = plan[position]
+            if deadline is not None and perf_counter() > deadline:
+                tally.expire(position)
+                return True
+            try:
+                res = None
+                overran = False
+                if context is not None:
+                    res = context.results.get(rule_id)
+                if res is None:
+                    if batch is not None:
+                        precomputed = batch[position]
+                        if precomputed is not None:
+                            res = precomputed[row]
+                    elif resolved:
+                        condition_met = resolved.get(position)
+                        if condition_met is not None:
+                            res = rule.result_for(transaction[rule.field], condition_met)
+                    if res is None:
+                        budget = budgets[position] if budgets is not None else None
+                        started = perf_counter()
+                        if budget is not None and not budget.allows(started):
+                            tally.degrade(position, "bypassed")
+                            continue
+                        if context is not None:
+                            res = context.resolve(rule)
+                        else:
+                            res = evaluate(transaction)
+                        elapsed = perf_counter() - started
+                        stats_by_position[position].latency.observe(elapsed)
+                        if budget is not None:
+                            overran = self._record_budget(budget, elapsed)
+                    elif context is not None:
+                        context.results[rule_id] = res
+                if tally.add(position, res, overran):
+                    return True
+            except Exception as e:
+                tally.error(position, e)
+        return False
+
+    async def evaluate_transaction_async(
+        self,
+        transaction: Dict[str, Any],
+        lean: bool = False,
+        snapshot: Optional[RuleSetSnapshot] = None
+    ) -> Dict[str, Any]:
+        """
+        Асинхронная оценка транзакции. CPU-правила выполняются сразу,
+        I/O-правила (io_bound) одного этапа ожидаются параллельно через
+        asyncio.gather. Этапы разделены критическими правилами, поэтому порядок
+        приоритетов, набор оценённых правил и остановка на критическом правиле
+        совпадают с evaluate_transaction.
+        I/O-правило ожидается не дольше своего бюджета и остатка бюджета транзакции.
+        """
+        snapshot = snapshot or self._snapshot
+        logger.info(f"Evaluating transaction (async) with {len(snapshot.plan)} rules")
+
+        resolved = self._resolve(snapshot, transaction)
+        context = EvaluationContext(transaction)
+        deadline = self._deadline()
+        tally = _Tally(snapshot, lean)
+
+        for stage in snapshot.stages:
+            if deadline is not None and perf_counter() > deadline:
+                tally.expire(stage[0])
+                break
+            outcomes, overruns = await self._run_stage(snapshot, stage, context, resolved, deadline)
+            stopped = False
+            for position in stage:
+                res = outcomes[position]
+                if isinstance(res, RuleDegraded):
+                    tally.degrade(position, res.reason)
+                elif isinstance(res, BaseException):
+                    tally.error(position, res)
+                elif tally.add(position, res, position in overruns):
+                    stopped = True
+                    break
+            if stopped:
+                break
+
+        return tally.summary()
+
+    async def _run_stage(
+        self,
+        snapshot: RuleSetSnapshot,
+        stage,
+        context: EvaluationContext,
+        resolved: Optional[Dict[int, bool]],
+        deadline: Optional[float] = None
+    ) -> Tuple[Dict[int, Any], Set[int]]:
+        """
+        Оценивает один этап плана. Возвращает {позиция: RuleResult или исключение}
+        и позиции синхронных правил, превысивших бюджет (результат сохранён).
+        Порядок: запуск I/O-правил, CPU-правила, ожидание I/O, затем композиты,
+        которые берут результаты вложенных правил из контекста.
+        Деградировавшие правила возвращаются как RuleDegraded.
+        """
+        plan = snapshot.plan
+        budgets = snapshot.budgets
+        transaction = context.transaction
+        outcomes: Dict[int, Any] = {}
+        overruns: Set[int] = set()
+
+        pending = {}
+        for position in stage:
+            rule = plan[position][4]
+            if rule.io_bound and not rule.uses_context and rule.rule_id not in context.results:
+                budget = budgets[position]
+                if budget is not None and not budget.allows(perf_counter()):
+                    outcomes[position] = RuleDegraded("bypassed")
+                    continue
+                pending[position] = asyncio.ensure_future(
+                    self._timed_async(rule, transaction, snapshot.stats[position], budget, deadline)
+                )
+        if pending:
+            # Даём I/O-задачам отправить запросы до выполнения CPU-правил
+            await asyncio.sleep(0)
+
+        for position in stage:
+            rule_id, _, _, evaluate, rule = plan[position]
+            if position in pending or position in outcomes or rule.uses_context:
+                continue
+            try:
+                res = context.results.get(rule_id)
+                if res is None:
+                    condition_met = resolved.get(position) if resolved else None
+                    if condition_met is not None:
+                        res = rule.result_for(transaction[rule.field], condition_met)
+                    else:
+                        budget = budgets[position]
+                        started = perf_counter()
+                        if budget is not None and not budget.allows(started):
+                            outcomes[position] = RuleDegraded("bypassed")
+                            continue
+                        res = evaluate(transaction)
+                        elapsed = perf_counter() - started
+                        snapshot.stats[position].latency.observe(elapsed)
+                        if budget is not None and self._record_budget(budget, elapsed):
+                            overruns.add(position)
+                    context.results[rule_id] = res
+                outcomes[position] = res
+            except Exception as e:
+                outcomes[position] = e
+
+        if pending:
+            done = await asyncio.gather(*pending.values(), return_exceptions=True)
+            for position, res in zip(pending, done):
+                outcomes[position] = res
+                if not isinstance(res, BaseException):
+                    context.results[plan[position][0]] = res
+
+        for position in stage:
+            rule = plan[position][4]
+            if not rule.uses_context:
+                continue
+            budget = budgets[position]
+            started = perf_counter()
+            if budget is not None and not budget.allows(started):
+                outcomes[position] = RuleDegraded("bypassed")
+                continue
+            try:
+                if rule.rule_id not in context.results and rule.has_pending_io(context):
+                    # Вложенные I/O-правила вне этапа — синхронная оценка в потоке
+                    outcomes[position] = await asyncio.to_thread(context.resolve, rule)
+                else:
+                    outcomes[position] = context.resolve(rule)
+            except Exception as e:
+                outcomes[position] = e
+            elapsed = perf_counter() - started
+            snapshot.stats[position].latency.observe(elapsed)
+            if budget is not None and self._record_budget(budget, elapsed):
+                overruns.add(position)
+
+        return outcomes, overruns
+
+    @staticmethod
+    async def _timed_async(
+        rule: BaseRule,
+        transaction: Dict[str, Any],
+        stats,
+        budget: Optional[RuleBudget] = None,
+        deadline: Optional[float] = None
+    ) -> RuleResult:
+        started = perf_counter()
+        timeout = budget.timeout if budget is not None else None
+        reason = "timeout"
+        if deadline is not None and (timeout is None or deadline - started < timeout):
+            timeout, reason = max(deadline - started, 0.0), "deadline"
+        try:
+            if timeout is None:
+                res = await rule.evaluate_async(transaction)
+            else:
+                res = await asyncio.wait_for(rule.evaluate_async(transaction), timeout)
+        except asyncio.TimeoutError:
+            if reason == "timeout":
+                budget.record_timeout(perf_counter())
+            raise RuleDegraded(reason) from None
+        finally:
+            stats.latency.observe(perf_counter() - started)
+        if budget is not None:
+            budget.record_success()
+        return res
+
+    @staticmethod
+    def materialize(evaluation: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Превращает результат lean-оценки в обычный: details правил строятся
+        и сериализуются только здесь — перед сохранением или выдачей в API.
+        """
+        if "timestamp" not in evaluation:
+            return evaluation
+
+        timestamp_iso = evaluation["timestamp"].isoformat() + "Z"
+        details = []
+        for entry in evaluation["details"]:
+            if "result" in entry:
+                entry = dict(entry)
+                entry["result"] = entry["result"].to_dict(timestamp_iso)
+            details.append(entry)
+
+        materialized = {key: value for key, value in evaluation.items() if key != "timestamp"}
+        materialized["details"] = details
+        return materialized
 
     def reload_rules(self, new_rules: List[BaseRule]):
-        """Hot-reload: заменяет правила на новые"""
+        """
+        Hot-reload: заменяет правила на новые.
+        Оценки, уже начатые на старом снимке, доходят до конца на нём.
+        """
         self.load_rules(new_rules)
         logger.info("Rules hot-reloaded")
 
     def summary(self) -> Dict[str, Any]:
         """Общая информация по правилам"""
-        total = len(self.rules)
-        active = len(self.get_active_rules())
+        snapshot = self._snapshot
+        total = len(snapshot.rules)
+        active = len(snapshot.active)
         return {
             "total": total,
             "active": active,
-            "inactive": total - active
+            "inactive": total - active,
+            "version": snapshot.version
         }
 
 # Создаем экземпляр в конце файла
-rule_engine = RuleEngine()
\ No newline at end of file
+rule_engine = RuleEngine(
+    rule_timeout_ms=_env_ms("RULE_TIMEOUT_MS"),
+    transaction_timeout_ms=_env_ms("TRANSACTION_TIMEOUT_MS")
+)
\ No newline at end of file
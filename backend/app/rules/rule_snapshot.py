@@ -0,0 +1,79 @@
+import logging
+from typing import Any, Callable, Dict, Optional, Sequence, Tuple
+
+from app.core.metrics import RuleStats
+from .base_rule import BaseRule, RuleResult
+from .budget import RuleBudget, RuleBudgets
+from .threshold_index import ThresholdIndex
+
+logger = logging.getLogger(__name__)
+
+# Элемент плана: (rule_id, имя, критичность, функция оценки, правило)
+PlanEntry = Tuple[int, str, bool, Callable[[Dict[str, Any]], RuleResult], BaseRule]
+
+
+class RuleSetSnapshot:
+    """
+    Неизменяемый версионированный снимок набора правил.
+    Всё, что нужно для оценки, собирается один раз при создании:
+    индекс по rule_id, отфильтрованные активные правила, скомпилированный
+    план и ThresholdIndex. RuleEngine подменяет снимок целиком при любом
+    изменении, поэтому оценка, взявшая снимок, не видит частичных изменений.
+    """
+    __slots__ = (
+        "version", "rules", "by_id", "active", "plan", "index", "needs_context", "stages", "stats",
+        "budgets", "has_budgets", "stateful"
+    )
+
+    def __init__(self, rules: Sequence[BaseRule], version: int, budgets: Optional[RuleBudgets] = None):
+        self.version = version
+        self.rules: Tuple[BaseRule, ...] = tuple(rules)
+        self.by_id: Dict[int, BaseRule] = {rule.rule_id: rule for rule in self.rules}
+        self.active: Tuple[BaseRule, ...] = tuple(rule for rule in self.rules if rule.is_enabled())
+        # План: всё, что не зависит от транзакции (имя, критичность, предикат)
+        self.plan: Tuple[PlanEntry, ...] = tuple(
+            (rule.rule_id, rule.get_name(), rule.is_critical(), rule.compile(), rule)
+            for rule in self.active
+        )
+        # Метрики правил по позициям плана — без поиска в горячем пути
+        self.stats: Tuple[RuleStats, ...] = tuple(
+            RuleStats(rule_id, rule_name) for rule_id, rule_name, _, _, _ in self.plan
+        )
+        # Бюджеты времени по позициям плана (None — без ограничения)
+        self.budgets: Tuple[Optional[RuleBudget], ...] = tuple(
+            budgets.for_rule(rule) if budgets is not None else None for rule in self.active
+        )
+        self.has_budgets = any(budget is not None for budget in self.budgets)
+        # Пороговые правила на одном поле дополнительно собираются в индекс
+        self.index: Optional[ThresholdIndex] = ThresholdIndex.build(self.plan)
+        # Если в плане есть CompositeRule, оценка идёт через EvaluationContext
+        self.needs_context = any(rule.uses_context for rule in self.active)
+        # Пакетные правила с внешним состоянием (velocity-счётчики):
+        # RuleEngine.evaluate_batch оценивает их по этапам
+        self.stateful = frozenset(
+            position for position, rule in enumerate(self.active) if rule.vectorized and rule.stateful
+        )
+        # Этапы для асинхронной оценки: каждый этап заканчивается критическим
+        # правилом, внутри этапа I/O-правила можно ожидать параллельно
+        stages = []
+        current = []
+        for position, entry in enumerate(self.plan):
+            current.append(position)
+            if entry[2]:
+                stages.append(tuple(current))
+                current = []
+        if current:
+            stages.append(tuple(current))
+        self.stages: Tuple[Tuple[int, ...], ...] = tuple(stages)
+
+    def get(self, rule_id: int) -> Optional[BaseRule]:
+        return self.by_id.get(rule_id)
+
+    def __len__(self) -> int:
+        return len(self.rules)
+
+    def __repr__(self):
+        return (
+            f"<RuleSetSnapshot(version={self.version}, "
+            f"rules={len(self.rules)}, active={len(self.active)})>"
+        )
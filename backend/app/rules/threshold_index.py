@@ -0,0 +1,175 @@
+import logging
+from bisect import bisect_left, bisect_right
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .columns import TransactionColumns
+from .threshold_rule import ThresholdRule
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+# Функция поиска точки разреза и сторона, на которой правила срабатывают:
+# True — сработали пороги левее разреза, False — правее
+_CUTS = {
+    ">": (bisect_left, True),     # t < v
+    ">=": (bisect_right, True),   # t <= v
+    "<": (bisect_right, False),   # t > v
+    "<=": (bisect_left, False),   # t >= v
+}
+
+
+def _is_number(value: Any) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and value == value
+
+
+def _is_key(value: Any) -> bool:
+    return isinstance(value, (str, int, float)) and not isinstance(value, bool)
+
+
+class _RangeGroup:
+    """Пороговые правила одного поля и оператора порядка, отсортированные по порогу."""
+
+    def __init__(self, field: str, operator: str, entries: List[Tuple[float, int]]):
+        entries.sort()
+        self.field = field
+        self.thresholds = [threshold for threshold, _ in entries]
+        self.positions = [position for _, position in entries]
+        self.cut, self.triggers_low = _CUTS[operator]
+        # Те же точки разреза для колонки: searchsorted повторяет bisect
+        self.side = "left" if self.cut is bisect_left else "right"
+        self._sorted = np.array(self.thresholds, dtype=np.float64)
+        self._ranks = np.arange(len(self.thresholds))[:, None]
+
+    def resolve(self, value: Any, resolved: Dict[int, bool]):
+        k = self.cut(self.thresholds, value)
+        low, high = self.positions[:k], self.positions[k:]
+        resolved.update(dict.fromkeys(low, self.triggers_low))
+        resolved.update(dict.fromkeys(high, not self.triggers_low))
+
+    def resolve_column(self, values: np.ndarray, present: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Исходы всех правил группы для колонки: матрица [правило × строка]
+        и маска разрешённых строк (число, как в resolve).
+        """
+        if values.dtype == object:
+            known = np.fromiter((_is_number(v) for v in values.tolist()), dtype=bool, count=len(values))
+            numbers = np.where(known, values, 0.0).astype(np.float64)
+        else:
+            known = present & (values == values)
+            numbers = values
+        cuts = np.searchsorted(self._sorted, numbers, side=self.side)
+        low = self._ranks < cuts
+        return (low if self.triggers_low else ~low), known
+
+
+class _EqualityGroup:
+    """Правила == / != одного поля: порог → позиции в плане."""
+
+    def __init__(self, field: str, operator: str, entries: List[Tuple[Any, int]]):
+        self.field = field
+        self.negate = operator == "!="
+        self.positions = [position for _, position in entries]
+        self.by_value: Dict[Any, List[int]] = {}
+        # Порог → номера правил внутри группы (строки матрицы resolve_column)
+        self.ranks_by_value: Dict[Any, List[int]] = {}
+        for rank, (threshold, position) in enumerate(entries):
+            self.by_value.setdefault(threshold, []).append(position)
+            self.ranks_by_value.setdefault(threshold, []).append(rank)
+
+    def resolve(self, value: Any, resolved: Dict[int, bool]):
+        resolved.update(dict.fromkeys(self.positions, self.negate))
+        matched = self.by_value.get(value)
+        if matched:
+            resolved.update(dict.fromkeys(matched, not self.negate))
+
+    def resolve_column(self, values: np.ndarray, present: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Исходы всех правил группы для колонки: матрица [правило × строка] и маска разрешённых строк"""
+        met = np.full((len(self.positions), len(values)), self.negate)
+        known = np.zeros(len(values), dtype=bool)
+        ranks_by_value = self.ranks_by_value
+        for row, (value, is_present) in enumerate(zip(values.tolist(), present.tolist())):
+            if not is_present or not _is_key(value):
+                continue
+            known[row] = True
+            matched = ranks_by_value.get(value)
+            if matched:
+                met[matched, row] = not self.negate
+        return met, known
+
+
+class ThresholdIndex:
+    """
+    Индекс пороговых правил по полю и оператору.
+    Все правила вида `amount > X` разрешаются одним bisect по отсортированным
+    порогам, правила `currency == X` — одним поиском в словаре.
+    Отсутствующее или нечисловое значение поля индекс не разрешает —
+    такие правила оцениваются обычным предикатом, с теми же результатами и ошибками.
+    """
+
+    # Группы меньшего размера выгоднее проверять напрямую
+    MIN_GROUP_SIZE = 2
+
+    def __init__(self, groups: List[Any]):
+        self.groups = groups
+
+    @classmethod
+    def build(cls, plan: List[tuple]) -> Optional["ThresholdIndex"]:
+        """Строит индекс по плану RuleEngine или возвращает None, если индексировать нечего."""
+        buckets: Dict[Tuple[str, str], List[Tuple[Any, int]]] = {}
+        for position, entry in enumerate(plan):
+            rule = entry[4]
+            if not isinstance(rule, ThresholdRule):
+                continue
+            threshold = rule.threshold
+            if rule.operator in _CUTS:
+                if not _is_number(threshold):
+                    continue
+            elif not _is_key(threshold):
+                continue
+            buckets.setdefault((rule.field, rule.operator), []).append((threshold, position))
+
+        groups = []
+        for (field, operator), entries in buckets.items():
+            if len(entries) < cls.MIN_GROUP_SIZE:
+                continue
+            if operator in _CUTS:
+                groups.append(_RangeGroup(field, operator, entries))
+            else:
+                groups.append(_EqualityGroup(field, operator, entries))
+
+        if not groups:
+            return None
+        logger.info(f"Threshold index built: {len(groups)} field groups")
+        return cls(groups)
+
+    def resolve(self, transaction: Dict[str, Any]) -> Dict[int, bool]:
+        """Возвращает {позиция в плане: условие выполнено} для разрешённых правил."""
+        resolved: Dict[int, bool] = {}
+        for group in self.groups:
+            value = transaction.get(group.field, _MISSING)
+            if value is _MISSING:
+                continue
+            if isinstance(group, _RangeGroup):
+                if not _is_number(value):
+                    continue
+            elif not _is_key(value):
+                continue
+            group.resolve(value, resolved)
+        return resolved
+
+    def resolve_columns(self, columns: TransactionColumns) -> Dict[int, Tuple[np.ndarray, np.ndarray]]:
+        """
+        Пакетный вариант resolve: {позиция в плане: (условие выполнено, строка
+        разрешена)} — массивы по строкам пачки. Неразрешённые строки (поля нет
+        или значение не подходит группе) правило оценивает само.
+        """
+        resolved: Dict[int, Tuple[np.ndarray, np.ndarray]] = {}
+        for group in self.groups:
+            values, present = columns.column(group.field)
+            met, known = group.resolve_column(values, present)
+            for rank, position in enumerate(group.positions):
+                resolved[position] = (met[rank], known)
+        return resolved
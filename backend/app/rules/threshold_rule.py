@@ -1,20 +1,29 @@
-from typing import Dict, Any
+from typing import Dict, Any, Callable, List, Optional, Tuple
+import operator as op
+import numpy as np
 from .base_rule import BaseRule, RuleResult
+from .columns import ColumnResults, TransactionColumns
 import logging
 
 logger = logging.getLogger(__name__)
 
 
 class ThresholdRule(BaseRule):
+    # Встроенные функции сравнения — без лишнего уровня lambda в горячем пути
     OPERATORS = {
-        ">": lambda a, b: a > b,
-        "<": lambda a, b: a < b,
-        ">=": lambda a, b: a >= b,
-        "<=": lambda a, b: a <= b,
-        "==": lambda a, b: a == b,
-        "!=": lambda a, b: a != b,
+        ">": op.gt,
+        "<": op.lt,
+        ">=": op.ge,
+        "<=": op.le,
+        "==": op.eq,
+        "!=": op.ne,
     }
 
+    ORDERING_OPERATORS = (">", "<", ">=", "<=")
+
+    # Правило поддерживает RuleEngine.evaluate_batch (evaluate_columns)
+    vectorized = True
+
     def __init__(self, rule_id: int, name: str, enabled: bool = True, parameters: Dict[str, Any] = None,priority: int=5):
         super().__init__(rule_id, name, enabled, parameters,priority)
         
@@ -30,6 +39,139 @@ class ThresholdRule(BaseRule):
                 f"Supported: {list(self.OPERATORS.keys())}"
             )
 
+        self.field = self.parameters["field"]
+        self.operator = self.parameters["operator"]
+        self.threshold = self._coerce_threshold(self.parameters["value"], self.operator)
+        self.risk_score = self.parameters.get("risk_score", 0.8)
+        self._predicate = self._build_predicate()
+
+    @classmethod
+    def _coerce_threshold(cls, value: Any, operator: str) -> Any:
+        """
+        Приводит порог к числу один раз при загрузке.
+        Для операторов порядка строка вида "10000" превращается в float,
+        равенство/неравенство сравнивают значение как есть. Строковое значение
+        поля приводится так же при сравнении (см. _build_predicate).
+        """
+        if operator in cls.ORDERING_OPERATORS and isinstance(value, str):
+            try:
+                return float(value)
+            except ValueError:
+                return value
+        return value
+
+    def _build_predicate(self) -> Callable[[Dict[str, Any]], RuleResult]:
+        """
+        Собирает специализированный предикат: поле, оператор, порог и
+        риск-скор связываются в замыкании, префикс причины форматируется заранее,
+        а details строятся лениво. Построители результатов сохраняются
+        и для пакетной оценки.
+        """
+        field = self.field
+        operator = self.operator
+        threshold_value = self.parameters["value"]
+        threshold = self.threshold
+        compare = self.OPERATORS[operator]
+        risk_score = self.risk_score
+        condition = f"{field} {operator} {threshold_value}"
+        missing_reason = f"Field '{field}' not found in transaction"
+
+        def missing_details() -> Dict[str, Any]:
+            return {
+                "reason": missing_reason,
+                "field": field,
+                "operator": operator,
+                "threshold": threshold_value
+            }
+
+        def hit_details(transaction_value: Any) -> Dict[str, Any]:
+            return {
+                "reason": f"{condition} (actual: {transaction_value})",
+                "field": field,
+                "operator": operator,
+                "threshold": threshold_value,
+                "actual_value": transaction_value,
+                "condition_met": True
+            }
+
+        def miss_details(transaction_value: Any) -> Dict[str, Any]:
+            return {
+                "reason": f"{condition} not met (actual: {transaction_value})",
+                "field": field,
+                "operator": operator,
+                "threshold": threshold_value,
+                "actual_value": transaction_value,
+                "condition_met": False
+            }
+
+        lazy = RuleResult.lazy
+
+        def missing_result() -> RuleResult:
+            return lazy(True, 0.0, missing_details)
+
+        def make_missing() -> RuleResult:
+            logger.warning(missing_reason)
+            return missing_result()
+
+        def make_result(transaction_value: Any, condition_met: bool) -> RuleResult:
+            if condition_met:
+                # Условие выполнено — правило сработало (транзакция подозрительная)
+                return lazy(False, risk_score, hit_details, transaction_value)
+            # Условие не выполнено — правило не сработало (транзакция нормальная)
+            return lazy(True, 0.0, miss_details, transaction_value)
+
+        def make_dict(transaction_value: Any, condition_met: bool, timestamp_iso: str) -> Dict[str, Any]:
+            """То же, что make_result(...).to_dict(timestamp_iso), без объекта RuleResult"""
+            if condition_met:
+                return {
+                    "passed": False, "risk_score": risk_score,
+                    "details": hit_details(transaction_value), "timestamp": timestamp_iso
+                }
+            return {
+                "passed": True, "risk_score": 0.0,
+                "details": miss_details(transaction_value), "timestamp": timestamp_iso
+            }
+
+        def missing_dict(timestamp_iso: str) -> Dict[str, Any]:
+            return {"passed": True, "risk_score": 0.0, "details": missing_details(), "timestamp": timestamp_iso}
+
+        def compare_mixed(transaction_value: Any) -> bool:
+            """
+            Сравнение, которое не прошло как есть (str с числом): строка поля
+            приводится к числу, как порог; не число — сравнивается с порогом
+            в исходном виде, как до приведения порога.
+            """
+            if isinstance(transaction_value, str):
+                try:
+                    return compare(float(transaction_value), threshold)
+                except (TypeError, ValueError):
+                    pass
+            return compare(transaction_value, threshold_value)
+
+        def predicate(transaction: Dict[str, Any]) -> RuleResult:
+            if field not in transaction:
+                return make_missing()
+            transaction_value = transaction[field]
+            try:
+                condition_met = compare(transaction_value, threshold)
+            except TypeError:
+                condition_met = compare_mixed(transaction_value)
+            return make_result(transaction_value, condition_met)
+
+        self._missing_reason = missing_reason
+        self._missing_result = missing_result
+        self._make_result = make_result
+        self._missing_dict = missing_dict
+        self._make_dict = make_dict
+        return predicate
+
+    def compile(self) -> Callable[[Dict[str, Any]], RuleResult]:
+        return self._predicate
+
+    def result_for(self, transaction_value: Any, condition_met: bool) -> RuleResult:
+        """Результат для уже известного исхода сравнения (см. ThresholdIndex)."""
+        return self._make_result(transaction_value, condition_met)
+
     def evaluate(self, transaction: Dict[str, Any]) -> RuleResult:
         """
         Проверяет транзакцию на соответствие пороговому условию.
@@ -43,58 +185,80 @@ class ThresholdRule(BaseRule):
             - risk_score: значение риска (из parameters или 0.8 по умолчанию)
             - details: информация о проверке
         """
-        field = self.parameters["field"]
-        operator = self.parameters["operator"]
-        threshold_value = self.parameters["value"]
-        risk_score = self.parameters.get("risk_score", 0.8)
-        
-        # Получаем значение поля из транзакции
-        if field not in transaction:
-            logger.warning(f"Field '{field}' not found in transaction")
-            return RuleResult(
-                passed=True,
-                risk_score=0.0,
-                details={
-                    "reason": f"Field '{field}' not found in transaction",
-                    "field": field,
-                    "operator": operator,
-                    "threshold": threshold_value
-                }
-            )
-        
-        transaction_value = transaction[field]
-        
-        # Применяем оператор
-        condition_met = self.OPERATORS[operator](transaction_value, threshold_value)
-        
-        if condition_met:
-            # Условие выполнено — правило сработало (транзакция подозрительная)
-            return RuleResult(
-                passed=False,
-                risk_score=risk_score,
-                details={
-                    "reason": f"{field} {operator} {threshold_value} (actual: {transaction_value})",
-                    "field": field,
-                    "operator": operator,
-                    "threshold": threshold_value,
-                    "actual_value": transaction_value,
-                    "condition_met": True
-                }
-            )
-        else:
-            # Условие не выполнено — правило не сработало (транзакция нормальная)
-            return RuleResult(
-                passed=True,
-                risk_score=0.0,
-                details={
-                    "reason": f"{field} {operator} {threshold_value} not met (actual: {transaction_value})",
-                    "field": field,
-                    "operator": operator,
-                    "threshold": threshold_value,
-                    "actual_value": transaction_value,
-                    "condition_met": False
-                }
-            )
+        return self._predicate(transaction)
+
+    def _compare_column(self, values: np.ndarray, present: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Сравнение колонки с порогом: (условие выполнено, строка сравнима).
+        Числовая колонка сравнивается одной операцией NumPy, object-колонка —
+        поэлементно; несравнимые значения (str с числом и т.п.) остаются
+        несравнимыми и оцениваются предикатом.
+        """
+        compare = self.OPERATORS[self.operator]
+        threshold = self.threshold
+        numeric_threshold = isinstance(threshold, (int, float)) and not isinstance(threshold, bool)
+        if values.dtype != object and numeric_threshold:
+            return compare(values, threshold) & present, present
+
+        met = np.zeros(len(values), dtype=bool)
+        comparable = np.zeros(len(values), dtype=bool)
+        for row, (value, is_present) in enumerate(zip(values.tolist(), present.tolist())):
+            if not is_present:
+                continue
+            try:
+                met[row] = bool(compare(value, threshold))
+            except Exception:
+                continue
+            comparable[row] = True
+        return met, comparable
+
+    def evaluate_columns(
+        self,
+        transactions: List[Dict[str, Any]],
+        columns: TransactionColumns,
+        condition: Optional[Tuple[np.ndarray, np.ndarray]] = None
+    ) -> ColumnResults:
+        """
+        Векторная оценка пачки по колонке поля. condition — исходы сравнения
+        (условие выполнено, строка сравнима), уже посчитанные ThresholdIndex
+        по точкам разреза; без него колонка сравнивается с порогом здесь.
+        RuleResult строится только для строк, попавших в результат.
+        """
+        values, present = columns.column(self.field)
+        met, comparable = condition if condition is not None else self._compare_column(values, present)
+        missing = ~present
+        if missing.any():
+            logger.warning(f"{self._missing_reason} ({int(missing.sum())} transactions)")
+        triggered = met & comparable
+        scores = np.where(triggered, float(self.risk_score), 0.0)
+
+        field = self.field
+        missing_result = self._missing_result
+        make_result = self._make_result
+        missing_dict = self._missing_dict
+        make_dict = self._make_dict
+        # Списки Python вместо индексации NumPy по ячейке — строятся при первом обращении
+        rows = []
+
+        def outcome(row: int) -> Tuple[bool, bool]:
+            if not rows:
+                rows.append(missing.tolist())
+                rows.append(met.tolist())
+            return rows[0][row], rows[1][row]
+
+        def make(row: int) -> RuleResult:
+            is_missing, condition_met = outcome(row)
+            if is_missing:
+                return missing_result()
+            return make_result(transactions[row][field], condition_met)
+
+        def make_row_dict(row: int, timestamp_iso: str) -> Dict[str, Any]:
+            is_missing, condition_met = outcome(row)
+            if is_missing:
+                return missing_dict(timestamp_iso)
+            return make_dict(transactions[row][field], condition_met, timestamp_iso)
+
+        return ColumnResults(triggered, scores, comparable | missing, make, make_row_dict)
 
     def __repr__(self):
         return (
@@ -0,0 +1,199 @@
+import logging
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .base_rule import BaseRule, RuleResult
+from .velocity_store import AGGREGATE_KINDS, VelocityBatch, VelocityStore, VelocityUpdate, get_velocity_store
+
+logger = logging.getLogger(__name__)
+
+
+class VelocityAggregate:
+    """
+    Один агрегат правила: kind по полю field в разрезе ключа key за окно.
+    Например, сумма amount по from_account или число различных merchant по user_id.
+    """
+    __slots__ = ("name", "key", "kind", "field", "max")
+
+    def __init__(self, spec: Dict[str, Any]):
+        self.kind = str(spec.get("type", "count")).lower()
+        if self.kind not in AGGREGATE_KINDS:
+            raise ValueError(f"Unsupported aggregate type '{self.kind}'. Use one of {AGGREGATE_KINDS}")
+        if "key" not in spec or "max" not in spec:
+            raise ValueError("Velocity aggregate requires 'key' and 'max'")
+        self.key = spec["key"]
+        self.field = spec.get("field")
+        if self.kind != "count" and not self.field:
+            raise ValueError(f"Velocity aggregate '{self.kind}' requires 'field'")
+        self.max = float(spec["max"])
+        self.name = spec.get("name") or (
+            f"{self.kind}_per_{self.key}" if self.kind == "count"
+            else f"{self.kind}_{self.field}_per_{self.key}"
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"name": self.name, "type": self.kind, "key": self.key, "field": self.field, "max": self.max}
+
+
+class VelocityRule(BaseRule):
+    """
+    Velocity-правило по нескольким агрегатам за скользящее окно:
+    count — число транзакций, sum — сумма поля, distinct — число различных
+    значений поля (HyperLogLog). Срабатывает, если хотя бы один агрегат
+    превысил свой max. Все агрегаты транзакции обновляются за один обмен
+    с хранилищем.
+
+    Параметры: aggregates — список {"key", "type", "field", "max", "name"},
+    time_window_minutes (60), buckets — число подокон (12), risk_score (0.5).
+    """
+    # Пачка транзакций обновляет агрегаты одним обменом с хранилищем
+    vectorized = True
+    stateful = True
+
+    def __init__(
+        self,
+        rule_id: int,
+        name: str,
+        enabled: bool = True,
+        parameters: Dict[str, Any] = None,
+        priority: int = 5,
+        store: Optional[VelocityStore] = None
+    ):
+        super().__init__(rule_id, name, enabled, parameters, priority)
+        specs = self.parameters.get("aggregates")
+        if not isinstance(specs, list) or not specs:
+            raise ValueError("VelocityRule requires a non-empty 'aggregates' list")
+        self.aggregates = [VelocityAggregate(spec) for spec in specs]
+        self.window = int(self.parameters.get("time_window_minutes", 60))
+        self.buckets = int(self.parameters.get("buckets", 12))
+        self.risk_score = float(self.parameters.get("risk_score", 0.5))
+        self.window_ms = self.window * 60 * 1000
+        # Хранилище счётчиков: Redis или память процесса (VELOCITY_BACKEND)
+        self.store = store if store is not None else get_velocity_store()
+        self.io_bound = self.store.remote
+
+    def updates_for(self, transaction: Dict[str, Any]) -> Tuple[List[VelocityAggregate], List[VelocityUpdate]]:
+        """Агрегаты, применимые к транзакции, и обновления для хранилища"""
+        applied = []
+        updates = []
+        for aggregate in self.aggregates:
+            key_value = transaction.get(aggregate.key)
+            if not key_value:
+                continue
+            if aggregate.kind == "count":
+                value = 1
+            else:
+                value = transaction.get(aggregate.field)
+                if value is None:
+                    continue
+                if aggregate.kind == "sum":
+                    try:
+                        value = float(value)
+                    except (TypeError, ValueError):
+                        continue
+            applied.append(aggregate)
+            updates.append(VelocityUpdate(
+                f"velocity:{self.rule_id}:{aggregate.name}:{key_value}",
+                aggregate.kind,
+                value,
+                self.window_ms,
+                self.buckets
+            ))
+        return applied, updates
+
+    def result_for(self, applied: List[VelocityAggregate], values: List[float]) -> RuleResult:
+        exceeded = [aggregate.name for aggregate, value in zip(applied, values) if value > aggregate.max]
+        return RuleResult.lazy(
+            not exceeded,
+            self.risk_score if exceeded else 0.0,
+            self._details,
+            applied,
+            values,
+            exceeded
+        )
+
+    def evaluate(self, transaction: Dict[str, Any]) -> RuleResult:
+        applied, updates = self.updates_for(transaction)
+        if not updates:
+            return RuleResult(
+                passed=True,
+                risk_score=0.0,
+                details={"reason": "no velocity key fields in transaction"}
+            )
+        values = self.store.aggregate(updates, int(time.time() * 1000))
+        return self.result_for(applied, values)
+
+    def evaluate_batch(self, transactions: List[Dict[str, Any]], columns=None) -> List[Optional[RuleResult]]:
+        """
+        Агрегаты всей пачки — одним конвейером, в порядке транзакций.
+        Транзакции без ключевых полей остаются None и оцениваются через evaluate.
+        """
+        batch = self.store.batch()
+        finish = self.defer_batch(transactions, batch)
+        batch.execute()
+        return finish()
+
+    def defer_batch(
+        self,
+        transactions: List[Dict[str, Any]],
+        batch: VelocityBatch
+    ) -> Callable[[], List[Optional[RuleResult]]]:
+        """
+        Ставит обновления агрегатов пачки в batch (общий для нескольких правил).
+        Возвращает функцию, собирающую результаты после batch.execute().
+        """
+        rows = []
+        applied_by_row = []
+        batches = []
+        for row, transaction in enumerate(transactions):
+            applied, updates = self.updates_for(transaction)
+            if updates:
+                rows.append(row)
+                applied_by_row.append(applied)
+                batches.append(updates)
+
+        handle = batch.aggregate_many(batches, int(time.time() * 1000))
+
+        def finish() -> List[Optional[RuleResult]]:
+            results: List[Optional[RuleResult]] = [None] * len(transactions)
+            for row, applied, values in zip(rows, applied_by_row, batch.result(handle)):
+                results[row] = self.result_for(applied, values)
+            return results
+
+        return finish
+
+    async def evaluate_async(self, transaction: Dict[str, Any]) -> RuleResult:
+        """Обмен с хранилищем через асинхронный пул — event loop не блокируется."""
+        if not self.store.remote:
+            return self.evaluate(transaction)
+        batch = self.store.batch()
+        finish = self.defer_batch([transaction], batch)
+        await batch.execute_async()
+        result = finish()[0]
+        # None — нет ключевых полей, evaluate ответит без обращения к хранилищу
+        return result if result is not None else self.evaluate(transaction)
+
+    def _details(
+        self,
+        applied: List[VelocityAggregate],
+        values: List[float],
+        exceeded: List[str]
+    ) -> Dict[str, Any]:
+        if exceeded:
+            reason = f"Velocity limits exceeded in last {self.window} minutes: {', '.join(exceeded)}"
+        else:
+            reason = f"Velocity within limits for last {self.window} minutes"
+        return {
+            "reason": reason,
+            "aggregates": [
+                dict(aggregate.to_dict(), value=value, exceeded=aggregate.name in exceeded)
+                for aggregate, value in zip(applied, values)
+            ],
+            "time_window_minutes": self.window
+        }
+
+    def __repr__(self):
+        return (
+            f"<VelocityRule(id={self.rule_id}, name='{self.name}', "
+            f"aggregates={len(self.aggregates)}, window={self.window}m)>"
+        )
@@ -0,0 +1,469 @@
+import asyncio
+import itertools
+import logging
+import math
+import os
+import threading
+import uuid
+from abc import ABC, abstractmethod
+from array import array
+from collections import OrderedDict
+from hashlib import blake2b
+from typing import Any, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+import redis
+import redis.asyncio as async_redis
+
+from app.db.redis import get_redis, get_sync_redis
+
+logger = logging.getLogger(__name__)
+
+# Скользящее окно на sorted set: score — время события в мс.
+# За один вызов: удалить события старше окна, добавить текущее, посчитать,
+# продлить TTL ключа на длину окна. Выполняется атомарно на сервере.
+SLIDING_WINDOW_SCRIPT = """
+local now = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now - window)
+redis.call('ZADD', KEYS[1], now, ARGV[3])
+local count = redis.call('ZCARD', KEYS[1])
+redis.call('PEXPIRE', KEYS[1], window)
+return count
+"""
+
+
+class VelocityUpdate(NamedTuple):
+    """
+    Обновление агрегата по подокнам: count — число событий, sum — сумма value,
+    distinct — число различных value (HyperLogLog). key — без номера подокна.
+    """
+    key: str
+    kind: str
+    value: Any
+    window_ms: int
+    buckets: int
+
+
+AGGREGATE_KINDS = ("count", "sum", "distinct")
+
+
+# 2^-rank для оценки HyperLogLog (rank ≤ 64)
+_INVERSE_POWERS = np.ldexp(1.0, -np.arange(65))
+
+
+def _bucket_ms(window_ms: int, buckets: int) -> int:
+    return max(1, -(-window_ms // buckets))
+
+
+class VelocityBatch:
+    """
+    Отложенные обновления нескольких правил в одном хранилище.
+    Операции копятся через hit_many/aggregate_many и выполняются одним
+    обменом в execute; результат операции — result(номер).
+    """
+
+    def __init__(self, store: "VelocityStore"):
+        self.store = store
+        self.operations: List[Tuple[str, list, int]] = []
+        self.results: List[list] = []
+
+    def hit_many(self, hits: Sequence[Tuple[str, int]], window_ms: int) -> int:
+        self.operations.append(("hit", list(hits), window_ms))
+        return len(self.operations) - 1
+
+    def aggregate_many(self, batches: Sequence[Sequence[VelocityUpdate]], now_ms: int) -> int:
+        self.operations.append(("aggregate", list(batches), now_ms))
+        return len(self.operations) - 1
+
+    def execute(self):
+        self.results = self.store.execute_batch(self.operations)
+
+    async def execute_async(self):
+        self.results = await self.store.execute_batch_async(self.operations)
+
+    def result(self, handle: int) -> list:
+        return self.results[handle]
+
+    def __len__(self) -> int:
+        return len(self.operations)
+
+
+class VelocityStore(ABC):
+    """
+    Хранилище скользящих счётчиков событий для velocity-правил.
+    remote=True — каждый вызов идёт по сети, правило выгодно ожидать асинхронно.
+    """
+    remote = False
+
+    @abstractmethod
+    def hit(self, key: str, now_ms: int, window_ms: int) -> int:
+        """Регистрирует событие и возвращает число событий за окно, включая его"""
+
+    @abstractmethod
+    def aggregate(self, updates: Sequence[VelocityUpdate], now_ms: int) -> List[float]:
+        """
+        Применяет обновления и возвращает значения агрегатов за окно (с учётом
+        текущего события) в том же порядке. Все обновления — за один обмен.
+        """
+
+    def batch(self) -> VelocityBatch:
+        """Пачка отложенных операций — см. VelocityBatch"""
+        return VelocityBatch(self)
+
+    def execute_batch(self, operations: List[Tuple[str, list, int]]) -> List[list]:
+        """
+        Выполняет операции VelocityBatch по порядку. Удалённые хранилища
+        переопределяют метод, чтобы уложить всю пачку в один обмен.
+        """
+        results = []
+        for kind, items, argument in operations:
+            if kind == "hit":
+                results.append([self.hit(key, now_ms, argument) for key, now_ms in items])
+            else:
+                results.append([self.aggregate(updates, argument) for updates in items])
+        return results
+
+    async def execute_batch_async(self, operations: List[Tuple[str, list, int]]) -> List[list]:
+        """execute_batch без блокировки event loop; локальные хранилища считают на месте"""
+        return self.execute_batch(operations)
+
+    def hit_many(self, hits: Sequence[Tuple[str, int]], window_ms: int) -> List[int]:
+        """hit для пачки (ключ, время) в порядке поступления — за один обмен"""
+        batch = self.batch()
+        handle = batch.hit_many(hits, window_ms)
+        batch.execute()
+        return batch.result(handle)
+
+    def aggregate_many(self, batches: Sequence[Sequence[VelocityUpdate]], now_ms: int) -> List[List[float]]:
+        """aggregate для нескольких транзакций по порядку — за один обмен"""
+        batch = self.batch()
+        handle = batch.aggregate_many(batches, now_ms)
+        batch.execute()
+        return batch.result(handle)
+
+    @abstractmethod
+    def clear(self):
+        """Сбрасывает все счётчики"""
+
+
+class RedisVelocityStore(VelocityStore):
+    """
+    Точное скользящее окно в Redis — общее для всех узлов. Синхронный путь
+    (evaluate, пакетная оценка) и асинхронный (evaluate_async, execute_async)
+    работают через общие пулы app.db.redis с одними настройками подключения.
+    Синхронный клиент блокирует поток до ответа, поэтому допустим только вне
+    event loop — в потоке (asyncio.to_thread) или процессе пула, см. _blocking.
+    """
+    remote = True
+
+    def __init__(
+        self,
+        client: Optional[redis.Redis] = None,
+        async_client: Optional[async_redis.Redis] = None
+    ):
+        self.client = client if client is not None else get_sync_redis()
+        # EVALSHA с откатом на EVAL, если скрипт ещё не загружен на сервер
+        self._sliding_window = self.client.register_script(SLIDING_WINDOW_SCRIPT)
+        self._async_client = async_client
+        self._sliding_window_async = None
+        # Уникальные члены sorted set: события в одну миллисекунду не должны склеиваться
+        self._member_prefix = uuid.uuid4().hex[:8]
+        self._member_sequence = itertools.count()
+
+    @property
+    def async_client(self) -> async_redis.Redis:
+        if self._async_client is None:
+            self._async_client = get_redis()
+        return self._async_client
+
+    def _member(self, now_ms: int) -> str:
+        return f"{self._member_prefix}:{now_ms}:{next(self._member_sequence)}"
+
+    @staticmethod
+    def _blocking(operation: str):
+        """
+        Проверка перед командой синхронного клиента: в потоке с работающим
+        event loop она остановила бы все запросы процесса. Такой вызов —
+        ошибка маршрутизации, правило получает исключение вместо блокировки.
+        """
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        raise RuntimeError(
+            f"Blocking Redis call ({operation}) on the event loop thread; "
+            f"use evaluate_async/execute_async or run it in a worker thread"
+        )
+
+    def hit(self, key: str, now_ms: int, window_ms: int) -> int:
+        self._blocking("hit")
+        return int(self._sliding_window(keys=[key], args=[now_ms, window_ms, self._member(now_ms)]))
+
+    def aggregate(self, updates: Sequence[VelocityUpdate], now_ms: int) -> List[float]:
+        """
+        Подокна — отдельные ключи {key}:{epoch} с TTL чуть больше окна.
+        Запись в текущее подокно и чтение всех подокон окна идут одним конвейером.
+        """
+        return self.aggregate_many([updates], now_ms)[0]
+
+    @staticmethod
+    def _queue_aggregate(pipe, update: VelocityUpdate, now_ms: int):
+        """Три команды на обновление: запись в подокно, TTL, чтение окна"""
+        bucket_ms = _bucket_ms(update.window_ms, update.buckets)
+        epoch = now_ms // bucket_ms
+        keys = [f"{update.key}:{e}" for e in range(epoch - update.buckets + 1, epoch + 1)]
+        current = keys[-1]
+        if update.kind == "distinct":
+            pipe.pfadd(current, str(update.value))
+        elif update.kind == "sum":
+            pipe.incrbyfloat(current, float(update.value))
+        else:
+            pipe.incr(current)
+        pipe.pexpire(current, update.window_ms + bucket_ms)
+        if update.kind == "distinct":
+            # PFCOUNT по нескольким ключам — мощность объединения
+            pipe.pfcount(*keys)
+        else:
+            pipe.mget(keys)
+
+    @staticmethod
+    def _read_aggregates(replies: List[Any]) -> List[float]:
+        values = []
+        for reading in replies[2::3]:
+            if isinstance(reading, list):
+                values.append(sum(float(part) for part in reading if part is not None))
+            else:
+                values.append(float(reading))
+        return values
+
+    def _queue_batch(self, pipe, script, operations: List[Tuple[str, list, int]]):
+        """
+        Ставит операции пачки в конвейер по порядку. Отдаёт вызовы скрипта:
+        у асинхронного клиента их нужно дождаться до следующей команды.
+        """
+        for kind, items, argument in operations:
+            if kind == "hit":
+                for key, now_ms in items:
+                    yield script(keys=[key], args=[now_ms, argument, self._member(now_ms)], client=pipe)
+            else:
+                for updates in items:
+                    for update in updates:
+                        self._queue_aggregate(pipe, update, argument)
+
+    def _split_replies(self, operations: List[Tuple[str, list, int]], replies: List[Any]) -> List[list]:
+        results = []
+        offset = 0
+        for kind, items, _ in operations:
+            if kind == "hit":
+                results.append([int(count) for count in replies[offset:offset + len(items)]])
+                offset += len(items)
+            else:
+                values = []
+                for updates in items:
+                    size = 3 * len(updates)
+                    values.append(self._read_aggregates(replies[offset:offset + size]))
+                    offset += size
+                results.append(values)
+        return results
+
+    def execute_batch(self, operations: List[Tuple[str, list, int]]) -> List[list]:
+        """Все операции пачки — одним конвейером; ответы раскладываются по порядку"""
+        self._blocking("execute_batch")
+        pipe = self.client.pipeline(transaction=False)
+        for _ in self._queue_batch(pipe, self._sliding_window, operations):
+            pass
+        return self._split_replies(operations, pipe.execute())
+
+    async def execute_batch_async(self, operations: List[Tuple[str, list, int]]) -> List[list]:
+        """Тот же конвейер через асинхронный пул — event loop не блокируется"""
+        client = self.async_client
+        if self._sliding_window_async is None:
+            self._sliding_window_async = client.register_script(SLIDING_WINDOW_SCRIPT)
+        pipe = client.pipeline(transaction=False)
+        for call in self._queue_batch(pipe, self._sliding_window_async, operations):
+            await call
+        return self._split_replies(operations, await pipe.execute())
+
+    def clear(self):
+        self._blocking("clear")
+        for key in self.client.scan_iter(match="velocity:*"):
+            self.client.delete(key)
+
+
+class _Ring:
+    """
+    Кольцевой буфер сумм по подокнам длиной bucket_ms (count — сумма единиц).
+    total — сумма по буферу; при сдвиге времени обнуляются только вышедшие подокна.
+    """
+    __slots__ = ("bucket_ms", "counts", "total", "last")
+
+    def __init__(self, bucket_ms: int, buckets: int):
+        self.bucket_ms = bucket_ms
+        self.counts = array("d", bytes(8 * buckets))
+        self.total = 0.0
+        self.last = -1
+
+    def hit(self, now_ms: int, amount: float = 1.0) -> float:
+        size = len(self.counts)
+        epoch = now_ms // self.bucket_ms
+        if epoch > self.last:
+            if epoch - self.last >= size:
+                # Всё окно устарело — обнуляем без накопления ошибки округления
+                for slot in range(size):
+                    self.counts[slot] = 0.0
+                self.total = 0.0
+            else:
+                for expired in range(self.last + 1, epoch + 1):
+                    slot = expired % size
+                    self.total -= self.counts[slot]
+                    self.counts[slot] = 0.0
+            self.last = epoch
+        elif epoch <= self.last - size:
+            # Событие старше окна (часы отстали) — учитываем в текущем подокне
+            epoch = self.last
+        self.counts[epoch % size] += amount
+        self.total += amount
+        return self.total
+
+
+class _Sketch:
+    """
+    HyperLogLog по подокнам: регистры (buckets × 2^precision) в одном массиве
+    NumPy. Оценка за окно — поэлементный максимум живых подокон. Память на ключ
+    постоянна: buckets * 2^precision байт.
+    """
+    __slots__ = ("bucket_ms", "precision", "registers", "epochs", "last")
+
+    def __init__(self, bucket_ms: int, buckets: int, precision: int):
+        self.bucket_ms = bucket_ms
+        self.precision = precision
+        self.registers = np.zeros((buckets, 1 << precision), dtype=np.uint8)
+        self.epochs = np.full(buckets, -1, dtype=np.int64)
+        self.last = -1
+
+    def add(self, now_ms: int, member: Any) -> float:
+        size = len(self.epochs)
+        epoch = now_ms // self.bucket_ms
+        if epoch > self.last:
+            self.last = epoch
+        elif epoch <= self.last - size:
+            # Событие старше окна (часы отстали) — учитываем в текущем подокне
+            epoch = self.last
+        slot = epoch % size
+        if self.epochs[slot] != epoch:
+            self.registers[slot] = 0
+            self.epochs[slot] = epoch
+
+        p = self.precision
+        hashed = int.from_bytes(blake2b(str(member).encode(), digest_size=8).digest(), "big")
+        index = hashed >> (64 - p)
+        rest = hashed & ((1 << (64 - p)) - 1)
+        rank = (64 - p) - rest.bit_length() + 1
+        if rank > self.registers[slot, index]:
+            self.registers[slot, index] = rank
+
+        merged = self.registers[self.epochs > self.last - size].max(axis=0)
+        m = merged.size
+        estimate = (0.7213 / (1 + 1.079 / m)) * m * m / float(_INVERSE_POWERS[merged].sum())
+        zeros = int(np.count_nonzero(merged == 0))
+        if estimate <= 2.5 * m and zeros:
+            # Поправка для малых мощностей (linear counting)
+            estimate = m * math.log(m / zeros)
+        return float(round(estimate))
+
+
+class InMemoryVelocityStore(VelocityStore):
+    """
+    Счётчики в памяти процесса для одноузловой установки и бенчмарков.
+    Окно делится на buckets подокон, поэтому граница окна точна до одного
+    подокна. Память ограничена max_keys: дольше всех не использовавшиеся
+    ключи вытесняются. distinct-агрегаты — HyperLogLog с 2^precision
+    регистрами (погрешность ~1.04 / sqrt(2^precision)).
+    """
+
+    def __init__(self, buckets: int = 60, max_keys: int = 100_000, precision: int = 10):
+        self.buckets = buckets
+        self.max_keys = max_keys
+        self.precision = precision
+        self._rings: "OrderedDict[str, Any]" = OrderedDict()
+        # Правило может оцениваться из нескольких потоков
+        self._lock = threading.Lock()
+
+    def _state(self, key: str, kind: type, bucket_ms: int, buckets: int):
+        """Состояние ключа (вызывать под _lock); новое — с вытеснением старейшего"""
+        state = self._rings.get(key)
+        if (
+            state is None or type(state) is not kind or state.bucket_ms != bucket_ms
+            or len(state.epochs if kind is _Sketch else state.counts) != buckets
+        ):
+            if kind is _Sketch:
+                state = _Sketch(bucket_ms, buckets, self.precision)
+            else:
+                state = _Ring(bucket_ms, buckets)
+            self._rings[key] = state
+            if len(self._rings) > self.max_keys:
+                self._rings.popitem(last=False)
+        else:
+            self._rings.move_to_end(key)
+        return state
+
+    def hit(self, key: str, now_ms: int, window_ms: int) -> int:
+        bucket_ms = _bucket_ms(window_ms, self.buckets)
+        with self._lock:
+            return int(self._state(key, _Ring, bucket_ms, self.buckets).hit(now_ms))
+
+    def aggregate(self, updates: Sequence[VelocityUpdate], now_ms: int) -> List[float]:
+        values = []
+        with self._lock:
+            for update in updates:
+                bucket_ms = _bucket_ms(update.window_ms, update.buckets)
+                if update.kind == "distinct":
+                    state = self._state(update.key, _Sketch, bucket_ms, update.buckets)
+                    values.append(state.add(now_ms, update.value))
+                else:
+                    amount = float(update.value) if update.kind == "sum" else 1.0
+                    state = self._state(update.key, _Ring, bucket_ms, update.buckets)
+                    values.append(state.hit(now_ms, amount))
+        return values
+
+    def clear(self):
+        with self._lock:
+            self._rings.clear()
+
+    def __len__(self) -> int:
+        return len(self._rings)
+
+
+_store: Optional[VelocityStore] = None
+
+
+def create_velocity_store(backend: Optional[str] = None) -> VelocityStore:
+    """
+    Хранилище по имени: redis (по умолчанию) или memory.
+    По умолчанию имя берётся из VELOCITY_BACKEND.
+    """
+    backend = (backend or os.getenv("VELOCITY_BACKEND", "redis")).lower()
+    if backend == "redis":
+        return RedisVelocityStore()
+    if backend == "memory":
+        return InMemoryVelocityStore(
+            buckets=int(os.getenv("VELOCITY_BUCKETS", "60")),
+            max_keys=int(os.getenv("VELOCITY_MAX_KEYS", "100000"))
+        )
+    raise ValueError(f"Unknown velocity backend '{backend}'. Use 'redis' or 'memory'")
+
+
+def get_velocity_store() -> VelocityStore:
+    """Общее хранилище процесса (создаётся при первом обращении)"""
+    global _store
+    if _store is None:
+        _store = create_velocity_store()
+        logger.info(f"Velocity store: {type(_store).__name__}")
+    return _store
+
+
+def set_velocity_store(store: VelocityStore):
+    """Подменяет общее хранилище (правила, созданные после вызова, используют его)"""
+    global _store
+    _store = store
@@ -0,0 +1,108 @@
+"""
+Контроль допуска транзакций в очередь (backpressure).
+Глубина очереди берётся из кэша, который обновляется фоном не чаще раза
+в QUEUE_DEPTH_CACHE_MS: проверка не добавляет обращения к Redis на запрос.
+"""
+import asyncio
+import os
+import time
+from typing import Any, Dict, Optional
+from app.core.logging import get_logger
+from app.core.metrics import admission_decisions
+from app.db.redis import redis_client
+
+logger = get_logger(__name__)
+
+SHED_POLICIES = ("reject", "sync")
+
+# Решения допуска
+QUEUED = "queued"
+SYNC = "sync"
+REJECTED = "rejected"
+
+
+class AdmissionController:
+    """
+    Решает судьбу входящей транзакции по глубине очереди:
+    - ниже high_water_mark (QUEUE_HIGH_WATER_MARK, 0 — без ограничения) — queued;
+    - выше — по политике policy (QUEUE_SHED_POLICY):
+      reject — 429 с Retry-After (QUEUE_RETRY_AFTER, секунды),
+      sync — транзакции с amount >= sync_min_amount (ADMISSION_SYNC_MIN_AMOUNT)
+      оцениваются сразу в запросе, остальные отклоняются.
+    """
+
+    def __init__(
+        self,
+        high_water_mark: Optional[int] = None,
+        policy: Optional[str] = None,
+        retry_after: Optional[int] = None,
+        depth_ttl_ms: Optional[float] = None,
+        sync_min_amount: Optional[float] = None
+    ):
+        self.high_water_mark = (
+            high_water_mark if high_water_mark is not None
+            else int(os.getenv("QUEUE_HIGH_WATER_MARK", "10000"))
+        )
+        self.policy = (policy or os.getenv("QUEUE_SHED_POLICY", "reject")).lower()
+        if self.policy not in SHED_POLICIES:
+            raise ValueError(f"Unknown shed policy '{self.policy}'. Use one of {SHED_POLICIES}")
+        self.retry_after = retry_after or int(os.getenv("QUEUE_RETRY_AFTER", "1"))
+        self.depth_ttl = (depth_ttl_ms or float(os.getenv("QUEUE_DEPTH_CACHE_MS", "250"))) / 1000
+        self.sync_min_amount = (
+            sync_min_amount if sync_min_amount is not None
+            else float(os.getenv("ADMISSION_SYNC_MIN_AMOUNT", "10000"))
+        )
+        self._depth: Optional[int] = None
+        self._checked_at = float("-inf")
+        self._refresh: Optional[asyncio.Task] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.high_water_mark > 0
+
+    async def _refresh_depth(self):
+        try:
+            depth = await redis_client.get_queue_length(default=None)
+            # При ошибке прежнее значение остаётся: недоступный Redis проявится при push
+            if depth is not None:
+                self._depth = depth
+        finally:
+            self._checked_at = time.monotonic()
+
+    async def queue_depth(self) -> int:
+        """
+        Кэшированная глубина очереди. Устаревшее значение отдаётся сразу,
+        обновление идёт одной фоновой задачей на все запросы; ждёт его
+        только самый первый запрос.
+        """
+        if time.monotonic() - self._checked_at >= self.depth_ttl:
+            if self._refresh is None or self._refresh.done():
+                self._refresh = asyncio.create_task(self._refresh_depth())
+            if self._depth is None:
+                await asyncio.shield(self._refresh)
+        return self._depth or 0
+
+    async def admit(self, transaction_data: Dict[str, Any]) -> str:
+        """Решение для транзакции: queued, sync или rejected"""
+        if not self.enabled:
+            decision = QUEUED
+        elif await self.queue_depth() < self.high_water_mark:
+            decision = QUEUED
+            # Свои постановки учитываются сразу, не дожидаясь обновления кэша
+            self._depth = (self._depth or 0) + 1
+        elif self.policy == "sync" and float(transaction_data.get("amount") or 0) >= self.sync_min_amount:
+            decision = SYNC
+        else:
+            decision = REJECTED
+
+        admission_decisions.labels(decision).inc()
+        if decision != QUEUED:
+            logger.warning(
+                f"Queue over high-water mark ({self._depth} >= {self.high_water_mark}), "
+                f"transaction {transaction_data.get('id')}: {decision}"
+            )
+        return decision
+
+
+# Контроллер процесса API
+admission_controller = AdmissionController()
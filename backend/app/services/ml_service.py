@@ -1,7 +1,9 @@
 import logging
 import random
 from datetime import datetime
-from typing import Dict, Any
+from typing import Dict, Any, List
+
+import numpy as np
 
 logger = logging.getLogger(__name__)
 
@@ -56,6 +58,44 @@ class MLModelSimulator:
         features['currency'] = transaction.get('currency', 'USD')
         
         return features
+
+    def extract_features_batch(self, columns) -> Dict[str, np.ndarray]:
+        """
+        Колоночный вариант extract_features для TransactionColumns.
+        Возвращает словарь колонок с теми же признаками.
+        """
+        hours, weekdays = columns.time_features()
+        transactions = columns.transactions
+        return {
+            'amount': columns.numeric_column('amount'),
+            'hour': hours,
+            'day_of_week': weekdays,
+            'is_weekend': (weekdays >= 5).astype(np.int64),
+            'merchant': [tx.get('merchant', 'unknown') for tx in transactions],
+            'currency': [tx.get('currency', 'USD') for tx in transactions],
+        }
+
+    @staticmethod
+    def feature_rows(features: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Разворачивает колонки признаков обратно в словари по транзакциям."""
+        return [
+            {
+                'amount': amount,
+                'hour': hour,
+                'day_of_week': day_of_week,
+                'is_weekend': is_weekend,
+                'merchant': merchant,
+                'currency': currency,
+            }
+            for amount, hour, day_of_week, is_weekend, merchant, currency in zip(
+                features['amount'].tolist(),
+                features['hour'].tolist(),
+                features['day_of_week'].tolist(),
+                features['is_weekend'].tolist(),
+                features['merchant'],
+                features['currency'],
+            )
+        ]
     
     def predict(self, features: Dict[str, Any]) -> float:
         """
@@ -87,6 +127,20 @@ class MLModelSimulator:
         logger.debug(f"ML prediction: features={features}, risk_score={risk_score:.3f}")
         return risk_score
 
+    def predict_batch(self, features: Dict[str, np.ndarray]) -> np.ndarray:
+        """
+        Векторный вариант predict: та же эвристика над колонками.
+        Случайная база берётся из того же генератора random, что и в predict.
+        """
+        amount = features['amount']
+        hour = features['hour']
+
+        base_risk = np.array([random.uniform(0.1, 0.4) for _ in range(len(amount))])
+        base_risk += np.where(amount > 100000, 0.3, np.where(amount > 50000, 0.15, 0.0))
+        base_risk += np.where((hour >= 22) | (hour <= 5), 0.2, 0.0)
+
+        return np.clip(base_risk, 0.0, 1.0)
+
 
 # Глобальный экземпляр модели
 _ml_model = None
@@ -3,29 +3,62 @@
 (без зависимостей от redis и других модулей)
 """
 import json
-from sqlalchemy.orm import Session
+from typing import Any, Dict, List
+from sqlalchemy import case, select, update
 from app.db.database import SessionLocal
-from app.db.models import RuleResult
+from app.db.models import RuleResult, Transaction
 
-def save_rule_result(transaction_id: int, rule_id: int, result: dict):
+def save_evaluations(outcomes: List[Dict[str, Any]]) -> int:
     """
-    Сохраняет результат проверки правила для транзакции
+    Сохраняет оценки пачки транзакций одной транзакцией БД:
+    результаты правил — многострочным INSERT, статусы — одним UPDATE.
+    outcomes — [{"transaction_id": uuid, "status": str, "details": details оценки}],
+    details в обычном (не lean) виде. Возвращает число сохранённых результатов правил.
     """
+    if not outcomes:
+        return 0
     db = SessionLocal()
     try:
-        rule_result = RuleResult(
-            transaction_id=transaction_id,
-            rule_id=rule_id,
-            triggered=result["passed"],
-            risk_score=result["risk_score"],
-            details=json.dumps(result["details"])
+        external_ids = [outcome["transaction_id"] for outcome in outcomes]
+        # rule_results ссылаются на первичный ключ транзакции, а не на её uuid
+        primary_keys = dict(db.execute(
+            select(Transaction.transaction_id, Transaction.id)
+            .where(Transaction.transaction_id.in_(external_ids))
+        ).all())
+
+        rows = []
+        for outcome in outcomes:
+            primary_key = primary_keys.get(outcome["transaction_id"])
+            if primary_key is None:
+                continue
+            for entry in outcome["details"]:
+                result = entry.get("result")
+                # Ошибки и пропущенные правила результата не имеют
+                if result is None or entry.get("rule_id") is None:
+                    continue
+                rows.append({
+                    "transaction_id": primary_key,
+                    "rule_id": entry["rule_id"],
+                    "triggered": not result["passed"],
+                    "risk_score": result["risk_score"],
+                    "details": json.dumps(result["details"])
+                })
+        if rows:
+            # executemany: SQLAlchemy собирает многострочные INSERT
+            # (insertmanyvalues) из одного скомпилированного выражения
+            db.execute(RuleResult.__table__.insert(), rows)
+
+        statuses = {outcome["transaction_id"]: outcome["status"] for outcome in outcomes}
+        db.execute(
+            update(Transaction)
+            .where(Transaction.transaction_id.in_(list(statuses)))
+            .values(status=case(statuses, value=Transaction.transaction_id))
+            .execution_options(synchronize_session=False)
         )
-        db.add(rule_result)
         db.commit()
-        db.refresh(rule_result)
-        return rule_result
+        return len(rows)
     except Exception as e:
         db.rollback()
         raise e
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
@@ -1,3 +1,4 @@
+import hashlib
 import json
 import logging
 from sqlalchemy.orm import Session
@@ -6,6 +7,7 @@ from app.rules.threshold_rule import ThresholdRule
 from app.rules.pattern_rule import PatternRule
 from app.rules.composite_rule import CompositeRule
 from app.rules.ml_rule import MLRule
+from app.rules.velocity_rule import VelocityRule
 
 logger = logging.getLogger(__name__)
 
@@ -65,6 +67,14 @@ def load_rules_from_db(db_session: Session):
                         parameters=parameters,
                         priority = db_rule.priority
                     )
+                elif rule_type == "velocity":
+                    instance = VelocityRule(
+                        rule_id=db_rule.id,
+                        name=db_rule.name,
+                        enabled=db_rule.is_active,
+                        parameters=parameters,
+                        priority = db_rule.priority
+                    )
                 else:
                     logger.warning(f"Unknown rule type '{rule_type}' for rule_id={db_rule.id}")
                     continue
@@ -86,6 +96,20 @@ def load_rules_from_db(db_session: Session):
         logger.error(f"Failed to load rules from database: {e}")
         return {}
 
+def rules_fingerprint(db_session: Session) -> str:
+    """
+    Отпечаток активных правил: меняется при любом изменении их набора или
+    полей, которые читает load_rules_from_db (имя, тип, параметры, приоритет).
+    Позволяет процессам-воркерам не пересоздавать правила зря.
+    """
+    rows = (
+        db_session.query(Rule.id, Rule.name, Rule.type, Rule.condition, Rule.priority, Rule.is_active)
+        .filter_by(is_active=True)
+        .order_by(Rule.id)
+        .all()
+    )
+    return hashlib.sha1(repr([tuple(row) for row in rows]).encode("utf-8")).hexdigest()
+
 def reload_rules(db_session: Session):
     """
     Перезагружает правила из БД и обновляет кэш в памяти
@@ -56,6 +56,27 @@ def update_transaction_status(transaction_id: str, status: str):
     finally:
         db.close()
 
+def update_transactions_status(transaction_ids: List[str], status: str, current_status: str = None) -> int:
+    """
+    Обновление статуса нескольких транзакций одним UPDATE; current_status —
+    только тех, у кого сейчас такой статус. Число обновлённых
+    """
+    if not transaction_ids:
+        return 0
+    db = SessionLocal()
+    try:
+        query = db.query(Transaction).filter(Transaction.transaction_id.in_(transaction_ids))
+        if current_status:
+            query = query.filter(Transaction.status == current_status)
+        updated = query.update({Transaction.status: status}, synchronize_session=False)
+        db.commit()
+        return updated
+    except Exception as e:
+        db.rollback()
+        raise e
+    finally:
+        db.close()
+
 def get_all_transactions(skip: int = 0, limit: int = 100, status: str = None):
     """Получение списка транзакций с пагинацией и фильтрацией"""
     db = SessionLocal()
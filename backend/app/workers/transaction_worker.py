@@ -1,37 +1,239 @@
 import asyncio
+import os
 import time
-from typing import Dict, Any
-from app.db.redis import redis_client
+from concurrent.futures import Executor
+from contextlib import nullcontext
+from typing import Dict, Any, List, Optional, Set, Tuple
+from app.db.redis import QUEUE_RECEIPT, redis_client
 from app.core.logging import get_logger
-from app.services.transaction_service import update_transaction_status
-from app.services.rule_result_service import save_rule_result
+from app.core.metrics import (
+    worker_processed, worker_failed, worker_batch_size, drain_rule_metrics, merge_rule_metrics
+)
+from app.services.transaction_service import update_transaction_status, update_transactions_status
+from app.services.rule_result_service import save_evaluations
 
 logger = get_logger(__name__)
 
+def evaluate_in_process(
+    transactions: List[Dict[str, Any]]
+) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    """
+    Оценка пачки в процессе ProcessPoolExecutor (снимок правил загружен
+    инициализатором пула). Результат не lean: он передаётся обратно через pickle
+    вместе с метриками правил, накопленными за пачку (drain_rule_metrics) —
+    родитель добавляет их в свой /metrics.
+    """
+    from app.rules.rule_engine import rule_engine
+    evaluations = rule_engine.evaluate_batch(transactions)
+    return evaluations, drain_rule_metrics()
+
+
 class SimpleTransactionWorker:
-    def __init__(self):
+    """
+    Потребитель очереди. В пуле (WorkerPool) у каждого потребителя свой
+    consumer_id, общий semaphore ограничивает число одновременно оцениваемых
+    пачек, а executor (ProcessPoolExecutor) забирает оценку из процесса API.
+    """
+
+    def __init__(
+        self,
+        batch_size: Optional[int] = None,
+        block_timeout: Optional[float] = None,
+        consumer_id: Optional[str] = None,
+        reaper: bool = True,
+        semaphore: Optional[asyncio.Semaphore] = None,
+        executor: Optional[Executor] = None
+    ):
         self.is_running = False
         self.processed_count = 0
+        # Сколько транзакций забирать за одно пробуждение и сколько ждать первую
+        self.batch_size = batch_size or int(os.getenv("WORKER_BATCH_SIZE", "100"))
+        self.block_timeout = block_timeout or float(os.getenv("WORKER_BLOCK_TIMEOUT", "1.0"))
+        # С какого размера пачка оценивается матрично (evaluate_batch_async): на
+        # пачках меньше ~16 транзакций построчная асинхронная оценка быстрее
+        self.batch_eval_min = int(os.getenv("WORKER_BATCH_EVAL_MIN", "16"))
+        # None — потребитель процесса по умолчанию (redis_client.consumer_id)
+        self.consumer_id = consumer_id
+        # Возвращать ли в очередь транзакции упавших потребителей
+        self.reaper = reaper
+        self.semaphore = semaphore
+        self.executor = executor
+        # Начатые сохранения пачек: их не прерывает отмена при остановке
+        self._completing: Set[asyncio.Task] = set()
     
     async def process_queue(self, delay: float = 1.0):
+        """
+        Блокирующее чтение очереди: ожидание транзакции до block_timeout,
+        затем забираются все готовые (до batch_size) и оцениваются пачкой.
+        Раз в половину visibility timeout воркер возвращает в очередь
+        транзакции упавших потребителей, раз в QUEUE_RETRY_POLL_MS — транзакции,
+        время повтора которых наступило.
+        delay — пауза только после ошибки (например, Redis недоступен).
+        """
         self.is_running = True
-        logger.info("Transaction worker started")
+        logger.info(f"Transaction worker started (batch_size={self.batch_size})")
+        reap_interval = redis_client.visibility_timeout / 2
+        next_reap = 0.0 if self.reaper else float("inf")
+        next_retry = next_reap
+
+        try:
+            # Незавершённое прошлым запуском с тем же WORKER_CONSUMER_ID
+            await redis_client.release_inflight(self.consumer_id)
+        except Exception as e:
+            logger.error(f"Failed to release in-flight transactions: {e}")
         
         while self.is_running:
             try:
-                transaction_data = await redis_client.pop_transaction()
-                
-                if transaction_data:
-                    success = await self.process_transaction(transaction_data)
-                    if success:
-                        self.processed_count += 1
-                
-                await asyncio.sleep(delay)
+                if time.monotonic() >= next_reap:
+                    next_reap = time.monotonic() + reap_interval
+                    await redis_client.requeue_expired()
+                if time.monotonic() >= next_retry:
+                    next_retry = time.monotonic() + redis_client.retry_poll
+                    await redis_client.promote_retries()
+
+                transactions = await redis_client.pop_transactions(
+                    self.batch_size, self.block_timeout, self.consumer_id
+                )
+                if transactions:
+                    worker_batch_size.observe(len(transactions))
+                    async with self.semaphore or nullcontext():
+                        await self.process_batch(transactions)
                 
             except Exception as e:
                 logger.error(f"Worker error: {e}")
+                try:
+                    # Взятое, но не подтверждённое — обратно в очередь, не ждать аренды
+                    await redis_client.release_inflight(self.consumer_id)
+                except Exception:
+                    pass
                 await asyncio.sleep(delay)
     
+    async def process_batch(self, transactions: List[Dict[str, Any]]) -> int:
+        """
+        Оценивает пачку в процессе executor (evaluate_batch), без него —
+        evaluate_batch_async (velocity-правила через асинхронный клиент) от
+        batch_eval_min транзакций, меньшие пачки — evaluate_transaction_async
+        по одной. Сохраняет результаты и подтверждает транзакции в очереди;
+        одна транзакция без executor идёт через process_transaction.
+        Отмена (остановка воркера) прерывает только оценку: начатое сохранение
+        доводится до подтверждения, его дожидается flush.
+        Возвращает число успешно обработанных.
+        """
+        evaluations = None
+        try:
+            if self.executor is not None:
+                payload = [
+                    {key: value for key, value in transaction.items() if key != QUEUE_RECEIPT}
+                    for transaction in transactions
+                ]
+                evaluations, rule_metrics = await asyncio.get_running_loop().run_in_executor(
+                    self.executor, evaluate_in_process, payload
+                )
+                merge_rule_metrics(rule_metrics)
+            elif len(transactions) >= self.batch_eval_min:
+                from app.rules.rule_engine import rule_engine
+                evaluations = await rule_engine.evaluate_batch_async(transactions, lean=True)
+            elif len(transactions) > 1:
+                from app.rules.rule_engine import rule_engine
+                evaluations = [
+                    await rule_engine.evaluate_transaction_async(transaction, lean=True)
+                    for transaction in transactions
+                ]
+        except Exception as e:
+            logger.error(f"Batch evaluation failed, falling back to one by one: {e}")
+
+        completing = asyncio.ensure_future(self._complete_and_ack(transactions, evaluations))
+        self._completing.add(completing)
+        completing.add_done_callback(self._completing.discard)
+        return await asyncio.shield(completing)
+
+    async def _complete_and_ack(
+        self,
+        transactions: List[Dict[str, Any]],
+        evaluations: Optional[List[Dict[str, Any]]]
+    ) -> int:
+        if evaluations is None:
+            processed = 0
+            for transaction_data in transactions:
+                processed += await self.process_transaction(transaction_data)
+        else:
+            # Сохранение синхронное (SQLAlchemy) — вне event loop
+            failures = await asyncio.to_thread(self.complete_batch, transactions, evaluations)
+            await self.retry_failed(failures)
+            processed = len(transactions) - len(failures)
+
+        # Результаты сохранены, неудавшиеся отложены на повтор или в DLQ —
+        # транзакции можно снять с обработки
+        await redis_client.ack_transactions(transactions, self.consumer_id)
+        return processed
+
+    async def retry_failed(self, failures: List[Tuple[Dict[str, Any], Exception]]):
+        """
+        Неудавшиеся транзакции — на повтор с экспоненциальной задержкой;
+        исчерпавшие QUEUE_MAX_ATTEMPTS попыток уходят в DLQ со статусом failed.
+        Ошибка Redis пробрасывается: транзакции остаются неподтверждёнными.
+        """
+        if not failures:
+            return
+        dead = await redis_client.schedule_retries(
+            [(transaction_data, f"{type(e).__name__}: {e}") for transaction_data, e in failures],
+            self.consumer_id
+        )
+        if not dead:
+            return
+        worker_failed.inc(len(dead))
+        try:
+            await asyncio.to_thread(update_transactions_status, [t.get('id') for t in dead], "failed")
+        except Exception as e:
+            # Транзакции уже в DLQ; статус — только отражение для админки
+            logger.error(f"Failed to mark dead-lettered transactions as failed: {e}")
+
+    async def flush(self):
+        """Дожидается сохранений, начатых до отмены обработки"""
+        if self._completing:
+            await asyncio.gather(*self._completing, return_exceptions=True)
+
+    def complete_batch(
+        self,
+        transactions: List[Dict[str, Any]],
+        evaluations: List[Dict[str, Any]]
+    ) -> List[Tuple[Dict[str, Any], Exception]]:
+        """
+        Сохраняет оценки всей пачки одной транзакцией БД. Если она не прошла,
+        транзакции сохраняются по одной — ошибка одной не роняет остальные.
+        Возвращает несохранённые: [(транзакция, ошибка)].
+        """
+        try:
+            self.persist_evaluations(transactions, evaluations)
+        except Exception as e:
+            logger.error(f"Batch persistence failed, saving one by one: {e}")
+            failures = []
+            for transaction_data, evaluation_result in zip(transactions, evaluations):
+                error = self._complete(transaction_data, evaluation_result)
+                if error is not None:
+                    failures.append((transaction_data, error))
+            return failures
+
+        logger.info(f"Batch of {len(transactions)} transactions processed")
+        self.processed_count += len(transactions)
+        worker_processed.inc(len(transactions))
+        return []
+
+    def persist_evaluations(self, transactions: List[Dict[str, Any]], evaluations: List[Dict[str, Any]]) -> List[str]:
+        """Результаты правил и итоговые статусы; возвращает статусы"""
+        from app.rules.rule_engine import rule_engine
+        outcomes = [
+            {
+                "transaction_id": transaction_data.get('id'),
+                "status": self.determine_status(evaluation_result),
+                # details строятся только здесь
+                "details": rule_engine.materialize(evaluation_result).get('details', [])
+            }
+            for transaction_data, evaluation_result in zip(transactions, evaluations)
+        ]
+        save_evaluations(outcomes)
+        return [outcome["status"] for outcome in outcomes]
+
     async def process_transaction(self, transaction_data: Dict[str, Any]) -> bool:
         transaction_id = transaction_data.get('id', 'unknown')
         
@@ -40,30 +242,45 @@ class SimpleTransactionWorker:
             
             # Импортируем rule_engine внутри функции чтобы избежать circular import
             from app.rules.rule_engine import rule_engine
-            evaluation_result = rule_engine.evaluate_transaction(transaction_data)
+            evaluation_result = await rule_engine.evaluate_transaction_async(transaction_data, lean=True)
             
-            # Сохраняем результаты каждого правила
-            for rule_result in evaluation_result.get('details', []):
-                if 'rule_id' in rule_result:
-                    save_rule_result(
-                        transaction_id=transaction_id,
-                        rule_id=rule_result['rule_id'],
-                        result=rule_result
-                    )
-            
-            # Определяем финальный статус
-            final_status = self.determine_status(evaluation_result)
-            
-            # Обновляем статус транзакции
-            update_transaction_status(transaction_id, final_status)
+        except Exception as e:
+            logger.error(f"Failed to process transaction {transaction_id}: {e}")
+            await self.retry_failed([(transaction_data, e)])
+            return False
+
+        error = await asyncio.to_thread(self._complete, transaction_data, evaluation_result)
+        if error is not None:
+            await self.retry_failed([(transaction_data, error)])
+        return error is None
+
+    def complete_transaction(self, transaction_data: Dict[str, Any], evaluation_result: Dict[str, Any]) -> bool:
+        """
+        Сохраняет результаты правил и итоговый статус оценённой транзакции.
+        Вне очереди (синхронная оценка в API): при ошибке статус сразу failed.
+        """
+        error = self._complete(transaction_data, evaluation_result)
+        if error is not None:
+            update_transaction_status(transaction_data.get('id', 'unknown'), "failed")
+            worker_failed.inc()
+        return error is None
+
+    def _complete(self, transaction_data: Dict[str, Any], evaluation_result: Dict[str, Any]) -> Optional[Exception]:
+        """Сохранение одной транзакции; ошибка возвращается, а не бросается"""
+        transaction_id = transaction_data.get('id', 'unknown')
+        
+        try:
+            # Результаты правил и финальный статус — одним commit
+            final_status = self.persist_evaluations([transaction_data], [evaluation_result])[0]
             
             logger.info(f"Transaction {transaction_id} processed. Status: {final_status}")
-            return True
+            self.processed_count += 1
+            worker_processed.inc()
+            return None
             
         except Exception as e:
             logger.error(f"Failed to process transaction {transaction_id}: {e}")
-            update_transaction_status(transaction_id, "failed")
-            return False
+            return e
     
     def determine_status(self, evaluation_result: Dict[str, Any]) -> str:
         if not evaluation_result.get('is_suspicious', False):
@@ -79,20 +296,9 @@ class SimpleTransactionWorker:
             return "approved"
     
     async def stop(self):
+        """Перестать брать пачки; текущая доводится до конца в process_queue"""
         self.is_running = False
         logger.info("Transaction worker stopped")
 
-# Глобальный экземпляр воркера
-worker = SimpleTransactionWorker()
-
-async def start_worker(delay: float = 1.0):
-    await worker.process_queue(delay)
-
-async def stop_worker():
-    await worker.stop()
-
-def get_worker_status():
-    return {
-        "is_running": worker.is_running,
-        "processed_count": worker.processed_count
-    }
\ No newline at end of file
+# Потребитель по умолчанию (один на процесс); пул — app.workers.worker_pool
+worker = SimpleTransactionWorker()
\ No newline at end of file
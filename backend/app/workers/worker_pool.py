@@ -0,0 +1,222 @@
+import asyncio
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional
+from app.core.logging import get_logger
+from app.db.redis import redis_client
+from app.workers.transaction_worker import SimpleTransactionWorker
+
+logger = get_logger(__name__)
+
+
+def load_engine_rules() -> str:
+    """
+    Загружает активные правила из БД в rule_engine этого процесса.
+    Возвращает отпечаток загруженного набора (rules_fingerprint).
+    """
+    from app.db.database import SessionLocal
+    from app.rules.rule_engine import rule_engine
+    from app.services.rule_service import load_rules_from_db, rules_fingerprint
+
+    db = SessionLocal()
+    try:
+        fingerprint = rules_fingerprint(db)
+        rules = load_rules_from_db(db)
+    finally:
+        db.close()
+    rule_engine.reload_rules(list(rules.values()))
+    return fingerprint
+
+
+def _init_process():
+    """Инициализатор процесса пула: свой снимок правил, загруженный заранее"""
+    load_engine_rules()
+
+
+class WorkerPool:
+    """
+    Пул потребителей очереди:
+    - consumers (WORKER_CONSUMERS) — число конкурентных потребителей со своими
+      consumer_id и списками обработки;
+    - concurrency (WORKER_CONCURRENCY) — сколько пачек оцениваются одновременно
+      (общий semaphore), по умолчанию = consumers;
+    - mode (WORKER_MODE): async — оценка в потоках этого процесса,
+      process — в ProcessPoolExecutor из processes (WORKER_PROCESSES) процессов
+      с предзагруженными правилами (ML, большие наборы правил);
+    - refresh_seconds (RULES_REFRESH_SECONDS) — проверка изменений правил в БД;
+      при изменении снимок перезагружается, а процессы пула пересоздаются;
+    - drain_timeout (WORKER_DRAIN_TIMEOUT) — сколько stop ждёт начатые пачки.
+    """
+
+    def __init__(
+        self,
+        consumers: Optional[int] = None,
+        concurrency: Optional[int] = None,
+        mode: Optional[str] = None,
+        processes: Optional[int] = None,
+        batch_size: Optional[int] = None,
+        refresh_seconds: Optional[float] = None,
+        drain_timeout: Optional[float] = None
+    ):
+        self.consumers = consumers or int(os.getenv("WORKER_CONSUMERS", "1"))
+        self.concurrency = concurrency or int(os.getenv("WORKER_CONCURRENCY", str(self.consumers)))
+        self.mode = (mode or os.getenv("WORKER_MODE", "async")).lower()
+        if self.mode not in ("async", "process"):
+            raise ValueError(f"Unknown worker mode '{self.mode}'. Use 'async' or 'process'")
+        self.processes = processes or int(os.getenv("WORKER_PROCESSES", str(os.cpu_count() or 1)))
+        self.batch_size = batch_size
+        self.refresh_seconds = refresh_seconds or float(os.getenv("RULES_REFRESH_SECONDS", "60"))
+        self.drain_timeout = (
+            drain_timeout if drain_timeout is not None
+            else float(os.getenv("WORKER_DRAIN_TIMEOUT", "20"))
+        )
+        self.workers: List[SimpleTransactionWorker] = []
+        self.executor: Optional[ProcessPoolExecutor] = None
+        self.fingerprint: Optional[str] = None
+        self._tasks: List[asyncio.Task] = []
+        self._refresh_task: Optional[asyncio.Task] = None
+
+    def _new_executor(self) -> ProcessPoolExecutor:
+        # spawn: процессы не наследуют потоки, соединения и event loop родителя
+        return ProcessPoolExecutor(
+            max_workers=self.processes,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_process
+        )
+
+    async def start(self):
+        """Загружает правила и запускает потребителей (не ждёт их завершения)"""
+        try:
+            self.fingerprint = await asyncio.to_thread(load_engine_rules)
+        except Exception as e:
+            logger.error(f"Failed to load rules at worker start: {e}")
+        if self.mode == "process":
+            self.executor = self._new_executor()
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+        self.workers = [
+            SimpleTransactionWorker(
+                batch_size=self.batch_size,
+                consumer_id=f"{redis_client.consumer_id}:{index}" if self.consumers > 1 else None,
+                reaper=index == 0,
+                semaphore=semaphore,
+                executor=self.executor
+            )
+            for index in range(self.consumers)
+        ]
+        self._tasks = [asyncio.create_task(worker.process_queue()) for worker in self.workers]
+        self._refresh_task = asyncio.create_task(self._refresh_rules())
+        logger.info(
+            f"Worker pool started: consumers={self.consumers}, concurrency={self.concurrency}, "
+            f"mode={self.mode}" + (f", processes={self.processes}" if self.executor else "")
+        )
+
+    async def _refresh_rules(self):
+        while True:
+            await asyncio.sleep(self.refresh_seconds)
+            try:
+                await self.refresh_rules()
+            except Exception as e:
+                logger.error(f"Rules refresh failed: {e}")
+
+    async def refresh_rules(self) -> bool:
+        """Перезагружает правила, если они изменились в БД; True — перезагружены"""
+        from app.db.database import SessionLocal
+        from app.services.rule_service import rules_fingerprint
+
+        def current() -> str:
+            db = SessionLocal()
+            try:
+                return rules_fingerprint(db)
+            finally:
+                db.close()
+
+        if await asyncio.to_thread(current) == self.fingerprint:
+            return False
+        self.fingerprint = await asyncio.to_thread(load_engine_rules)
+        if self.executor is not None:
+            # Новые пачки идут в процессы с новым снимком, старые доделывают начатое
+            old, self.executor = self.executor, self._new_executor()
+            for worker in self.workers:
+                worker.executor = self.executor
+            old.shutdown(wait=False)
+        logger.info("Worker pool rules reloaded")
+        return True
+
+    async def stop(self, timeout: Optional[float] = None):
+        """
+        Остановка с дренажом:
+        1. потребители перестают брать пачки (текущее ожидание очереди
+           заканчивается не позже WORKER_BLOCK_TIMEOUT);
+        2. начатые пачки оцениваются и сохраняются в пределах timeout
+           (по умолчанию drain_timeout);
+        3. не успевшие отменяются: начатые сохранения дожидаются (flush),
+           неподтверждённые транзакции возвращаются в очередь (release_inflight).
+        Пулы Redis и БД закрывает вызывающий — после stop.
+        """
+        timeout = self.drain_timeout if timeout is None else timeout
+        started = time.monotonic()
+        for worker in self.workers:
+            await worker.stop()
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+
+        pending = set()
+        if self._tasks:
+            _, pending = await asyncio.wait(self._tasks, timeout=timeout)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*self._tasks, *filter(None, [self._refresh_task]), return_exceptions=True)
+        self._tasks = []
+        self._refresh_task = None
+
+        released = 0
+        for worker in self.workers:
+            await worker.flush()
+            try:
+                released += await redis_client.release_inflight(worker.consumer_id)
+            except Exception as e:
+                logger.error(f"Failed to release in-flight transactions of {worker.consumer_id}: {e}")
+
+        if self.executor is not None:
+            # Запущенные оценки доходят до конца, ожидающие отменяются
+            await asyncio.to_thread(self.executor.shutdown, wait=True, cancel_futures=True)
+            self.executor = None
+        logger.info(
+            f"Worker pool stopped in {time.monotonic() - started:.1f}s: "
+            f"{len(pending)} consumers interrupted, {released} transactions released"
+        )
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "is_running": any(worker.is_running for worker in self.workers),
+            "processed_count": sum(worker.processed_count for worker in self.workers),
+            "consumers": self.consumers,
+            "concurrency": self.concurrency,
+            "mode": self.mode,
+            "processes": self.processes if self.executor else None
+        }
+
+
+# Глобальный пул процесса
+worker_pool: Optional[WorkerPool] = None
+
+
+async def start_worker():
+    """Запускает пул потребителей по настройкам окружения"""
+    global worker_pool
+    worker_pool = WorkerPool()
+    await worker_pool.start()
+
+
+async def stop_worker():
+    if worker_pool is not None:
+        await worker_pool.stop()
+
+
+def get_worker_status() -> Dict[str, Any]:
+    if worker_pool is None:
+        return {"is_running": False, "processed_count": 0}
+    return worker_pool.status()
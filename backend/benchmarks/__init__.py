@@ -0,0 +1,9 @@
+"""
+Бенчмарки движка правил и конвейера воркера.
+Запуск из каталога backend:
+
+    python -m benchmarks.run --rules 10,100,1000 --transactions 2000
+
+Redis и Postgres заменяются in-process заменителями (см. stand_ins),
+поэтому числа воспроизводимы и не зависят от окружения.
+"""
@@ -0,0 +1,150 @@
+"""
+Генераторы синтетических транзакций и наборов правил.
+Всё детерминировано seed: одинаковые аргументы дают одинаковые данные.
+"""
+import json
+import random
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from app.rules.base_rule import BaseRule
+from app.rules.composite_rule import CompositeRule
+from app.rules.ml_rule import MLRule
+from app.rules.pattern_rule import PatternRule
+from app.rules.threshold_rule import ThresholdRule
+from app.rules.velocity_rule import VelocityRule
+
+CURRENCIES = ["RUB", "USD", "EUR", "CNY", "KZT"]
+MERCHANTS = [f"merchant_{i}" for i in range(200)]
+
+# Доли типов правил в наборе по умолчанию
+DEFAULT_MIX = {"threshold": 0.7, "composite": 0.1, "pattern": 0.1, "ml": 0.1}
+
+RULE_TYPES = {
+    ThresholdRule: "threshold",
+    PatternRule: "pattern",
+    CompositeRule: "composite",
+    MLRule: "ml",
+    VelocityRule: "velocity",
+}
+
+
+def generate_transactions(count: int, seed: int = 42, accounts: int = 1000) -> List[Dict[str, Any]]:
+    """Транзакции в формате очереди воркера (id = transaction_id)"""
+    rng = random.Random(seed)
+    start = datetime(2024, 1, 1)
+    transactions = []
+    for i in range(count):
+        transaction_id = f"bench-{seed}-{i}"
+        transactions.append({
+            "id": transaction_id,
+            "transaction_id": transaction_id,
+            "amount": round(rng.lognormvariate(7.0, 1.5), 2),
+            "currency": rng.choice(CURRENCIES),
+            "merchant": rng.choice(MERCHANTS),
+            "user_id": f"user_{rng.randrange(accounts)}",
+            "from_account": f"acc_{rng.randrange(accounts)}",
+            "to_account": f"acc_{rng.randrange(accounts)}",
+            "timestamp": (start + timedelta(seconds=rng.randrange(7 * 24 * 3600))).isoformat(),
+            "description": "benchmark",
+        })
+    return transactions
+
+
+def _threshold_parameters(rng: random.Random) -> Dict[str, Any]:
+    if rng.random() < 0.8:
+        return {
+            "field": "amount",
+            "operator": rng.choice([">", ">=", "<", "<="]),
+            "value": round(rng.lognormvariate(7.0, 1.5), 2),
+            "risk_score": round(rng.uniform(0.1, 1.0), 2),
+        }
+    return {
+        "field": rng.choice(["currency", "merchant"]),
+        "operator": rng.choice(["==", "!="]),
+        "value": rng.choice(CURRENCIES + MERCHANTS[:5]),
+        "risk_score": round(rng.uniform(0.1, 1.0), 2),
+    }
+
+
+def generate_rules(
+    count: int,
+    mix: Optional[Dict[str, float]] = None,
+    seed: int = 42,
+    critical_ratio: float = 0.0
+) -> List[BaseRule]:
+    """
+    Набор из count правил с долями типов mix (threshold, composite, pattern,
+    ml, velocity). Составные правила ссылаются на уже созданные простые
+    правила — как при загрузке из БД.
+    critical_ratio — доля правил с priority=1 (останавливают оценку).
+    """
+    rng = random.Random(seed)
+    mix = mix or DEFAULT_MIX
+    total_weight = sum(mix.values())
+    counts = {kind: int(count * weight / total_weight) for kind, weight in mix.items()}
+    counts["threshold"] = counts.get("threshold", 0) + count - sum(counts.values())
+
+    registry: Dict[int, BaseRule] = {}
+    rules: List[BaseRule] = []
+    next_id = 1
+
+    def priority() -> int:
+        return 1 if rng.random() < critical_ratio else rng.randint(2, 10)
+
+    for kind in ("threshold", "pattern", "ml", "velocity"):
+        for _ in range(counts.get(kind, 0)):
+            name = f"{kind}_{next_id}"
+            if kind == "threshold":
+                rule = ThresholdRule(next_id, name, True, _threshold_parameters(rng), priority())
+            elif kind == "pattern":
+                rule = PatternRule(next_id, name, True, {
+                    "max_transactions": rng.randint(3, 50),
+                    "time_window_minutes": rng.choice([1, 5, 15, 60]),
+                }, priority())
+            elif kind == "ml":
+                rule = MLRule(next_id, name, True, {"threshold": round(rng.uniform(0.5, 0.95), 2)})
+                rule.priority = priority()
+            else:
+                rule = VelocityRule(next_id, name, True, {
+                    "time_window_minutes": rng.choice([15, 60, 1440]),
+                    "aggregates": [
+                        {"key": "from_account", "type": "sum", "field": "amount", "max": rng.randint(5000, 100000)},
+                        {"key": "user_id", "type": "distinct", "field": "merchant", "max": rng.randint(3, 30)},
+                        {"key": "merchant", "type": "distinct", "field": "user_id", "max": rng.randint(10, 200)},
+                    ],
+                }, priority())
+            registry[next_id] = rule
+            rules.append(rule)
+            next_id += 1
+
+    simple_ids = list(registry)
+    for _ in range(counts.get("composite", 0)):
+        if not simple_ids:
+            break
+        nested = rng.sample(simple_ids, min(len(simple_ids), rng.randint(2, 4)))
+        rule = CompositeRule(next_id, f"composite_{next_id}", True, {
+            "operator": rng.choice(["AND", "OR"]),
+            "rules": nested,
+        }, rules_registry=registry, priority=priority())
+        registry[next_id] = rule
+        rules.append(rule)
+        next_id += 1
+
+    return rules
+
+
+def rule_rows(rules: List[BaseRule]) -> List[Dict[str, Any]]:
+    """Строки таблицы rules для набора правил (для заменителя Postgres)"""
+    return [
+        {
+            "id": rule.rule_id,
+            "name": rule.name,
+            "type": RULE_TYPES[type(rule)],
+            "condition": json.dumps(rule.parameters),
+            "risk_score": int(float(rule.parameters.get("risk_score", 0.5)) * 100),
+            "is_active": rule.enabled,
+            "priority": rule.priority,
+        }
+        for rule in rules
+    ]
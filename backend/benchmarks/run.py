@@ -0,0 +1,300 @@
+"""
+Бенчмарк движка правил и конвейера воркера.
+
+    python -m benchmarks.run --rules 10,100,1000,10000 --transactions 2000 --json out.json
+
+Сценарии: engine (evaluate_transaction), engine_async
+(evaluate_transaction_async), batch (evaluate_batch), worker (очередь →
+оценка → сохранение). Для каждого — пропускная способность, перцентили
+латентности на транзакцию и аллокации (tracemalloc, отдельный прогон).
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+from typing import Any, Callable, Dict, List
+
+# Те же пути импорта, что и в main.py
+backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(backend_dir))
+sys.path.insert(0, backend_dir)
+
+from benchmarks.stand_ins import InMemoryRedis, configure_database, install_redis  # noqa: E402
+
+SCENARIOS = ("engine", "engine_async", "batch", "worker")
+
+
+def percentile(samples: List[float], q: float) -> float:
+    """Перцентиль по ближайшему рангу; samples отсортированы"""
+    if not samples:
+        return 0.0
+    rank = max(0, min(len(samples) - 1, int(round(q / 100.0 * len(samples))) - 1))
+    return samples[rank]
+
+
+def summarize(name: str, rules: int, latencies: List[float], wall: float) -> Dict[str, Any]:
+    latencies = sorted(latencies)
+    count = len(latencies)
+    return {
+        "scenario": name,
+        "rules": rules,
+        "transactions": count,
+        "throughput_tps": count / wall if wall > 0 else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "max_ms": latencies[-1] * 1000 if latencies else 0.0,
+    }
+
+
+def measure_allocations(run: Callable[[List[Dict[str, Any]]], Any], sample: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Пик памяти и число выделенных блоков на транзакцию на отдельном прогоне"""
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        tracemalloc.reset_peak()
+        run(sample)
+        _, peak = tracemalloc.get_traced_memory()
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+    diff = after.compare_to(before, "filename")
+    blocks = sum(stat.count_diff for stat in diff if stat.count_diff > 0)
+    retained = sum(stat.size_diff for stat in diff if stat.size_diff > 0)
+    n = max(len(sample), 1)
+    return {
+        "alloc_peak_kib": peak / 1024,
+        "retained_blocks_per_tx": blocks / n,
+        "retained_bytes_per_tx": retained / n,
+    }
+
+
+class Bench:
+    """Один прогон: набор правил, транзакции, заменители хранилищ"""
+
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.redis = InMemoryRedis()
+        install_redis(self.redis, args.velocity)
+
+        from app.db import models  # noqa: F401 — регистрирует таблицы в Base.metadata
+        from app.db.database import Base, engine
+        Base.metadata.drop_all(bind=engine)
+        Base.metadata.create_all(bind=engine)
+
+        from benchmarks.generators import generate_transactions
+        self.transactions = generate_transactions(args.transactions, seed=args.seed, accounts=args.accounts)
+        self.warmup = self.transactions[:args.warmup]
+        self.sample = self.transactions[:args.alloc_sample]
+
+    def prepare(self, rule_count: int):
+        """Загружает набор правил в движок и в заменитель БД"""
+        from app.db.database import SessionLocal
+        from app.db.models import Rule, RuleResult, Transaction
+        from app.rules.rule_engine import rule_engine
+        from benchmarks.generators import generate_rules, rule_rows
+
+        rules = generate_rules(
+            rule_count, mix=self.args.mix, seed=self.args.seed, critical_ratio=self.args.critical_ratio
+        )
+        rule_engine.load_rules(rules)
+
+        db = SessionLocal()
+        try:
+            db.query(RuleResult).delete()
+            db.query(Transaction).delete()
+            db.query(Rule).delete()
+            db.bulk_insert_mappings(Rule, rule_rows(rules))
+            db.bulk_insert_mappings(Transaction, [
+                {
+                    "transaction_id": tx["transaction_id"],
+                    "amount": tx["amount"],
+                    "currency": tx["currency"],
+                    "merchant": tx["merchant"],
+                    "user_id": tx["user_id"],
+                    "timestamp": datetime.fromisoformat(tx["timestamp"]),
+                    "description": tx["description"],
+                    "status": "received",
+                }
+                for tx in self.transactions
+            ])
+            db.commit()
+        finally:
+            db.close()
+
+    def reset(self):
+        """Одинаковое начальное состояние для каждого сценария"""
+        from app.rules.velocity_store import get_velocity_store
+        self.redis.flushall()
+        get_velocity_store().clear()
+        random.seed(self.args.seed)
+
+    # --- Сценарии: run(transactions) -> латентности по транзакциям ---
+    def run_engine(self, transactions: List[Dict[str, Any]]) -> List[float]:
+        from app.rules.rule_engine import rule_engine
+        latencies = []
+        for tx in transactions:
+            started = time.perf_counter()
+            rule_engine.evaluate_transaction(tx, lean=self.args.lean)
+            latencies.append(time.perf_counter() - started)
+        return latencies
+
+    def run_engine_async(self, transactions: List[Dict[str, Any]]) -> List[float]:
+        from app.rules.rule_engine import rule_engine
+
+        async def run():
+            latencies = []
+            for tx in transactions:
+                started = time.perf_counter()
+                await rule_engine.evaluate_transaction_async(tx, lean=self.args.lean)
+                latencies.append(time.perf_counter() - started)
+            return latencies
+
+        return asyncio.run(run())
+
+    def run_batch(self, transactions: List[Dict[str, Any]]) -> List[float]:
+        from app.rules.rule_engine import rule_engine
+        size = self.args.batch_size
+        latencies = []
+        for offset in range(0, len(transactions), size):
+            chunk = transactions[offset:offset + size]
+            started = time.perf_counter()
+            rule_engine.evaluate_batch(chunk, lean=self.args.lean)
+            latencies.extend([(time.perf_counter() - started) / len(chunk)] * len(chunk))
+        return latencies
+
+    def run_worker(self, transactions: List[Dict[str, Any]]) -> List[float]:
+        from app.db.redis import redis_client
+        from app.workers.transaction_worker import worker
+
+        async def run():
+            for tx in transactions:
+                await redis_client.push_transaction(tx)
+            latencies = []
+            self.worker_failed = 0
+            while True:
+                started = time.perf_counter()
+                batch = await redis_client.pop_transactions(self.args.batch_size, timeout=0.01)
+                if not batch:
+                    break
+                self.worker_failed += len(batch) - await worker.process_batch(batch)
+                latencies.extend([(time.perf_counter() - started) / len(batch)] * len(batch))
+            return latencies
+
+        return asyncio.run(run())
+
+    def scenario(self, name: str, rule_count: int) -> Dict[str, Any]:
+        run = getattr(self, f"run_{name}")
+        self.reset()
+        if self.warmup:
+            run(self.warmup)
+
+        self.reset()
+        started = time.perf_counter()
+        latencies = run(self.transactions)
+        wall = time.perf_counter() - started
+        result = summarize(name, rule_count, latencies, wall)
+        if name == "worker":
+            result["failed"] = self.worker_failed
+
+        if self.sample and not self.args.no_alloc:
+            self.reset()
+            result.update(measure_allocations(run, self.sample))
+        return result
+
+
+def format_table(results: List[Dict[str, Any]]) -> str:
+    columns = [
+        ("scenario", "{:<13}"), ("rules", "{:>6}"), ("throughput_tps", "{:>11.1f}"),
+        ("p50_ms", "{:>9.3f}"), ("p95_ms", "{:>9.3f}"), ("p99_ms", "{:>9.3f}"),
+        ("max_ms", "{:>9.3f}"), ("alloc_peak_kib", "{:>10.1f}"), ("retained_bytes_per_tx", "{:>10.1f}"),
+        ("failed", "{:>6}"),
+    ]
+    header = ["scenario", "rules", "tx/s", "p50 ms", "p95 ms", "p99 ms", "max ms", "peak KiB", "B/tx kept", "failed"]
+    widths = [len(fmt.format(0 if key != "scenario" else "")) for key, fmt in columns]
+    lines = ["  ".join(title.rjust(width) for title, width in zip(header, widths))]
+    for row in results:
+        cells = []
+        for (key, fmt), width in zip(columns, widths):
+            value = row.get(key)
+            cells.append(fmt.format(value) if value is not None else "-".rjust(width))
+        lines.append("  ".join(cells))
+    return "\n".join(lines)
+
+
+def parse_mix(value: str) -> Dict[str, float]:
+    mix = {}
+    for part in value.split(","):
+        kind, _, weight = part.partition("=")
+        mix[kind.strip()] = float(weight)
+    return mix
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Rule engine benchmarks")
+    parser.add_argument("--rules", default="10,100,1000", help="rule set sizes, comma separated")
+    parser.add_argument("--transactions", type=int, default=1000)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--accounts", type=int, default=1000, help="distinct from_account values")
+    parser.add_argument("--mix", type=parse_mix, help="rule type shares, e.g. threshold=0.6,velocity=0.4")
+    parser.add_argument("--critical-ratio", type=float, default=0.0, help="share of priority=1 rules")
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--warmup", type=int, default=100)
+    parser.add_argument("--alloc-sample", type=int, default=200, help="transactions traced by tracemalloc")
+    parser.add_argument("--no-alloc", action="store_true", help="skip the tracemalloc pass")
+    parser.add_argument("--velocity", choices=("redis", "memory"), default="redis",
+                        help="velocity store for pattern rules (redis = in-process Redis stand-in)")
+    parser.add_argument("--lean", action="store_true", help="evaluate with lean=True")
+    parser.add_argument("--database", help="SQLite file for the Postgres stand-in (default: temp dir)")
+    parser.add_argument("--json", help="write results to this file")
+    parser.add_argument("--verbose", action="store_true", help="keep application logging")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> List[Dict[str, Any]]:
+    args = parse_args(argv)
+    database_url = configure_database(args.database)
+    if not args.verbose:
+        # Ошибки обработки учитываются в колонке failed, а не в логе
+        logging.disable(logging.ERROR)
+
+    scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        raise SystemExit(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+
+    bench = Bench(args)
+    results = []
+    for rule_count in [int(n) for n in args.rules.split(",")]:
+        bench.prepare(rule_count)
+        for name in scenarios:
+            result = bench.scenario(name, rule_count)
+            results.append(result)
+            print(f"{name:<13} rules={rule_count:<6} {result['throughput_tps']:.1f} tx/s", file=sys.stderr)
+
+    print(format_table(results))
+    if args.json:
+        import numpy
+        report = {
+            "python": platform.python_version(),
+            "numpy": numpy.__version__,
+            "platform": platform.platform(),
+            "database": database_url,
+            "arguments": vars(args),
+            "results": results,
+        }
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,496 @@
+"""
+In-process заменители Redis и Postgres для бенчмарков.
+Redis — словарь в памяти с подмножеством команд, которые использует код
+приложения; Lua-скрипты приложения эмулируются их переводом на Python
+(_scripts). Postgres — SQLite-файл во временном каталоге (DATABASE_URL).
+configure_database нужно вызвать до первого импорта app.db.
+"""
+import os
+import tempfile
+from fnmatch import fnmatchcase
+import time
+from bisect import bisect_right, insort
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional
+
+
+def configure_database(path: Optional[str] = None) -> str:
+    """Направляет app.db.database на SQLite-файл; возвращает DATABASE_URL"""
+    if path is None:
+        path = os.path.join(tempfile.mkdtemp(prefix="rules-bench-"), "bench.db")
+    url = f"sqlite:///{path}"
+    os.environ["DATABASE_URL"] = url
+    return url
+
+
+class InMemoryRedis:
+    """
+    Синхронный заменитель redis.Redis (decode_responses=True).
+    TTL хранится как момент истечения и проверяется при обращении к ключу.
+    """
+
+    def __init__(self):
+        self._data: Dict[str, Any] = {}
+        self._expires: Dict[str, float] = {}
+
+    def _get(self, key: str, default: Any = None) -> Any:
+        expires = self._expires.get(key)
+        if expires is not None and expires <= time.monotonic():
+            self._data.pop(key, None)
+            self._expires.pop(key, None)
+        return self._data.get(key, default)
+
+    def flushall(self):
+        self._data.clear()
+        self._expires.clear()
+        return True
+
+    def ping(self):
+        return True
+
+    def close(self):
+        pass
+
+    # --- Строки и счётчики ---
+    def get(self, key: str) -> Optional[str]:
+        value = self._get(key)
+        return None if value is None else str(value)
+
+    def set(self, key: str, value: Any, ex: Optional[int] = None, px: Optional[int] = None):
+        self._data[key] = value
+        self._expires.pop(key, None)
+        if ex:
+            self.expire(key, ex)
+        if px:
+            self.pexpire(key, px)
+        return True
+
+    def exists(self, *keys: str) -> int:
+        return sum(1 for key in keys if self._get(key) is not None)
+
+    def incr(self, key: str, amount: int = 1) -> int:
+        value = int(self._get(key, 0)) + amount
+        self._data[key] = value
+        return value
+
+    def expire(self, key: str, seconds: int) -> bool:
+        if self._get(key) is None:
+            return False
+        self._expires[key] = time.monotonic() + seconds
+        return True
+
+    def incrbyfloat(self, key: str, amount: float = 1.0) -> float:
+        value = float(self._get(key, 0)) + amount
+        self._data[key] = value
+        return value
+
+    def mget(self, keys: List[str]) -> List[Optional[str]]:
+        return [self.get(key) for key in keys]
+
+    def pexpire(self, key: str, milliseconds: int) -> bool:
+        return self.expire(key, milliseconds / 1000.0)
+
+    def scan_iter(self, match: str = "*"):
+        return [key for key in list(self._data) if fnmatchcase(key, match) and self._get(key) is not None]
+
+    def delete(self, *keys: str) -> int:
+        removed = 0
+        for key in keys:
+            if self._get(key) is not None:
+                removed += 1
+            self._data.pop(key, None)
+            self._expires.pop(key, None)
+        return removed
+
+    # --- Списки (очередь транзакций) ---
+    def _list(self, key: str) -> deque:
+        value = self._get(key)
+        if value is None:
+            value = self._data[key] = deque()
+        return value
+
+    def lpush(self, key: str, *values: str) -> int:
+        items = self._list(key)
+        for value in values:
+            items.appendleft(value)
+        return len(items)
+
+    def rpush(self, key: str, *values: str) -> int:
+        items = self._list(key)
+        items.extend(values)
+        return len(items)
+
+    def lpop(self, key: str) -> Optional[str]:
+        items = self._get(key)
+        return items.popleft() if items else None
+
+    def ltrim(self, key: str, start: int, end: int) -> bool:
+        items = self._get(key)
+        if items:
+            kept = self.lrange(key, start, end)
+            items.clear()
+            items.extend(kept)
+        return True
+
+    def rpop(self, key: str, count: Optional[int] = None):
+        items = self._get(key)
+        if not items:
+            return None
+        if count is None:
+            return items.pop()
+        return [items.pop() for _ in range(min(count, len(items)))]
+
+    def brpop(self, keys: List[str], timeout: float = 0):
+        """Без ожидания: в однопоточном бенчмарке очередь никто не пополнит"""
+        for key in keys:
+            value = self.rpop(key)
+            if value is not None:
+                return key, value
+        return None
+
+    def llen(self, key: str) -> int:
+        items = self._get(key)
+        return len(items) if items else 0
+
+    def lmove(self, source: str, destination: str, src: str = "LEFT", dest: str = "RIGHT") -> Optional[str]:
+        items = self._get(source)
+        if not items:
+            return None
+        value = items.popleft() if src == "LEFT" else items.pop()
+        target = self._list(destination)
+        if dest == "LEFT":
+            target.appendleft(value)
+        else:
+            target.append(value)
+        return value
+
+    def blmove(self, source: str, destination: str, timeout: float, src: str = "LEFT", dest: str = "RIGHT"):
+        """Без ожидания, как brpop"""
+        return self.lmove(source, destination, src, dest)
+
+    def lrem(self, key: str, count: int, value: str) -> int:
+        items = self._get(key)
+        if not items:
+            return 0
+        limit = abs(count) or len(items)
+        ordered = list(items) if count >= 0 else list(reversed(items))
+        kept = []
+        removed = 0
+        for item in ordered:
+            if item == value and removed < limit:
+                removed += 1
+            else:
+                kept.append(item)
+        items.clear()
+        items.extend(kept if count >= 0 else reversed(kept))
+        return removed
+
+    def lrange(self, key: str, start: int, end: int) -> List[str]:
+        items = list(self._get(key) or ())
+        return items[start:] if end == -1 else items[start:end + 1]
+
+    # --- Множества ---
+    def sadd(self, key: str, *members: str) -> int:
+        values = self._get(key)
+        if values is None:
+            values = self._data[key] = set()
+        before = len(values)
+        values.update(members)
+        return len(values) - before
+
+    def srem(self, key: str, *members: str) -> int:
+        values = self._get(key) or set()
+        removed = len(values & set(members))
+        values.difference_update(members)
+        return removed
+
+    def smembers(self, key: str) -> set:
+        return set(self._get(key) or ())
+
+    # --- Sorted sets: список (score, member), отсортированный по score ---
+    def _zset(self, key: str) -> List:
+        value = self._get(key)
+        if value is None:
+            value = self._data[key] = []
+        return value
+
+    def zadd(self, key: str, mapping: Dict[str, float]) -> int:
+        entries = self._zset(key)
+        added = 0
+        for member, score in mapping.items():
+            existing = [entry for entry in entries if entry[1] == member]
+            for entry in existing:
+                entries.remove(entry)
+            added += not existing
+            insort(entries, (float(score), member))
+        return added
+
+    def zremrangebyscore(self, key: str, min_score: Any, max_score: Any) -> int:
+        entries = self._get(key)
+        if not entries:
+            return 0
+        low = float("-inf") if min_score == "-inf" else float(min_score)
+        high = float(max_score)
+        keep = [entry for entry in entries if not low <= entry[0] <= high]
+        removed = len(entries) - len(keep)
+        entries[:] = keep
+        return removed
+
+    def zrangebyscore(
+        self, key: str, min_score: Any, max_score: Any, start: Optional[int] = None, num: Optional[int] = None
+    ) -> List[str]:
+        low = float("-inf") if min_score == "-inf" else float(min_score)
+        high = float("inf") if max_score == "+inf" else float(max_score)
+        members = [member for score, member in self._get(key) or () if low <= score <= high]
+        return members[start:start + num] if start is not None and num is not None else members
+
+    def zrem(self, key: str, *members: str) -> int:
+        entries = self._get(key)
+        if not entries:
+            return 0
+        keep = [entry for entry in entries if entry[1] not in members]
+        removed = len(entries) - len(keep)
+        entries[:] = keep
+        return removed
+
+    def zcard(self, key: str) -> int:
+        entries = self._get(key)
+        return len(entries) if entries else 0
+
+    # --- HyperLogLog: точные множества (заменителю погрешность не нужна) ---
+    def pfadd(self, key: str, *members: str) -> int:
+        values = self._get(key)
+        if values is None:
+            values = self._data[key] = set()
+        before = len(values)
+        values.update(members)
+        return int(len(values) > before)
+
+    def pfcount(self, *keys: str) -> int:
+        union = set()
+        for key in keys:
+            union |= self._get(key) or set()
+        return len(union)
+
+    # --- Конвейер: команды копятся и выполняются по execute ---
+    def pipeline(self, transaction: bool = True) -> "_Pipeline":
+        return _Pipeline(self)
+
+    # --- Скрипты ---
+    def register_script(self, script: str) -> Callable:
+        implementation = _scripts()[script]
+
+        def call(keys: List[str] = (), args: List[Any] = (), client=None):
+            if isinstance(client, _Pipeline):
+                # Как в redis-py: в конвейере скрипт ставится в очередь
+                client._commands.append((implementation, (self, list(keys), list(args)), {}))
+                return client
+            return implementation(self, list(keys), list(args))
+
+        return call
+
+
+class _Pipeline:
+    def __init__(self, store: InMemoryRedis):
+        self._store = store
+        self._commands = []
+
+    def __getattr__(self, name: str):
+        method = getattr(self._store, name)
+
+        def queue(*args, **kwargs):
+            self._commands.append((method, args, kwargs))
+            return self
+
+        return queue
+
+    def execute(self) -> List[Any]:
+        commands, self._commands = self._commands, []
+        return [method(*args, **kwargs) for method, args, kwargs in commands]
+
+
+def _sliding_window(store: InMemoryRedis, keys: List[str], args: List[Any]) -> int:
+    """Перевод velocity_store.SLIDING_WINDOW_SCRIPT"""
+    key = keys[0]
+    now, window, member = float(args[0]), float(args[1]), args[2]
+    entries = store._zset(key)
+    # Все score в ключе — отметки времени, поэтому хватает среза
+    del entries[:bisect_right(entries, (now - window, chr(0x10FFFF)))]
+    store.zadd(key, {member: now})
+    count = store.zcard(key)
+    store.pexpire(key, window)
+    return count
+
+
+def _claim(store: InMemoryRedis, keys: List[str], args: List[Any]) -> List[str]:
+    """Перевод app.db.queue_scripts.CLAIM_SCRIPT"""
+    items = []
+    for _ in range(int(args[0])):
+        item = store.lmove(keys[0], keys[1], "RIGHT", "LEFT")
+        if item is None:
+            break
+        items.append(item)
+    store.set(keys[2], "1", px=int(args[1]))
+    return items
+
+
+def _requeue(store: InMemoryRedis, keys: List[str], args: List[Any]) -> int:
+    """Перевод app.db.queue_scripts.REQUEUE_SCRIPT"""
+    if args[1] != "1" and store.exists(keys[2]):
+        return -1
+    moved = 0
+    while store.lmove(keys[0], keys[1], "LEFT", "RIGHT") is not None:
+        moved += 1
+    store.srem(keys[3], args[0])
+    return moved
+
+
+def _claim_lanes(store: InMemoryRedis, keys: List[str], args: List[Any]) -> List[Any]:
+    """Перевод app.db.queue_scripts.LANES_CLAIM_SCRIPT"""
+    lanes = len(keys) - 3
+    limit, lease = int(args[0]), int(args[1])
+    names, quotas = args[2:2 + lanes], [int(quota) for quota in args[2 + lanes:]]
+    items: List[str] = []
+    counts = [-1] * lanes
+    drained = set()
+
+    def take(i: int, quota: int):
+        if i in drained:
+            return
+        counts[i] = max(counts[i], 0)
+        while quota > 0 and len(items) < limit:
+            item = store.rpop(keys[3 + i])
+            if item is None:
+                drained.add(i)
+                return
+            item = f"{names[i]}|{item}"
+            if lease > 0:
+                store.lpush(keys[0], item)
+            items.append(item)
+            counts[i] += 1
+            quota -= 1
+
+    for i in range(lanes):
+        if len(items) >= limit:
+            break
+        take(i, quotas[i])
+    for i in range(lanes):
+        if len(items) >= limit:
+            break
+        take(i, limit)
+    if lease > 0:
+        store.set(keys[1], "1", px=lease)
+    if len(items) < limit:
+        store.delete(keys[2])
+    return [counts, items]
+
+
+def _requeue_lanes(store: InMemoryRedis, keys: List[str], args: List[Any]) -> int:
+    """Перевод app.db.queue_scripts.REQUEUE_LANES_SCRIPT"""
+    if args[1] != "1" and store.exists(keys[1]):
+        return -1
+    lanes = dict(zip(args[2:], keys[4:]))
+    moved = 0
+    while True:
+        item = store.lpop(keys[0])
+        if item is None:
+            break
+        key = keys[-1]
+        name, separator, raw = item.partition("|")
+        if separator and not item.startswith("{"):
+            key, item = lanes.get(name, key), raw
+        store.rpush(key, item)
+        moved += 1
+    if moved:
+        store.lpush(keys[3], "1")
+    store.srem(keys[2], args[0])
+    return moved
+
+
+def _move_to_queue(store: InMemoryRedis, keys: List[str], args: List[Any]) -> List[int]:
+    """Перевод app.db.queue_scripts.MOVE_TO_QUEUE_SCRIPT (потоков заменитель не держит)"""
+    moved = []
+    for i, key in enumerate(keys[2:]):
+        member, item = args[3 + 2 * i], args[4 + 2 * i]
+        if args[0] == "zset":
+            removed = store.zrem(keys[0], member)
+        else:
+            removed = store.lrem(keys[0], -1, member)
+        if removed:
+            store.lpush(key, item)
+            if args[1] == "lanes":
+                store.lpush(keys[1], "1")
+            moved.append(i)
+    if moved and args[1] == "lanes":
+        store.ltrim(keys[1], 0, int(args[2]) - 1)
+    return moved
+
+
+def _scripts() -> Dict[str, Callable]:
+    """Lua-скрипты приложения и их эмуляции"""
+    from app.db.queue_scripts import (
+        CLAIM_SCRIPT,
+        LANES_CLAIM_SCRIPT,
+        MOVE_TO_QUEUE_SCRIPT,
+        REQUEUE_LANES_SCRIPT,
+        REQUEUE_SCRIPT,
+    )
+    from app.rules.velocity_store import SLIDING_WINDOW_SCRIPT
+    return {
+        SLIDING_WINDOW_SCRIPT: _sliding_window,
+        CLAIM_SCRIPT: _claim,
+        REQUEUE_SCRIPT: _requeue,
+        LANES_CLAIM_SCRIPT: _claim_lanes,
+        REQUEUE_LANES_SCRIPT: _requeue_lanes,
+        MOVE_TO_QUEUE_SCRIPT: _move_to_queue,
+    }
+
+
+class AsyncInMemoryRedis:
+    """Асинхронный фасад над тем же хранилищем — заменитель redis.asyncio.Redis"""
+
+    def __init__(self, store: InMemoryRedis):
+        self._store = store
+
+    def pipeline(self, transaction: bool = True) -> "_AsyncPipeline":
+        return _AsyncPipeline(self._store)
+
+    def register_script(self, script: str) -> Callable:
+        call = self._store.register_script(script)
+
+        async def call_async(keys: List[str] = (), args: List[Any] = (), client=None):
+            return call(keys, args, client)
+
+        return call_async
+
+    def __getattr__(self, name: str):
+        method = getattr(self._store, name)
+
+        async def call(*args, **kwargs):
+            return method(*args, **kwargs)
+
+        return call
+
+
+class _AsyncPipeline(_Pipeline):
+    """Конвейер асинхронного клиента: команды ставятся синхронно, execute ожидается"""
+
+    async def execute(self) -> List[Any]:
+        return super().execute()
+
+
+def install_redis(store: InMemoryRedis, velocity_backend: str = "redis"):
+    """
+    Подменяет Redis-клиенты приложения на хранилище в памяти.
+    velocity_backend=memory — velocity-правила работают с InMemoryVelocityStore.
+    """
+    from app.db import redis as redis_module
+    from app.rules.velocity_store import RedisVelocityStore, create_velocity_store, set_velocity_store
+
+    async_store = AsyncInMemoryRedis(store)
+    redis_module.set_redis(async_store, store)
+    redis_module.redis_client.redis_client = async_store
+    if velocity_backend == "redis":
+        set_velocity_store(RedisVelocityStore(store, async_store))
+    else:
+        set_velocity_store(create_velocity_store(velocity_backend))
@@ -47,17 +47,39 @@ async def lifespan(app: FastAPI):
     # Startup
     logger.info("Starting application...")
     
+    # Общий пул Redis: проверяем подключение, но без Redis API всё равно стартует
+    from app.db.redis import redis_client
+    try:
+        await redis_client.init_redis()
+    except ValueError:
+        # Redis старше, чем нужно QUEUE_MODE, — очередь не заработает
+        raise
+    except Exception as e:
+        logger.warning(f"Redis is not available at startup: {e}")
+
+    # Пул воркеров в процессе API; WORKER_ENABLED=false — оценка только в
+    # отдельных процессах (python backend/worker.py)
     # Импортируем воркер внутри функции чтобы избежать circular import
-    import asyncio
-    from app.workers.transaction_worker import start_worker
-    asyncio.create_task(start_worker())
+    from app.workers.worker_pool import start_worker
+    worker_enabled = os.getenv("WORKER_ENABLED", "true").lower() == "true"
+    if worker_enabled:
+        await start_worker()
+    else:
+        from app.workers.worker_pool import load_engine_rules
+        try:
+            load_engine_rules()
+        except Exception as e:
+            logger.warning(f"Failed to load rules at startup: {e}")
     
     yield
     
-    # Shutdown
+    # Shutdown: сначала дренаж воркеров (они ещё пишут в Redis и БД), затем пулы
     logger.info("Stopping application...")
-    from app.workers.transaction_worker import stop_worker
+    from app.workers.worker_pool import stop_worker
+    from app.db.database import close_database
     await stop_worker()
+    await redis_client.close_redis()
+    close_database()
 
 
 app = FastAPI(
@@ -91,6 +113,21 @@ async def root():
 async def health_check():
     return {"status": "healthy"}
 
+@app.get("/metrics")
+async def metrics():
+    """Метрики в формате Prometheus: правила, очередь, воркер, БД, Redis и его пулы"""
+    from fastapi.responses import Response
+    from app.core.metrics import render_metrics
+    from app.db.redis import observe_redis_pools, redis_client
+
+    # Метрики очереди (длина, выданные, ждущие повтора, DLQ) — из кэша, см. observe_queue_stats
+    await redis_client.observe_queue_stats()
+    observe_redis_pools()
+    return Response(
+        content=render_metrics(),
+        media_type="text/plain; version=0.0.4"
+    )
+
 # Админка через API + Swagger/Redoc
 @app.get("/admin")
 async def admin_info():
@@ -101,6 +138,8 @@ async def admin_info():
             "transactions_api": "/api/admin/transactions",
             "rules_api": "/api/admin/rules", 
             "analytics_api": "/api/admin/analytics",
+            "dead_letters_api": "/api/admin/dead-letters",
+            "metrics": "/metrics",
             "export_csv": "/api/export/transactions"
         }
     }
@@ -0,0 +1,103 @@
+import sys
+import os
+sys.path.append(os.path.dirname(__file__))
+os.environ["QUEUE_RETRY_BASE_MS"] = "0"
+os.environ["QUEUE_MAX_ATTEMPTS"] = "2"
+os.environ["QUEUE_VISIBILITY_TIMEOUT"] = "0.1"
+
+import asyncio
+import json
+
+import fakeredis.aioredis
+
+from app.db.redis import QUEUE_ATTEMPTS, RedisClient
+
+LANES = json.dumps([{"name": "high", "min_amount": 10000, "weight": 3}])
+
+
+def make_queue(mode: str, lanes: bool) -> RedisClient:
+    """Очередь поверх fakeredis: Lua-скрипты приложения выполняются как есть (нужен lupa)"""
+    os.environ["QUEUE_MODE"] = mode
+    os.environ["QUEUE_LANES"] = LANES if lanes else ""
+    queue = RedisClient()
+    queue.consumer_id = "worker-a"
+    queue.redis_client = fakeredis.aioredis.FakeRedis(decode_responses=True)
+    return queue
+
+
+def transactions(count: int):
+    return [{"id": f"tx_{i}", "amount": 50000.0 if i % 3 == 0 else 100.0} for i in range(count)]
+
+
+async def drain(queue: RedisClient, consumer_id=None):
+    taken = []
+    while True:
+        batch = await queue.pop_transactions(4, timeout=0.01, consumer_id=consumer_id)
+        if not batch:
+            return taken
+        taken.extend(batch)
+        await queue.ack_transactions(batch, consumer_id)
+
+
+async def main():
+    for mode in ("simple", "reliable", "stream"):
+        for lanes in (False, True):
+            label = f"{mode}{' + полосы' if lanes else ''}"
+
+            # Тест 1: каждая транзакция выдаётся один раз
+            queue = make_queue(mode, lanes)
+            for transaction in transactions(10):
+                assert await queue.push_transaction(transaction)
+            first = await queue.pop_transactions(4, timeout=0.01)
+            if lanes:
+                # Вес high — 3 из 4, полоса default добирает остаток
+                assert sum(t["amount"] > 10000 for t in first) == 3, f"{label}: план полос {first}"
+            await queue.ack_transactions(first)
+            ids = [t["id"] for t in first + await drain(queue)]
+            assert sorted(ids) == sorted(t["id"] for t in transactions(10)), f"{label}: выдано {ids}"
+            print(f"✅ {label}: 10 транзакций выданы по одному разу")
+
+            if mode != "simple":
+                # Тест 2: неподтверждённые возвращаются release_inflight, а после
+                # QUEUE_VISIBILITY_TIMEOUT — requeue_expired (reliable) или XAUTOCLAIM (stream)
+                queue = make_queue(mode, lanes)
+                for transaction in transactions(6):
+                    await queue.push_transaction(transaction)
+                taken = await queue.pop_transactions(3, timeout=0.01)
+                assert await queue.release_inflight() == 3, f"{label}: release_inflight"
+                released = await queue.pop_transactions(3, timeout=0.01)
+                assert sorted(t["id"] for t in released) == sorted(t["id"] for t in taken), \
+                    f"{label}: после release выдано {released}"
+                await queue.ack_transactions(released)
+                crashed = await queue.pop_transactions(2, timeout=0.01, consumer_id="worker-b")
+                await asyncio.sleep(queue.visibility_timeout * 1.5)
+                if mode == "reliable":
+                    assert await queue.requeue_expired() == 2, f"{label}: requeue_expired"
+                ids = [t["id"] for t in released + await drain(queue)]
+                assert sorted(ids) == sorted(t["id"] for t in transactions(6)), f"{label}: после возврата {ids}"
+                assert (await queue.get_queue_stats())["pending"] == 0, f"{label}: остались неподтверждённые"
+                print(f"✅ {label}: возврат неподтверждённых ({len(taken)} + {len(crashed)})")
+
+            # Тест 3: повтор, DLQ после QUEUE_MAX_ATTEMPTS и возврат из DLQ
+            queue = make_queue(mode, lanes)
+            await queue.push_transaction({"id": "tx_fail", "amount": 50000.0})
+            batch = await queue.pop_transactions(1, timeout=0.01)
+            assert await queue.schedule_retries([(batch[0], "db down")]) == []
+            await queue.ack_transactions(batch)
+            assert await queue.promote_retries() == 1, f"{label}: promote_retries"
+            batch = await queue.pop_transactions(1, timeout=0.01)
+            assert batch[0][QUEUE_ATTEMPTS] == 1, f"{label}: номер попытки {batch}"
+            dead = await queue.schedule_retries([(batch[0], "db down again")])
+            await queue.ack_transactions(batch)
+            assert [t["id"] for t in dead] == ["tx_fail"], f"{label}: DLQ {dead}"
+            letters = await queue.get_dead_letters()
+            assert letters["total"] == 1 and letters["items"][0]["errors"] == ["db down", "db down again"]
+            assert await queue.replay_dead_letters() == ["tx_fail"], f"{label}: replay_dead_letters"
+            replayed = await drain(queue)
+            assert [t["id"] for t in replayed] == ["tx_fail"] and QUEUE_ATTEMPTS not in replayed[0]
+            stats = await queue.get_queue_stats()
+            assert (stats["length"], stats["retrying"], stats["dead"]) == (0, 0, 0), f"{label}: {stats}"
+            print(f"✅ {label}: повтор, DLQ и возврат из DLQ")
+
+
+asyncio.run(main())
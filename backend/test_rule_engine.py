@@ -0,0 +1,94 @@
+import sys
+import os
+sys.path.append(os.path.dirname(__file__))
+os.environ.setdefault("VELOCITY_BACKEND", "memory")
+
+import asyncio
+import json
+import time
+
+from app.core.metrics import rule_degraded
+from app.rules.base_rule import BaseRule, RuleResult
+from app.rules.rule_engine import RuleEngine
+from app.rules.threshold_rule import ThresholdRule
+from benchmarks.generators import generate_transactions
+
+
+class SlowRule(BaseRule):
+    """Правило с заданным временем оценки"""
+
+    def __init__(self, rule_id: int, name: str, seconds: float, priority: int = 2, parameters=None):
+        super().__init__(rule_id, name, True, parameters, priority)
+        self.seconds = seconds
+
+    def evaluate(self, transaction):
+        time.sleep(self.seconds)
+        return RuleResult(passed=False, risk_score=0.7, details={"slept": self.seconds})
+
+
+def normalized(evaluation):
+    """Оценка без времени — для сравнения прогонов"""
+    evaluation = json.loads(json.dumps(RuleEngine.materialize(evaluation), default=str))
+    for detail in evaluation["details"]:
+        if "result" in detail:
+            detail["result"].pop("timestamp", None)
+    return json.dumps(evaluation, sort_keys=True)
+
+
+def degraded(evaluations):
+    return sum(1 for evaluation in evaluations if evaluation.get("degraded_rules"))
+
+
+def threshold_rules(count: int):
+    return [
+        ThresholdRule(100 + i, f"amount_{i}", True, {"field": "amount", "operator": ">", "value": 500 * i}, 5)
+        for i in range(count)
+    ]
+
+
+# Тест 1: TRANSACTION_TIMEOUT_MS — срок каждой транзакции, а не всей пачки.
+# Транзакция укладывается в срок, вся пачка — нет.
+transactions = generate_transactions(40, seed=3)
+engine = RuleEngine(transaction_timeout_ms=100)
+engine.load_rules([SlowRule(1, "slow", 0.004), SlowRule(2, "slow_tail", 0.001, 3)] + threshold_rules(20))
+scalar = [engine.evaluate_transaction(t) for t in transactions]
+batch = engine.evaluate_batch(transactions)
+batch_async = asyncio.run(engine.evaluate_batch_async(transactions))
+assert degraded(scalar) == 0, f"Построчно деградировало {degraded(scalar)}"
+assert degraded(batch) == 0, f"evaluate_batch: деградировало {degraded(batch)} из {len(batch)}"
+assert degraded(batch_async) == 0, f"evaluate_batch_async: деградировало {degraded(batch_async)}"
+expected = [normalized(e) for e in scalar]
+assert [normalized(e) for e in batch] == expected, "evaluate_batch расходится с evaluate_transaction"
+assert [normalized(e) for e in batch_async] == expected, "evaluate_batch_async расходится с evaluate_transaction"
+print(f"✅ Срок транзакции в пачке: {len(transactions)} транзакций без деградации, результаты совпадают")
+
+# Тест 2: транзакция не укладывается в срок — одинаковые пропуски построчно и пачкой
+engine = RuleEngine(transaction_timeout_ms=5)
+engine.load_rules([SlowRule(1, "slow", 0.01), SlowRule(2, "slow_tail", 0.001, 3)] + threshold_rules(20))
+transactions = generate_transactions(10, seed=4)
+scalar = [normalized(engine.evaluate_transaction(t)) for t in transactions]
+batch = engine.evaluate_batch(transactions)
+assert degraded(batch) == len(transactions), f"Деградировало {degraded(batch)} из {len(transactions)}"
+assert [normalized(e) for e in batch] == scalar, "Пропуски по сроку расходятся с evaluate_transaction"
+print("✅ Просроченные транзакции: правила после срока пропущены так же, как построчно")
+
+# Тест 3: синхронное правило превысило timeout_ms — результат сохранён, превышение отмечено
+evaluators = {
+    "evaluate_transaction": lambda engine, t: engine.evaluate_transaction(t),
+    "evaluate_transaction_async": lambda engine, t: asyncio.run(engine.evaluate_transaction_async(t)),
+    "evaluate_batch": lambda engine, t: engine.evaluate_batch([t])[0],
+    "evaluate_batch_async": lambda engine, t: asyncio.run(engine.evaluate_batch_async([t]))[0],
+}
+for rule_id, (label, evaluate) in enumerate(evaluators.items(), start=10):
+    engine = RuleEngine()
+    engine.load_rules([SlowRule(rule_id, f"slow_{label}", 0.005, 5, {"timeout_ms": 1})])
+    overruns = rule_degraded.labels(rule_id, f"slow_{label}", "timeout")
+    before = overruns.value
+    evaluation = evaluate(engine, {"amount": 1})
+    assert evaluation["triggered_rules"] == [f"slow_{label}"], f"{label}: результат потерян {evaluation}"
+    assert evaluation["details"][0]["timed_out"] is True, f"{label}: нет отметки {evaluation['details']}"
+    assert evaluation["degraded_rules"] == [
+        {"rule_id": rule_id, "rule_name": f"slow_{label}", "reason": "timeout"}
+    ], f"{label}: degraded_rules {evaluation.get('degraded_rules')}"
+    assert overruns.value == before + 1, f"{label}: rule_degraded_total не увеличен"
+print("✅ Превышение бюджета: результат сохранён, отмечен в details, degraded_rules и метрике")
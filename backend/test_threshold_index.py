@@ -0,0 +1,128 @@
+import sys
+import os
+sys.path.append(os.path.dirname(__file__))
+os.environ.setdefault("VELOCITY_BACKEND", "memory")
+
+import json
+import random
+
+import app.services.ml_service as ml_service
+from app.rules.columns import TransactionColumns
+from app.rules.rule_engine import RuleEngine
+from app.rules.threshold_index import ThresholdIndex
+from app.rules.threshold_rule import ThresholdRule
+from app.rules.velocity_store import get_velocity_store
+from benchmarks.generators import generate_rules, generate_transactions
+
+# ML-правило добавляет случайный шум — для сравнения прогонов он должен быть одинаковым
+ml_service.random.uniform = lambda a, b: (a + b) / 2
+
+
+def plan_of(rules):
+    return [(rule.rule_id, rule.name, rule.is_critical(), rule.evaluate, rule) for rule in rules]
+
+
+def normalized(evaluation):
+    """Оценка без времени — для сравнения прогонов"""
+    evaluation = json.loads(json.dumps(RuleEngine.materialize(evaluation), default=str))
+    for detail in evaluation["details"]:
+        if "result" in detail:
+            detail["result"].pop("timestamp", None)
+    return json.dumps(evaluation, sort_keys=True)
+
+
+def evaluate_all(rules, transactions, batch, lean=False):
+    engine = RuleEngine()
+    engine.load_rules(rules)
+    get_velocity_store().clear()
+    if batch:
+        return [normalized(e) for e in engine.evaluate_batch(transactions, lean=lean)]
+    return [normalized(engine.evaluate_transaction(t, lean=lean)) for t in transactions]
+
+
+# Тест 1: границы _RangeGroup — равные пороги, >= и >, нет поля, нечисловое значение
+rules = []
+for operator in (">", ">=", "<", "<="):
+    for threshold in (100, 100, 100.0, 250.5, -1):
+        rules.append(ThresholdRule(len(rules) + 1, f"{operator}{threshold}", True, {
+            "field": "amount", "operator": operator, "value": threshold
+        }))
+index = ThresholdIndex.build(plan_of(rules))
+edge_values = [99.99, 100, 100.0, 100.01, 250.5, -1, -1.5, 0, 10 ** 9, True, "100", None, float("nan")]
+cases = [{"amount": value} for value in edge_values] + [{}]
+
+mismatches = 0
+for transaction in cases:
+    resolved = index.resolve(transaction)
+    for position, rule in enumerate(rules):
+        if position in resolved and resolved[position] == rule.evaluate(transaction).passed:
+            mismatches += 1
+    number = isinstance(transaction.get("amount"), (int, float)) and not isinstance(transaction.get("amount"), bool)
+    if number and transaction["amount"] == transaction["amount"]:
+        assert len(resolved) == len(rules), f"Не все правила разрешены: {transaction}"
+    else:
+        assert not resolved, f"Индекс разрешил нечисловое значение: {transaction}"
+assert mismatches == 0, f"Индекс расходится с предикатом: {mismatches}"
+
+columns = TransactionColumns(cases)
+for position, (met, known) in index.resolve_columns(columns).items():
+    scalar = [index.resolve(transaction).get(position) for transaction in cases]
+    columnar = [bool(m) if k else None for m, k in zip(met.tolist(), known.tolist())]
+    assert scalar == columnar, f"Колонка расходится с resolve для правила {rules[position]}"
+print(f"✅ Границы порогов: {len(cases)} значений × {len(rules)} правил совпадают с предикатом")
+
+# Тест 2: == и != — числа, строки, bool не совпадает с 1
+rules = [
+    ThresholdRule(1, "usd", True, {"field": "currency", "operator": "==", "value": "USD"}),
+    ThresholdRule(2, "eur", True, {"field": "currency", "operator": "==", "value": "EUR"}),
+    ThresholdRule(3, "not_usd", True, {"field": "currency", "operator": "!=", "value": "USD"}),
+    ThresholdRule(4, "not_one", True, {"field": "currency", "operator": "!=", "value": 1}),
+]
+index = ThresholdIndex.build(plan_of(rules))
+for value in ("USD", "EUR", "RUB", 1, 1.0, True, None, ["USD"]):
+    transaction = {"currency": value}
+    resolved = index.resolve(transaction)
+    for position, triggered in resolved.items():
+        assert triggered != rules[position].evaluate(transaction).passed, f"{rules[position]} для {value!r}"
+print("✅ Равенство и неравенство совпадают с предикатом")
+
+# Тест 3: индекс и пакетная оценка против оценки без индекса на сгенерированных данных
+total = 0
+for mix in ({"threshold": 1}, None, {"threshold": 0.6, "composite": 0.2, "ml": 0.2}):
+    for count in (7, 60, 300):
+        rules = generate_rules(count, mix=mix, seed=count, critical_ratio=0.05)
+        transactions = generate_transactions(120, seed=count)
+        transactions[3].pop("amount")
+        transactions[5]["amount"] = "1500"
+        transactions[6]["amount"] = float("nan")
+        transactions[7]["currency"] = 5
+
+        for lean in (False, True):
+            # Порог группы больше числа правил — индекс не строится
+            min_group_size = ThresholdIndex.MIN_GROUP_SIZE
+            ThresholdIndex.MIN_GROUP_SIZE = len(rules) + 1
+            expected = evaluate_all(rules, transactions, batch=False, lean=lean)
+            ThresholdIndex.MIN_GROUP_SIZE = min_group_size
+
+            assert evaluate_all(rules, transactions, batch=False, lean=lean) == expected, \
+                f"Индекс меняет результат: mix={mix}, rules={count}, lean={lean}"
+            assert evaluate_all(rules, transactions, batch=True, lean=lean) == expected, \
+                f"evaluate_batch расходится: mix={mix}, rules={count}, lean={lean}"
+            total += len(transactions)
+print(f"✅ Индекс и evaluate_batch совпадают с построчной оценкой: {total} транзакций")
+
+# Тест 4: случайные пороги и значения, в том числе совпадающие
+rng = random.Random(7)
+for _ in range(200):
+    operator = rng.choice([">", ">=", "<", "<="])
+    thresholds = [rng.choice([1, 2, 2, 3, 5.5]) for _ in range(rng.randint(2, 8))]
+    rules = [
+        ThresholdRule(i + 1, f"r{i}", True, {"field": "amount", "operator": operator, "value": t})
+        for i, t in enumerate(thresholds)
+    ]
+    index = ThresholdIndex.build(plan_of(rules))
+    value = rng.choice([0, 1, 2, 2.0, 3, 5.5, 6])
+    resolved = index.resolve({"amount": value})
+    for position, rule in enumerate(rules):
+        assert resolved[position] != rule.evaluate({"amount": value}).passed, f"{rule} для {value}"
+print("✅ Случайные наборы порогов совпадают с предикатом")
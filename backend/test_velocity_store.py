@@ -0,0 +1,54 @@
+import sys
+import os
+sys.path.append(os.path.dirname(__file__))
+
+import math
+
+from app.rules.velocity_store import InMemoryVelocityStore, RedisVelocityStore, VelocityUpdate
+from benchmarks.stand_ins import InMemoryRedis
+
+WINDOW_MS = 60_000
+
+# Тест 1: оценка HyperLogLog в пределах трёх стандартных ошибок
+store = InMemoryVelocityStore(buckets=6, precision=10)
+error = 3 * 1.04 / math.sqrt(2 ** store.precision)
+for cardinality in (1, 10, 100, 1000, 20000):
+    store.clear()
+    estimate = 0.0
+    for i in range(cardinality):
+        estimate = store.aggregate(
+            [VelocityUpdate("merchants:user_1", "distinct", f"merchant_{i}", WINDOW_MS, 6)], 1_000
+        )[0]
+    assert abs(estimate - cardinality) <= max(1, cardinality * error), \
+        f"HLL: {cardinality} различных, оценка {estimate}"
+    print(f"✅ HLL: {cardinality} различных → оценка {estimate:.0f}")
+
+# Тест 2: повторы не увеличивают оценку, окно забывает старые значения
+store.clear()
+for i in range(50):
+    value = store.aggregate([VelocityUpdate("merchants:user_2", "distinct", "same", WINDOW_MS, 6)], 1_000 + i)[0]
+assert value == 1, f"Повторяющееся значение посчитано {value} раз"
+for i in range(300):
+    store.aggregate([VelocityUpdate("merchants:user_2", "distinct", f"m{i}", WINDOW_MS, 6)], 2_000)
+value = store.aggregate([VelocityUpdate("merchants:user_2", "distinct", "late", WINDOW_MS, 6)], 2_000 + 2 * WINDOW_MS)[0]
+assert value == 1, f"Окно не сдвинулось: {value}"
+print("✅ HLL: повторы и сдвиг окна")
+
+# Тест 3: скрипт скользящего окна (через заменитель Redis) — точный счёт,
+# хранилище в памяти отстаёт от него не больше чем на одно подокно
+redis_store = RedisVelocityStore(InMemoryRedis())
+memory_store = InMemoryVelocityStore(buckets=60)
+bucket_ms = WINDOW_MS // memory_store.buckets
+events = {}
+now_ms = 10_000_000
+for step in range(500):
+    now_ms += (step * 7919) % 1500
+    key = f"tx:acc_{step % 5}"
+    events.setdefault(key, []).append(now_ms)
+    expected = sum(1 for t in events[key] if t > now_ms - WINDOW_MS)
+    oldest_bucket = sum(1 for t in events[key] if now_ms - WINDOW_MS < t <= now_ms - WINDOW_MS + bucket_ms)
+    exact = redis_store.hit(key, now_ms, WINDOW_MS)
+    approximate = memory_store.hit(key, now_ms, WINDOW_MS)
+    assert exact == expected, f"Шаг {step}: скрипт {exact}, ожидалось {expected}"
+    assert expected - oldest_bucket <= approximate <= expected, f"Шаг {step}: память {approximate}, точно {expected}"
+print("✅ Скользящее окно: скрипт точен, хранилище в памяти — в пределах подокна")
@@ -0,0 +1,50 @@
+# backend/worker.py
+"""
+Отдельный процесс оценки транзакций: пул потребителей очереди без API.
+Масштабируется независимо от API (в API тогда WORKER_ENABLED=false).
+
+    python backend/worker.py
+
+Настройки — переменные окружения WORKER_CONSUMERS, WORKER_CONCURRENCY,
+WORKER_MODE (async|process), WORKER_PROCESSES, WORKER_BATCH_SIZE,
+WORKER_DRAIN_TIMEOUT и Redis/БД. SIGTERM/SIGINT — остановка с дренажом.
+"""
+import asyncio
+import os
+import signal
+import sys
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(current_dir))
+sys.path.insert(0, current_dir)
+
+from app.core.logging import get_logger, setup_logging
+
+logger = get_logger(__name__)
+
+
+async def main():
+    from app.db.database import close_database
+    from app.db.redis import redis_client
+    from app.workers.worker_pool import WorkerPool
+
+    pool = WorkerPool()
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stopping.set)
+
+    await redis_client.init_redis()
+    await pool.start()
+    await stopping.wait()
+
+    logger.info("Stopping worker...")
+    # Дренаж до WORKER_DRAIN_TIMEOUT, затем пулы Redis и БД
+    await pool.stop()
+    await redis_client.close_redis()
+    close_database()
+
+
+if __name__ == "__main__":
+    setup_logging()
+    asyncio.run(main())